@@ -13,16 +13,298 @@ __author__ = 'Steven J. West'
 # package imports
 import os
 import shutil
-import glob
 import sys
 import gc
+import copy
+import functools
+import itertools
+import hashlib
+import logging
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 import yaml # pyyaml library
+from ruamel.yaml import YAML # round-trip yaml - preserves comments
 from pathlib import Path
 import SimpleITK as sitk #SimpleITK-elastix package
 
  # get the module directory - to point to resources/ and other package artifacts
 BRAINREGISTER_MODULE_DIR = os.path.abspath( os.path.dirname(__file__) )
 
+ # use the libyaml C bindings for parsing/emitting YAML where pyyaml was built with them
+_YAML_LOADER = yaml.CSafeLoader if hasattr(yaml, 'CSafeLoader') else yaml.SafeLoader
+_YAML_DUMPER = yaml.CSafeDumper if hasattr(yaml, 'CSafeDumper') else yaml.SafeDumper
+
+# banners written around each register/move step - one print_and_log call
+ # emits the same rule and blank lines as the separate calls it replaces
+_BANNER_RULE = '='*72 + '\n\n'
+_BANNER_END = '\n' + _BANNER_RULE
+_BANNER_S2T = '\n\n================\nSOURCE TO TARGET\n================\n'
+_BANNER_T2S = '\n\n================\nTARGET TO SOURCE\n================\n'
+
+# sitk pixel ID for each sitk pixel type string - see ImageFilterPipeline.cast_image()
+_PIXEL_TYPE_SITK_ID = {
+    '16-bit signed integer': sitk.sitkInt16,
+    '8-bit signed integer': sitk.sitkInt8,
+    '8-bit unsigned integer': sitk.sitkUInt8,
+    '16-bit unsigned integer': sitk.sitkUInt16,
+}
+
+# unit voxel spacing - all images are registered in voxel space
+_UNIT_SPACING = (1.0, 1.0, 1.0)
+
+# zlib level for images saved in downsampled space - these are re-read by later
+ # steps, so a fast low level is used rather than the slower image IO default
+_DS_COMPRESSION_LEVEL = 1
+
+# downsampling modes - which image (if any) is downsampled, see BrainRegister._ds_mode
+_DS_NONE, _DS_SOURCE, _DS_TARGET = 0, 1, 2
+
+# transform parameter maps that move images between raw and downsampled spaces
+ # for BrainRegister._move() : (ds mode, to_ds) -> (pm attribute prefix, log label)
+_MOVE_DS_TABLE = {
+    (_DS_SOURCE, True):  ('src_tar_ds', 'source-to-downsampled'),
+    (_DS_TARGET, True):  ('tar_src_ds', 'target-to-downsampled'),
+    (_DS_SOURCE, False): ('tar_src_ds', 'downsampled-to-source'),
+    (_DS_TARGET, False): ('src_tar_ds', 'downsampled-to-target'),
+}
+
+# sitk interpolator matching each elastix FinalBSplineInterpolationOrder - for
+ # the native resampler used on the scaling parameter maps, see _ds_resample()
+_BSPLINE_ORDER_INTERPOLATOR = {
+    0: sitk.sitkNearestNeighbor,
+    1: sitk.sitkLinear,
+    3: sitk.sitkBSpline,
+}
+
+
+def _transpose_direction(direction):
+    '''
+    Transpose a 3x3 direction matrix given as 9 values - elastix parameter maps
+    store (Direction ...) column-major, SimpleITK images row-major, so this
+    converts between them in either direction
+    '''
+    return [ direction[3*j + i] for i in range(3) for j in range(3) ]
+
+
+def _pm_interpolation_order(pm):
+    '''FinalBSplineInterpolationOrder of elastix parameter map pm - elastix default is 3'''
+    return int(float( pm.get('FinalBSplineInterpolationOrder', ('3',))[0] ))
+
+
+@functools.lru_cache(maxsize=8)
+def _load_yaml_cached(path_str, mtime):
+    # mtime is part of the cache key only - an edited file is re-parsed
+    with open(path_str, 'r') as file:
+        return yaml.load(file, Loader=_YAML_LOADER)
+
+
+@functools.lru_cache(maxsize=8)
+def _readlines_cached(path_str, mtime):
+    with open(path_str, 'r') as file:
+        return tuple(file.readlines())
+
+
+def _yaml_cache_key(path, resource):
+    # packaged resources never change within a process - key on path only
+    path_str = os.path.abspath(path)
+    return path_str, (None if resource else os.path.getmtime(path_str))
+
+
+def _load_yaml(path, resource=False):
+    '''Load YAML file to dict - parsed result is cached per (path, mtime)
+
+    Parameters
+    ----------
+    path : str OR PosixPath
+        Path to the YAML file.
+    
+    resource : bool
+        Set True for files packaged in brainregister resources/ dir, which 
+        are cached on path alone.
+
+    Returns
+    -------
+    dict
+        A COPY of the cached dict, so callers are free to modify it.
+
+    '''
+    return copy.deepcopy(_load_yaml_cached(*_yaml_cache_key(path, resource)))
+
+
+def _readlines_yaml(path, resource=False):
+    '''Read YAML file to list of lines - cached as _load_yaml()'''
+    return list(_readlines_cached(*_yaml_cache_key(path, resource)))
+
+
+@functools.lru_cache(maxsize=None)
+def _relpath_cached(path_str, wd_str):
+    '''Relative path from wd_str to path_str - cached, as the same output 
+    paths are logged many times over a registration run.  Unbounded, so runs
+    with more image paths than a bounded cache holds do not evict every hit'''
+    return os.path.relpath(path_str, start=wd_str)
+
+
+# parsed elastix transform parameter files keyed on path, stored with the
+ # file mtime - shared by all BrainRegister instances, so batch runs against 
+ # one atlas parse them once.  A rewritten file REPLACES its old entry, so the
+ # cache holds at most one map per parameter file path
+_PM_CACHE = {}
+
+
+def _read_pm_cached(path):
+    '''
+    Read elastix transform parameter file - cached in _PM_CACHE
+    
+    The parameter map is cached as a plain dict, and a COPY is returned on 
+    every call : the parameter maps are edited in place (eg. for nearest 
+    neighbour annotation transforms) so callers must not share the cached map.
+    A rewritten file has a new mtime, so is re-read and replaces the stale map.
+    '''
+    path = os.fspath(path)
+    mtime = os.path.getmtime(path)
+    cached = _PM_CACHE.get(path)
+    if cached is None or cached[0] != mtime:
+        cached = ( mtime, dict( sitk.ReadParameterFile(path) ) )
+        _PM_CACHE[path] = cached
+    return dict(cached[1])
+
+
+# module resource scaling parameter file - edited per call by get_*_scaling()
+_SCALING_PM_PATH = os.path.join(BRAINREGISTER_MODULE_DIR, 'resources', 
+                                'transformix-parameter-files', '00_scaling.txt')
+
+
+# off-diagonal zeros of the scaling TransformParameters - formatted once
+_ZEROS_6DP = ('0.000000', '0.000000', '0.000000')
+
+
+def _make_scaling_pm(scale, size, image_type):
+    '''
+    Scaling transform parameter map from the 00_scaling.txt resource
+    
+    scale is a dict of x-um/y-um/z-um scale factors, size the x,y,z size of 
+    the output (FIXED) image - rounded to whole voxels - and image_type the
+    ResultImageFormat.  Returned wrapped in a list, so this works with 
+    transform_image like any other set of parameter maps.
+    '''
+    pm = _read_pm_cached(_SCALING_PM_PATH) # returns a copy to edit
+    sx, sy, sz = scale['x-um'], scale['y-um'], scale['z-um']
+    pm['TransformParameters'] = ( f"{sx:.6f}", *_ZEROS_6DP, 
+                                  f"{sy:.6f}", *_ZEROS_6DP, 
+                                  f"{sz:.6f}", *_ZEROS_6DP )
+    pm['Size'] = tuple( f"{round(s):.6f}" for s in size )
+    pm['ResultImageFormat'] = (image_type,)
+    return [pm]
+
+
+def _identity_pm(image_path, ep=None):
+    '''
+    Identity transform parameter map on the grid of the image at image_path
+    
+    Size, Origin and Direction are read from the image header with sitk, and 
+    Spacing is 1 as load_image() sets on every image before registration - so 
+    this matches the grid elastix writes for a registration to this image.  
+    The ResultImage settings are copied from elastix parameter map ep if given.
+    '''
+    reader = sitk.ImageFileReader()
+    reader.SetFileName( os.fspath(image_path) )
+    reader.ReadImageInformation()
+    pm = _read_pm_cached(_SCALING_PM_PATH) # returns a copy to edit
+    pm['TransformParameters'] = ( '1.000000', *_ZEROS_6DP, 
+                                  '1.000000', *_ZEROS_6DP, 
+                                  '1.000000', *_ZEROS_6DP )
+    pm['Size'] = tuple( f"{s:.6f}" for s in reader.GetSize() )
+    pm['Spacing'] = tuple( f"{s:.6f}" for s in _UNIT_SPACING )
+    pm['Origin'] = tuple( f"{o:.6f}" for o in reader.GetOrigin() )
+    # elastix stores Direction column-major - sitk reports it row-major
+    pm['Direction'] = tuple( f"{d:.6f}" for d in 
+                             _transpose_direction(reader.GetDirection()) )
+    if ep is not None:
+        for key in ('ResultImagePixelType', 'ResultImageFormat'):
+            if key in ep:
+                pm[key] = tuple(ep[key])
+    return pm
+
+
+def _median_filter_gpu(img, radii):
+    '''
+    Median filter img on the GPU with cuCIM - once for each radius in radii
+    
+    Each radius is the x,y,z kernel radius, as for 
+    sitk.MedianImageFilter.SetRadius().  The image is copied to the GPU once, 
+    and stays there through all the filters.  cupy and cucim are OPTIONAL : 
+    if either is not installed or the GPU cannot run the filters - no driver 
+    or device, out of memory, kernel compile or cuCIM errors - None is 
+    returned and the caller should run the sitk filters.  A GPU failure is 
+    logged as a warning on the brainregister logger.
+    '''
+    try:
+        import cupy
+        from cucim.skimage.filters import median
+    except ImportError:
+        return None
+    
+    try:
+        arr = cupy.asarray(sitk.GetArrayViewFromImage(img))
+        for radius in radii:
+            # array is in z,y,x order - footprint spans radius voxels either side,
+             # with edge voxels repeated at the border as in ITK
+            footprint = cupy.ones( tuple(2*r + 1 for r in reversed(radius)), dtype=bool )
+            arr = median(arr, footprint=footprint, mode='nearest')
+        img_f = sitk.GetImageFromArray(cupy.asnumpy(arr))
+    except Exception as e: # any GPU failure falls back to the sitk filters
+        logging.getLogger(__name__).warning(
+            'GPU median filter failed - using SimpleITK filter : ' + repr(e) )
+        return None
+    
+    img_f.CopyInformation(img)
+    return img_f
+
+
+def _write_pm_file(pm, path):
+    '''
+    Write elastix parameter map pm to path - via a temporary file in the same
+    directory, moved into place with os.replace(), so an interrupted write 
+    never leaves a truncated parameter file that looks like a finished one
+    '''
+    path = os.fspath(path)
+    tmp_path = path + '.tmp'
+    sitk.WriteParameterFile(pm, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def _same_file(path_a, path_b):
+    '''True if path_a and path_b are the same file on disk - False if either is missing'''
+    try:
+        return os.path.samefile(path_a, path_b)
+    except OSError:
+        return False
+
+
+def _prune_cache_dir(cache_dir, max_files):
+    '''
+    Remove the least recently used NRRD files in cache_dir beyond max_files
+    
+    Cache files are touched when read, so file mtime orders them by last use.
+    A max_files of 0 (or None) leaves the cache unbounded.
+    '''
+    if not max_files:
+        return
+    with os.scandir(cache_dir) as it:
+        files = [ (e.stat().st_mtime, e.path) for e in it 
+                    if e.name.endswith('.nrrd') and e.is_file() ]
+    files.sort(reverse=True) # newest first
+    for _, path in files[max_files:]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass # removed by another process - nothing to do
+
+
+def _stem(path):
+    '''File name of path without its final suffix - as Path(path).stem'''
+    return os.path.splitext(os.path.basename(path))[0]
+
 
 # example function for testing
 def version():
@@ -71,9 +353,9 @@ def create_parameters_file(sample_template_path,
         built-in brainregister allen ccf data.  This can be set to an 
         external template by the user.  NOTE: This function assumes any 
         user-defined yaml template  contains the SAME FIELDS, but has modified 
-        default values to suit the users needs.  Any comments in an external 
-        yaml parameters file will be REMOVED after parsing through this method,
-        therefore it is best to create/copy a user-defined template manually.
+        default values to suit the users needs.  Comments in an external 
+        yaml parameters file are preserved, except any attached to the 
+        parameters this method overwrites.
     
     brainregister_params_filename : str
         String representing the file name the brainregister parameters yaml file
@@ -95,12 +377,10 @@ def create_parameters_file(sample_template_path,
     print('')
     
     
-    # RESOLVE the path- remove any .. references and convert to absolute path
-    sample_template_path_res = sample_template_path.resolve()
-    
-    # Make the path into an absolute path - remove ~ and ensure absolute
-    # AND convert to STRING
-    stp = str(sample_template_path.expanduser().absolute() )
+    # RESOLVE the path ONCE - remove ~ and any .. references and convert to 
+     # absolute path - AND keep a STRING copy for reading the image header
+    stp_path = Path(sample_template_path).expanduser().resolve()
+    stp = str(stp_path)
     
     print('  reading source template image information..')
     print('')
@@ -116,45 +396,46 @@ def create_parameters_file(sample_template_path,
         sys.exit('input file not valid')
     
     # if image is valid to sitk.reader this will pass
+    spacing, size = reader.GetSpacing(), reader.GetSize()
     
     print('  creating brainregister output directory : ' + str(output_dir) )
     print('')
     # next - resolve and create output_dir
     output_dir.resolve().mkdir(parents=True, exist_ok=True)
     # this is where the brainregister_parameters.yaml file will be written
-    brainregister_params_path = Path( 
-        str(output_dir.resolve().expanduser().absolute() ) 
-        + os.path.sep
-        + brainregister_params_filename)
+    brainregister_params_path = Path( os.path.join(
+        os.fspath(output_dir.resolve().expanduser().absolute() ),
+        brainregister_params_filename) )
     
     print('  building brainregister parameters file..')
     # next - build the yaml file
     if brainregister_params_template_path == 'brainregister_params':
         # open the brainregister template from resources/ dir in brainregister package
-        # read yaml to dict
         br_params = os.path.join(
                         BRAINREGISTER_MODULE_DIR, 
                         'resources', 'brainregister_parameters.yaml')
-        with open(br_params, 'r') as file:
-            brp = yaml.safe_load(file)
-        
-        # read yaml to list - THIS CONTAINS THE COMMENTS
-        with open(br_params, 'r') as file:
-            brpf = file.readlines()
+        br_params_resource = True
     else:
-        with open(brainregister_params_template_path, 'r') as file:
-            brp = yaml.safe_load(file)
+        br_params = brainregister_params_template_path
+        br_params_resource = False
+    
+    # read yaml with round-trip loader - this KEEPS THE COMMENTS attached to
+    # the keys, so they are written back out with the modified parameters
+    yaml_rt = YAML(typ='rt')
+    yaml_rt.explicit_start = True # keep the '---' document start marker
+    yaml_rt.width = 4096 # do not wrap long parameter values
+    brp = yaml_rt.load(''.join(_readlines_yaml(br_params, br_params_resource)))
     
     brp_keys = list(brp.keys())
     
     # MODIFY PARAMETERS
     
     print('    adding template path : ' + 
-                  sample_template_path_res.stem +
-                  sample_template_path_res.suffix )
+                  stp_path.stem +
+                  stp_path.suffix )
     # set sample-template-path to stp
     brp['source-template-path'] = os.path.relpath(
-                sample_template_path_res, 
+                stp_path, 
                 output_dir.resolve().expanduser().absolute()  )
     
     brp['source-annotations-path'] = [] # set to blank, user can modify manually as needed
@@ -162,15 +443,16 @@ def create_parameters_file(sample_template_path,
     
     print('    adding image paths..')
     # get other files with same suffix as stp in parent dir
-    fn, ext = os.path.splitext(sample_template_path_res.name)
-    files = glob.glob( 
-        str( str(sample_template_path_res.parent.expanduser().absolute() ) 
-            + os.path.sep 
-            + "*" 
-            + ext) )
-    # filter to remove the current sample_template_path and extract just the name(s)
-    filenames = [Path(f).name for f in files if f != str(
-                    sample_template_path_res.expanduser().absolute()) ]
+    # single scandir pass over parent dir - avoids glob pattern matching and
+     # re-parsing every returned path string with Path()
+    target_name = stp_path.name
+    fn, ext = os.path.splitext(target_name)
+    with os.scandir(stp_path.parent) as it:
+        # filter to remove the current sample_template_path and extract just the name(s)
+         # skip hidden files, as glob did
+        filenames = [e.name for e in it 
+                        if e.name.endswith(ext) and e.name != target_name 
+                        and not e.name.startswith('.') and e.is_file() ]
     
     source_path_keys = [b for b in brp_keys if (
                                 b.startswith('source-') 
@@ -184,78 +466,35 @@ def create_parameters_file(sample_template_path,
     
     print('    adding source template image resolution..')
     
-    if any([r == 1.0 for r in reader.GetSpacing()]):
+    if any([r == 1.0 for r in spacing]):
         print('')
         print('\033[1;31m TEMPLATE RESOLUTION NOT FOUND : '+
               'Please add manually to the brainregister params file! \033[0;0m')
         print('')
     else:
-        print('      adding x-um : ' + str(reader.GetSpacing()[0]) )
-        brp['source-template-resolution']['x-um'] = reader.GetSpacing()[0]
-        print('      adding y-um : ' + str(reader.GetSpacing()[1]) )
-        brp['source-template-resolution']['y-um'] = reader.GetSpacing()[1]
-        print('      adding z-um : ' + str(reader.GetSpacing()[2]) )
-        brp['source-template-resolution']['z-um'] = reader.GetSpacing()[2]
+        print('      adding x-um : ' + str(spacing[0]) + '\n' +
+              '      adding y-um : ' + str(spacing[1]) + '\n' +
+              '      adding z-um : ' + str(spacing[2]) )
+        brp['source-template-resolution'].update(
+            {'x-um': spacing[0], 'y-um': spacing[1], 'z-um': spacing[2]} )
     
     
     print('    adding source template image size..')
     
-    print('      adding x-um : ' + str(reader.GetSize()[0]) )
-    brp['source-template-size']['x'] = reader.GetSize()[0]
-    print('      adding y-um : ' + str(reader.GetSize()[1]) )
-    brp['source-template-size']['y'] = reader.GetSize()[1]
-    print('      adding z-um : ' + str(reader.GetSize()[2]) )
-    brp['source-template-size']['z'] = reader.GetSize()[2]
+    print('      adding x-um : ' + str(size[0]) + '\n' +
+          '      adding y-um : ' + str(size[1]) + '\n' +
+          '      adding z-um : ' + str(size[2]) )
+    brp['source-template-size'].update(
+        {'x': size[0], 'y': size[1], 'z': size[2]} )
     
     
     print('    saving brainregister parameters file..')
     with open(brainregister_params_path, 'w') as file:
-        yaml.dump(brp, file, sort_keys=False)
+        yaml_rt.dump(brp, file)
     
-    # ONLY IF USING brainregister parameters yaml (as know where comments are!)
     if brainregister_params_template_path == 'brainregister_params':
-        # add COMMENTS from original file
-        with open(brainregister_params_path, 'r') as file:
-            brpf2 = file.readlines()
-        
-        # get index of sample-template-orientation 
-         # as sample-images length can VARY!
-        sil = [i for i, s in enumerate(brpf2) if 'source-template-orientation' in s]
-        
-        # get index of downsampled-to-ccf-save-images
-         # as downsampled-to-ccf-parameters-files length can VARY!
-        pfld = [i for i, s in enumerate(brpf2) if 'source-to-target-save-image-type' in s]
-        
-        # get index of ccf-to-downsampled-save-annotation
-         # as ccf-to-downsampled-parameters-files length can VARY!
-        pflc = [i for i, s in enumerate(brpf2) if 'target-to-source-save-image-type' in s]
-        
-        # concat comments and yaml lines into one list:
-        brpf3 = [ brpf[0:53] + # source- image space comments
-                  brpf2[ 0:(sil[0]+1) ] + # source- params
-                  brpf[71:87] + # target- image space comments
-                  brpf2[ (sil[0]+1):(sil[0]+3)] + # target- params
-                  brpf[89:117] + # downsampling- general comments
-                  brpf2[ (sil[0]+3):(sil[0]+6)] + # downsampling- general params
-                  brpf[120:146] + # downsampling- output comments
-                  brpf2[ (sil[0]+6):(sil[0]+11)] + # source-to-target downsampling output params
-                  brpf[151:152] + # blank line!
-                  brpf2[ (sil[0]+11):(sil[0]+16)] + # target-to-source downsampling output params
-                  brpf[157:206] + # source-to-target comments
-                  brpf2[(sil[0]+16):(pfld[0]+1)] + # source-to-target params
-                  brpf[219:268] + # target-to-source comments
-                  brpf2[ (pfld[0]+1):(pflc[0]+1)] # target-to-source params
-                                                          ]
-        brpf3 = brpf3[0] # remove the nesting of this list
-        
-        # write this OVER the current yaml
-        with open(brainregister_params_path, 'w') as file:
-            for b in brpf3:
-                file.write('%s' % b)
-        
         print('      written brainregister_parameters.yaml file : ' +
                os.path.relpath(brainregister_params_path, os.getcwd()  ) )
-        
     else:
         print('  written custom brainregister parameters yaml file', brainregister_params_template_path)
     
@@ -270,7 +509,30 @@ def create_parameters_file(sample_template_path,
 class BrainRegister(object):
     
     
-    def __init__(self, yaml_path):
+    def __init__(self, yaml_path, verbose=True):
+        
+        # verbose=False silences stdout - the log file is still written in full
+        self._verbose = verbose
+        
+        # background image writer - only set while images are processed serially
+         # in _process_ds_all(), see save_image()
+        self._save_executor = None
+        self._save_future = None
+        
+        # worker pool shared by the annotation and image downsampling loops - 
+         # created on first use, see _process_ds_all()
+        self._ds_pool = None
+        
+        # whether all src_tar / tar_src pm files exist - see *_pm_files_exist()
+        self._pm_files_exist = {}
+        
+        # prefilter pipelines by filter string - see compute_adaptive_filter()
+        self._filter_cache = {}
+        
+        # store current working directory - abspath does not stat each
+         # path component, unlike Path.resolve()
+        self.wd_str = os.path.abspath(os.getcwd())
+        self.wd = Path(self.wd_str)
         
         self.set_brainregister_parameters_filepath(yaml_path)
         self.set_brainregister_log_filepath(yaml_path)
@@ -286,7 +548,54 @@ class BrainRegister(object):
     
     def set_brainregister_log_filepath(self, yaml_path):
         self.log_path = Path( Path(self.yaml_path).absolute().parent, 'brainregister.log' )
-        open(self.log_path, 'w').close() # this creates new file and clears current contents
+        # mode 'w' creates new file and clears current contents
+        self._open_log('w')
+    
+    
+    def _open_log(self, mode):
+        
+        # log through a logger whose handlers keep the log file open - rather than
+         # reopening it for every line - and serialise lines from worker threads
+        # one logger per INSTANCE - instances logging to the same file never 
+         # remove each other's handlers, see close()
+        self._log = logging.getLogger(__name__ + '.' + str(id(self)))
+        self._log.setLevel(logging.INFO)
+        self._log.propagate = False
+        for handler in list(self._log.handlers): # left by an unclosed instance with this id
+            self._log.removeHandler(handler)
+            handler.close()
+        
+        # each line is written after a newline, as print_and_log always has
+        file_handler = logging.FileHandler(self.log_path, mode=mode)
+        file_handler.terminator = ''
+        file_handler.setFormatter(logging.Formatter('\n%(message)s'))
+        self._log.addHandler(file_handler)
+        
+        if self._verbose:
+            self._log.addHandler(logging.StreamHandler(sys.stdout))
+    
+    
+    def close(self):
+        """
+        Close the brainregister log file
+        
+        The log handlers are closed and this instance's logger discarded, so 
+        batch runs over many parameters files do not hold one open file and 
+        one logger per instance.  Called at the end of register() - any later
+        print_and_log() reopens the log file to append to it.
+
+        Returns
+        -------
+        None.
+
+        """
+        if self._log is None:
+            return
+        for handler in list(self._log.handlers):
+            self._log.removeHandler(handler)
+            handler.close()
+        logging.Logger.manager.loggerDict.pop(self._log.name, None)
+        self._log = None
     
     
     def get_brainregister_parameters_Filepath(self):
@@ -295,37 +604,39 @@ class BrainRegister(object):
     
     def register(self):
         
-        self.register_transform_highres_to_downsampled()
-        # discard from memory all images/martices not needed - just point vars to blank list!
-        garbage = gc.collect() # run garbage collection to ensure memory is freed
+        try:
+            self.register_transform_highres_to_downsampled()
+            # discard from memory all images/martices not needed - just point vars to blank list!
+            garbage = gc.collect() # run garbage collection to ensure memory is freed
         
-        self.register_source_to_target()
-        self.transform_source_to_target()
-        # discard from memory all images/martices not needed - just point vars to blank list!
-        garbage = gc.collect() # run garbage collection to ensure memory is freed
+            self.register_source_to_target()
+            self.transform_source_to_target()
+            # discard from memory all images/martices not needed - just point vars to blank list!
+            garbage = gc.collect() # run garbage collection to ensure memory is freed
         
-        self.register_target_to_source()
-        self.transform_target_to_source()
-        # discard from memory all images/martices not needed - just point vars to blank list!
-        garbage = gc.collect() # run garbage collection to ensure memory is freed
+            self.register_target_to_source()
+            self.transform_target_to_source()
+            # discard from memory all images/martices not needed - just point vars to blank list!
+            garbage = gc.collect() # run garbage collection to ensure memory is freed
         
-        self.transform_lowres_to_downsampled()
-        # discard from memory all images/martices not needed - just point vars to blank list!
-        garbage = gc.collect() # run garbage collection to ensure memory is freed
+            self.transform_lowres_to_downsampled()
+            # discard from memory all images/martices not needed - just point vars to blank list!
+            garbage = gc.collect() # run garbage collection to ensure memory is freed
         
-        self.save_target_params()
+            self.save_target_params()
+        finally:
+            # close the log file - also if registration fails
+            self.close()
         
     
     
     
     def print_and_log(self, line):
         
-        # Open a file with access mode 'a'
-        with open(self.log_path, "a") as file_object:
-            # Append 'hello' at the end of file
-            file_object.write( '\n') # insert newline first
-            file_object.write( str(line))
-        print(line)
+        if self._log is None: # closed by close() - append to the log file
+            self._open_log('a')
+        # written to the log file, and to stdout when verbose
+        self._log.info( str(line) )
     
     
     
@@ -377,25 +688,26 @@ class BrainRegister(object):
         This function must be run before any other processing can take place!
         """
         
-        # resolve path to parameters file and get the parent dir
-        yaml_path_res = Path(self.yaml_path).resolve()
-        self.brp_dir = yaml_path_res.parent
+        # resolve path to parameters file ONCE
+        yaml_path_res = Path(self.yaml_path).expanduser().resolve()
         
         # first check that yaml_path is valid and read file
-        if Path(self.yaml_path).exists() == False:
+        if not yaml_path_res.is_file():
             self.print_and_log('')
             self.print_and_log('xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx')
             self.print_and_log('')
             sys.exit('  no brainregister_params file!')
         
-        with open(self.yaml_path, 'r') as file:
-            self.brp = yaml.safe_load(file)
+        # get the parent dir
+        self.brp_dir = yaml_path_res.parent
+        self._brp_dir_str = os.fspath(self.brp_dir) # reused to build output paths
         
+        self.brp = _load_yaml(yaml_path_res)
+
         self.brp_keys = list(self.brp.keys())
         # check the resolutions have been set to something other than 0.0 (which is the default)
-        if ( (self.brp['source-template-resolution']['x-um'] == 0.0) | 
-            (self.brp['source-template-resolution']['y-um'] == 0.0) | 
-            (self.brp['source-template-resolution']['z-um'] == 0.0) ) :
+        res = self.brp['source-template-resolution']
+        if ( res['x-um'] == 0.0 or res['y-um'] == 0.0 or res['z-um'] == 0.0 ) :
             self.print_and_log('')
             self.print_and_log('\033[1;31m ERROR : ' + 
                   ' image resolution not set in brainregister_params : ' + 
@@ -417,31 +729,27 @@ class BrainRegister(object):
 
         '''
         
-        self.src_tar_dir = Path( str(self.brp_dir) 
-                       + os.path.sep
-                       + self.brp['source-to-target-output'] )
+        self.src_tar_dir = Path( os.path.join( self._brp_dir_str, 
+                       self.brp['source-to-target-output'] ) )
         
-        self.tar_src_dir = Path( str(self.brp_dir) 
-                       + os.path.sep
-                       + self.brp['target-to-source-output'] )
+        self.tar_src_dir = Path( os.path.join( self._brp_dir_str, 
+                       self.brp['target-to-source-output'] ) )
         
         # get downsampling output
         self.src_tar_ds = (self.brp['source-to-target-downsampling-output'] is not False)
         
         self.src_tar_ds_dir = None
         if self.src_tar_ds is True:
-            self.src_tar_ds_dir = Path( str(self.brp_dir) 
-                       + os.path.sep
-                       + self.brp['source-to-target-downsampling-output'] )
+            self.src_tar_ds_dir = Path( os.path.join( self._brp_dir_str, 
+                       self.brp['source-to-target-downsampling-output'] ) )
         
         
         self.tar_src_ds = (self.brp['target-to-source-downsampling-output'] is not False)
         
         self.tar_src_ds_dir = None
         if self.tar_src_ds is True:
-            self.tar_src_ds_dir = Path( str(self.brp_dir) 
-                       + os.path.sep
-                       + self.brp['target-to-source-downsampling-output'] )
+            self.tar_src_ds_dir = Path( os.path.join( self._brp_dir_str, 
+                       self.brp['target-to-source-downsampling-output'] ) )
         
         
     
@@ -459,33 +767,34 @@ class BrainRegister(object):
 
         '''
         
+        # hoist invariant dir strings, prefixes and extensions out of the path
+         # building blocks below
+        brp_dir_s = self._brp_dir_str
+        ds_dir_s = os.fspath(self.src_tar_ds_dir) if self.src_tar_ds else None
+        tar_dir_s = os.fspath(self.src_tar_dir)
+        ds_pref = self.brp['downsampling-prefix']
+        st_pref = self.brp['source-to-target-prefix']
+        ds_ext = '.' + self.brp['downsampling-save-image-type']
+        st_ext = '.' + self.brp['source-to-target-save-image-type']
+        
         self.source_template_path = Path( 
-            str(self.brp_dir) + 
-            os.path.sep + 
-            self.brp['source-template-path'] ).resolve()
+            os.path.realpath(os.path.join(brp_dir_s, self.brp['source-template-path'])) )
         
         self.source_template_path_ds = None
         if self.src_tar_ds is True:
             self.source_template_path_ds = Path( 
-                str(self.src_tar_ds_dir) + 
-                os.path.sep  + 
-                self.brp['downsampling-prefix'] + 
-                Path(os.path.basename(
-                            self.brp['source-template-path'])).stem + 
-                '.' + 
-                self.brp['downsampling-save-image-type'] )
+                os.path.join(ds_dir_s, ds_pref + 
+                _stem(self.brp['source-template-path']) + 
+                ds_ext) )
         
         
         self.source_template_path_target = Path( 
-            str(self.src_tar_dir) + 
-            os.path.sep  + 
-            self.brp['source-to-target-prefix'] + 
-            Path(os.path.basename(
-                            self.brp['source-template-path'])).stem +
-            '.' + 
-            self.brp['source-to-target-save-image-type'] )
+            os.path.join(tar_dir_s, st_pref + 
+            _stem(self.brp['source-template-path']) +
+            st_ext) )
         
         
+        # filter the source path keys once, then narrow for each use below
         source_path_keys = [b for b in self.brp_keys if (
                                     b.startswith('source-') 
                                 and b.endswith('-path') 
@@ -496,31 +805,21 @@ class BrainRegister(object):
         self.source_anno_path_ds = []
         self.source_anno_path_target = []
         
-        if ( ('source-annotations-path' in source_path_keys) and
-            (len(self.brp['source-annotations-path']) > 0) ):
+        for sap in self.brp.get('source-annotations-path') or []:
             
-            for sap in self.brp['source-annotations-path']:
-                
-                self.source_anno_path.append(  Path( 
-                    str(self.brp_dir) + 
-                    os.path.sep + sap ).resolve() )
-                
-                if self.src_tar_ds is True:
-                    self.source_anno_path_ds.append( Path( 
-                        str(self.src_tar_ds_dir) + 
-                        os.path.sep  + 
-                        self.brp['downsampling-prefix'] + 
-                        Path(os.path.basename(sap)).stem + 
-                        '.' + 
-                        self.brp['downsampling-save-image-type'] ) )
-                    
-                self.source_anno_path_target.append( Path( 
-                    str(self.src_tar_dir) + 
-                    os.path.sep  + 
-                    self.brp['source-to-target-prefix'] + 
-                    Path(os.path.basename(sap)).stem +
-                    '.' + 
-                    self.brp['source-to-target-save-image-type'] ) )
+            self.source_anno_path.append(  Path( 
+                os.path.realpath(os.path.join(brp_dir_s, sap)) ) )
+            
+            if self.src_tar_ds is True:
+                self.source_anno_path_ds.append( Path( 
+                    os.path.join(ds_dir_s, ds_pref + 
+                    _stem(sap) + 
+                    ds_ext) ) )
+            
+            self.source_anno_path_target.append( Path( 
+                os.path.join(tar_dir_s, st_pref + 
+                _stem(sap) +
+                st_ext) ) )
         
         
         # and structure trees!
@@ -528,70 +827,46 @@ class BrainRegister(object):
         self.source_tree_path_ds = []
         self.source_tree_path_target = []
         
-        if ((len(self.brp['source-structure-tree']) > 0) ):
+        for sst in self.brp.get('source-structure-tree') or []:
             
-            for sst in self.brp['source-structure-tree']:
-                
-                self.source_tree_path.append(  Path( 
-                    str(self.brp_dir) + 
-                    os.path.sep + sst ).resolve() )
-                
-                if self.src_tar_ds is True:
-                    self.source_tree_path_ds.append( Path( 
-                        str(self.src_tar_ds_dir) + 
-                        os.path.sep  + 
-                        self.brp['downsampling-prefix'] + sst ) )
-                    
-                self.source_tree_path_target.append( Path( 
-                    str(self.src_tar_dir) + 
-                    os.path.sep  + 
-                    self.brp['source-to-target-prefix'] + sst ) )
+            self.source_tree_path.append(  Path( 
+                os.path.realpath(os.path.join(brp_dir_s, sst)) ) )
+            
+            if self.src_tar_ds is True:
+                self.source_tree_path_ds.append( Path( 
+                    os.path.join(ds_dir_s, ds_pref + sst) ) )
+            
+            self.source_tree_path_target.append( Path( 
+                os.path.join(tar_dir_s, st_pref + sst) ) )
         
         
         
         # gen without template or annotation
-        source_path_keys = [b for b in self.brp_keys if (
-                                    b.startswith('source-') 
-                                and b.endswith('-path') 
-                            and not b.startswith('source-template-path')
-                            and not b.startswith('source-annotations-path') ) ]
+        source_path_keys = [b for b in source_path_keys 
+                            if not b.startswith('source-annotations-path') ]
         
-        self.source_image_paths = []
-        for s in source_path_keys:
-            if self.brp[s]: # only add if not blank
-            
-                self.source_image_paths.append(
-                    [Path( 
-                str(self.source_template_path.parent) 
-                + os.path.sep 
-                + str(sr)) for sr in self.brp[s] ]
-                     )
-                
+        stp_dir_s = os.fspath(self.source_template_path.parent)
+        # build the flat list of image paths directly - no nested lists to flatten
+        self.source_image_paths = list(itertools.chain.from_iterable(
+                    ( Path( os.path.join(stp_dir_s, str(sr))) for sr in self.brp[s] )
+                    for s in source_path_keys if self.brp[s] )) # only add if not blank
         
         self.source_image_paths_ds = []
         self.source_image_paths_target = []
-        if self.source_image_paths: # only flatten list if not empty!
-            
-            self.source_image_paths = [item for sublist in self.source_image_paths for item in sublist]
+        if self.source_image_paths:
             
             for s in self.source_image_paths:
                 if self.src_tar_ds is True:
                     self.source_image_paths_ds.append( Path( 
-                        str(self.src_tar_ds_dir) + 
-                        os.path.sep  + 
-                        self.brp['downsampling-prefix'] + 
-                        Path(os.path.basename(s)).stem +
-                        '.' + 
-                        self.brp['downsampling-save-image-type'] ) )
+                        os.path.join(ds_dir_s, ds_pref + 
+                        _stem(s) +
+                        ds_ext) ) )
                     
                 
                 self.source_image_paths_target.append( Path(
-                    str(self.src_tar_dir) + 
-                    os.path.sep  + 
-                    self.brp['source-to-target-prefix'] + 
-                    Path(os.path.basename(s)).stem +
-                    '.' + 
-                    self.brp['source-to-target-save-image-type'] ) )
+                    os.path.join(tar_dir_s, st_pref + 
+                    _stem(s) +
+                    st_ext) ) )
         
         
         # ALSO set all image instance variables to None
@@ -604,30 +879,14 @@ class BrainRegister(object):
         
         
         # create image lists, and fill with None
-        self.source_anno_img = []
-        for i in self.source_anno_path:
-            self.source_anno_img.append(None)
-            
-        self.source_anno_img_ds = []
-        for i in self.source_anno_path_ds:
-            self.source_anno_img_ds.append(None)
-        
-        self.source_anno_img_target = []
-        for i in self.source_anno_path_target:
-            self.source_anno_img_target.append(None)
-        
+        self.source_anno_img = [None] * len(self.source_anno_path)
+        self.source_anno_img_ds = [None] * len(self.source_anno_path_ds)
+        self.source_anno_img_target = [None] * len(self.source_anno_path_target)
         
-        self.source_image_imgs = []
-        for i in self.source_image_paths:
-            self.source_image_imgs.append(None)
         
-        self.source_image_imgs_ds = []
-        for i in self.source_image_paths_ds:
-            self.source_image_imgs_ds.append(None)
-        
-        self.source_image_imgs_target = []
-        for i in self.source_image_paths_target:
-            self.source_image_imgs_target.append(None)
+        self.source_image_imgs = [None] * len(self.source_image_paths)
+        self.source_image_imgs_ds = [None] * len(self.source_image_paths_ds)
+        self.source_image_imgs_target = [None] * len(self.source_image_paths_target)
         
     
     
@@ -650,16 +909,13 @@ class BrainRegister(object):
             # open the ccf params file for brainregister allen ccf
             ccf_params = os.path.join(BRAINREGISTER_MODULE_DIR, 'resources',
                                       'allen-ccf', 'ccf_parameters.yaml')
-            with open(ccf_params, 'r') as file:
-                self.ccfp = yaml.safe_load(file)
+            self.ccfp = _load_yaml(ccf_params, resource=True)
         else: # use user-defined path
-            ccf_params = str( Path( self.brp_dir, os.path.join(
-                            self.brp['target-template-path'])
-                        ).resolve() )
+            ccf_params = os.path.realpath( os.path.join(
+                            self._brp_dir_str, self.brp['target-template-path']) )
             print('brp_dir : ' + str(self.brp_dir) )
             print('target-template-path : ' + str(self.brp['target-template-path']))
-            with open( ccf_params, 'r') as file:
-                self.ccfp = yaml.safe_load( file )
+            self.ccfp = _load_yaml(ccf_params)
         
         
         self.ccfp_keys = list(self.ccfp.keys())
@@ -674,34 +930,36 @@ class BrainRegister(object):
                  '"ccf" or "target"!')
         
         
+        # hoist invariant dir strings, prefixes and extensions out of the path
+         # building blocks below
+        ccf_dir_s = os.path.dirname(ccf_params)
+        ds_dir_s = os.fspath(self.tar_src_ds_dir) if self.tar_src_ds else None
+        src_dir_s = os.fspath(self.tar_src_dir)
+        ds_pref = self.brp['downsampling-prefix']
+        ts_pref = self.brp['target-to-source-prefix']
+        ds_ext = '.' + self.brp['downsampling-save-image-type']
+        ts_ext = '.' + self.brp['target-to-source-save-image-type']
+        
         self.target_template_path = Path( 
-            os.path.dirname(ccf_params) + 
-            os.path.sep + 
-            self.ccfp[str(self.target_string+'-template-path')] ).resolve()
+            os.path.realpath(os.path.join(ccf_dir_s, 
+            self.ccfp[str(self.target_string+'-template-path')])) )
         
         
         self.target_template_path_ds = None
         if self.tar_src_ds is True:
             self.target_template_path_ds = Path( 
-                str(self.tar_src_ds_dir) + 
-                os.path.sep  + 
-                self.brp['downsampling-prefix'] + 
-                Path(os.path.basename(
-                    self.ccfp[str(self.target_string+'-template-path')])).stem + 
-                '.' + 
-                self.brp['downsampling-save-image-type'] )
+                os.path.join(ds_dir_s, ds_pref + 
+                _stem(self.ccfp[str(self.target_string+'-template-path')]) + 
+                ds_ext) )
         
         
         self.target_template_path_source = Path( 
-            str(self.tar_src_dir) + 
-            os.path.sep  + 
-            self.brp['target-to-source-prefix'] + 
-            Path(os.path.basename(
-                self.ccfp[str(self.target_string+'-template-path')])).stem +
-            '.' + 
-            self.brp['target-to-source-save-image-type'] )
+            os.path.join(src_dir_s, ts_pref + 
+            _stem(self.ccfp[str(self.target_string+'-template-path')]) +
+            ts_ext) )
         
         
+        # filter the target path keys once, then narrow for each use below
         target_path_keys = [b for b in self.ccfp_keys if (
                             b.endswith('-path') 
                     and not b.startswith(str(self.target_string+'-template-path')) 
@@ -712,29 +970,21 @@ class BrainRegister(object):
         self.target_anno_path_ds = []
         self.target_anno_path_source = []
         
-        if ((str(self.target_string+'-annotations-path') in target_path_keys) and
-            (len(self.ccfp[str(self.target_string+'-annotations-path')]) > 0) ):
+        for tap in self.ccfp.get(str(self.target_string+'-annotations-path')) or []:
             
-            for tap in self.ccfp[str(self.target_string+'-annotations-path')]:
-                
-                self.target_anno_path.append(Path( 
-                    os.path.dirname(ccf_params) + 
-                    os.path.sep + tap ).resolve() )
-                
-                if self.tar_src_ds is True:
-                    self.target_anno_path_ds.append( Path( 
-                        str(self.tar_src_ds_dir) + 
-                        os.path.sep  + 
-                        self.brp['downsampling-prefix'] + 
-                        Path(os.path.basename(tap)).stem + 
-                        '.' + self.brp['downsampling-save-image-type'] ) )
-                
-                self.target_anno_path_source.append( Path( 
-                    str(self.tar_src_dir) + 
-                    os.path.sep  + 
-                    self.brp['target-to-source-prefix'] + 
-                    Path(os.path.basename(tap)).stem +
-                    '.' + self.brp['target-to-source-save-image-type'] ) )
+            self.target_anno_path.append(Path( 
+                os.path.realpath(os.path.join(ccf_dir_s, tap)) ) )
+            
+            if self.tar_src_ds is True:
+                self.target_anno_path_ds.append( Path( 
+                    os.path.join(ds_dir_s, ds_pref + 
+                    _stem(tap) + 
+                    ds_ext) ) )
+            
+            self.target_anno_path_source.append( Path( 
+                os.path.join(src_dir_s, ts_pref + 
+                _stem(tap) +
+                ts_ext) ) )
         
         
         # and structure trees!
@@ -742,70 +992,47 @@ class BrainRegister(object):
         self.target_tree_path_ds = []
         self.target_tree_path_source = []
         
-        if ((len(self.ccfp[str(self.target_string+'-structure-tree')]) > 0) ):
+        for tap in self.ccfp.get(str(self.target_string+'-structure-tree')) or []:
             
-            for tap in self.ccfp[str(self.target_string+'-structure-tree')]:
-                    
-                    self.target_tree_path.append(Path( 
-                        os.path.dirname(ccf_params) + 
-                        os.path.sep + tap ).resolve() )
-                    
-                    if self.tar_src_ds is True:
-                        self.target_tree_path_ds.append( Path( 
-                            str(self.tar_src_ds_dir) + 
-                            os.path.sep  + 
-                            self.brp['downsampling-prefix'] + tap ) )
-                    
-                    self.target_tree_path_source.append( Path( 
-                        str(self.tar_src_dir) + 
-                        os.path.sep  + 
-                        self.brp['target-to-source-prefix'] + tap ) )
+            self.target_tree_path.append(Path( 
+                os.path.realpath(os.path.join(ccf_dir_s, tap)) ) )
+            
+            if self.tar_src_ds is True:
+                self.target_tree_path_ds.append( Path( 
+                    os.path.join(ds_dir_s, ds_pref + tap) ) )
+            
+            self.target_tree_path_source.append( Path( 
+                os.path.join(src_dir_s, ts_pref + tap) ) )
         
         
         
         
-        target_path_keys = [b for b in self.ccfp_keys if (
-                            b.endswith('-path') 
-                    and not b.startswith(str(self.target_string+'-template-path'))
-                    and not b.startswith(str(self.target_string+'-annotations-path')) 
-                                  ) ]
+        target_path_keys = [b for b in target_path_keys if 
+                    not b.startswith(str(self.target_string+'-annotations-path')) ]
         
-        self.target_image_paths = []
-        for s in target_path_keys:
-            if self.ccfp[s]: # only add if not blank
-            
-                self.target_image_paths.append(
-                    [Path( 
-                str(self.target_template_path.parent) 
-                + os.path.sep 
-                + str(s)) for s in self.ccfp[s] ]
-                     )
-                
+        ttp_dir_s = os.fspath(self.target_template_path.parent)
+        # build the flat list of image paths directly - no nested lists to flatten
+        self.target_image_paths = list(itertools.chain.from_iterable(
+                    ( Path( os.path.join(ttp_dir_s, str(t))) for t in self.ccfp[s] )
+                    for s in target_path_keys if self.ccfp[s] )) # only add if not blank
         
         self.target_image_paths_ds = []
         self.target_image_paths_source = []
-        if self.target_image_paths: # only flatten list if not empty!
-            self.target_image_paths = [item for sublist in self.target_image_paths for item in sublist]
+        if self.target_image_paths:
             
             for s in self.target_image_paths:
                 
                 if self.tar_src_ds is True:
                     
                     self.target_image_paths_ds.append( Path( 
-                        str(self.tar_src_ds_dir) + 
-                        os.path.sep  + 
-                        self.brp['downsampling-prefix'] + 
-                        Path(os.path.basename(s)).stem +
-                        '.' + 
-                        self.brp['downsampling-save-image-type'] ) )
+                        os.path.join(ds_dir_s, ds_pref + 
+                        _stem(s) +
+                        ds_ext) ) )
                 
                 self.target_image_paths_source.append( Path(
-                    str(self.tar_src_dir) + 
-                    os.path.sep  + 
-                    self.brp['target-to-source-prefix'] + 
-                    Path(os.path.basename(s)).stem +
-                    '.' + 
-                    self.brp['target-to-source-save-image-type'] ) )
+                    os.path.join(src_dir_s, ts_pref + 
+                    _stem(s) +
+                    ts_ext) ) )
         
         # ALSO set all image instance variables to None
         self.target_template_img = None
@@ -816,30 +1043,13 @@ class BrainRegister(object):
         
         
         # create image lists, and fill with None
-        self.target_anno_img = []
-        for i in self.target_anno_path:
-            self.target_anno_img.append(None)
-            
-        self.target_anno_img_ds = []
-        for i in self.target_anno_path_ds:
-            self.target_anno_img_ds.append(None)
-        
-        self.target_anno_img_source = []
-        for i in self.target_anno_path_source:
-            self.target_anno_img_source.append(None)
-        
+        self.target_anno_img = [None] * len(self.target_anno_path)
+        self.target_anno_img_ds = [None] * len(self.target_anno_path_ds)
+        self.target_anno_img_source = [None] * len(self.target_anno_path_source)
         
-        self.target_image_imgs = []
-        for i in self.target_image_paths:
-            self.target_image_imgs.append(None)
-        
-        self.target_image_imgs_ds = []
-        for i in self.target_image_paths_ds:
-            self.target_image_imgs_ds.append(None)
-        
-        self.target_image_imgs_source = []
-        for i in self.target_image_paths_source:
-            self.target_image_imgs_source.append(None)
+        self.target_image_imgs = [None] * len(self.target_image_paths)
+        self.target_image_imgs_ds = [None] * len(self.target_image_paths_ds)
+        self.target_image_imgs_source = [None] * len(self.target_image_paths_source)
         
         
     
@@ -861,85 +1071,62 @@ class BrainRegister(object):
 
         '''
         
-        self.wd = Path(os.getcwd()).resolve() # store current working directory
-        
         # paths to transformix parameter map files
         
         # source-to-target downsampled transformix params
-        if self.src_tar_ds == True: # save to ds_dir
-            self.src_tar_ds_pm_path = [ Path(os.path.join( 
-             self.src_tar_ds_dir, 
-             self.brp['source-to-target-downsampling-transform-parameter-file'] ) ) ]
+        if self.src_tar_ds is True: # save to ds_dir
+            self.src_tar_ds_pm_path = [ self.src_tar_ds_dir / 
+             self.brp['source-to-target-downsampling-transform-parameter-file'] ]
             
         else: # save to src to target dir
-            self.src_tar_ds_pm_path = [ Path(os.path.join( 
-             self.src_tar_dir, 
-             self.brp['source-to-target-downsampling-transform-parameter-file'] ) ) ]
+            self.src_tar_ds_pm_path = [ self.src_tar_dir / 
+             self.brp['source-to-target-downsampling-transform-parameter-file'] ]
         
         # source-to-target transformix params
         # applied to the source and target AFTER downsampling
-        self.src_tar_pm_paths = []
-        for pm in self.brp['source-to-target-transform-parameter-files']:
-            self.src_tar_pm_paths.append( 
-                    Path( os.path.join(self.src_tar_dir, pm ) ) )
+        self.src_tar_pm_paths = [ self.src_tar_dir / pm for pm in 
+                    self.brp['source-to-target-transform-parameter-files'] ]
         
         # target-to-source downsampled transformix params
-        if self.tar_src_ds == True: # save to ds_dir
+        if self.tar_src_ds is True: # save to ds_dir
             # source-to-downsampled
-            self.tar_src_ds_pm_path = [ Path(os.path.join( 
-             self.tar_src_ds_dir, 
-             self.brp['target-to-source-downsampling-transform-parameter-file'] ) ) ]
+            self.tar_src_ds_pm_path = [ self.tar_src_ds_dir / 
+             self.brp['target-to-source-downsampling-transform-parameter-file'] ]
         else: # save to target to src dir
-            self.tar_src_ds_pm_path = [ Path(os.path.join( 
-             self.tar_src_dir, 
-             self.brp['target-to-source-downsampling-transform-parameter-file'] ) ) ]
+            self.tar_src_ds_pm_path = [ self.tar_src_dir / 
+             self.brp['target-to-source-downsampling-transform-parameter-file'] ]
         
         # target-to-source transformix params
         # applied to the source and target AFTER downsampling
-        self.tar_src_pm_paths = []
-        for pm in self.brp['target-to-source-transform-parameter-files']:
-            self.tar_src_pm_paths.append( 
-                    Path( os.path.join(self.tar_src_dir, pm ) ) )
+        self.tar_src_pm_paths = [ self.tar_src_dir / pm for pm in 
+                    self.brp['target-to-source-transform-parameter-files'] ]
         
         
         # check params-filenames and files are of the same number
-        if (len(self.brp['target-to-source-transform-parameter-files']) != 
-            len(self.brp['target-to-source-elastix-parameter-files'])):
-            sys.exit('  ERROR - target-to-source : transform-params-filenames'+
-                 ' and parameters-files are not equal in length')
-        
-        if (len(self.brp['source-to-target-transform-parameter-files']) != 
-            len(self.brp['source-to-target-elastix-parameter-files'])):
-            sys.exit('  ERROR - source-to-target : transform-params-filenames'+
-                 ' and parameters-files are not equal in length')
+        self._check_same_len('target-to-source')
+        self._check_same_len('source-to-target')
         
         
         self.tar_src_ep = self.get_elastix_params(self.brp['target-to-source-elastix-parameter-files'])
         self.src_tar_ep = self.get_elastix_params(self.brp['source-to-target-elastix-parameter-files'])
         
         
-        # load the parameter map lists if they exist, or set to None
-        self.src_tar_ds_pm = self.load_pm_files(self.src_tar_ds_pm_path) 
-        self.tar_src_ds_pm = self.load_pm_files(self.tar_src_ds_pm_path) 
+        # parameter map lists are loaded LAZILY - set to None here, and each
+         # transform method loads the files it needs on first use
+        self.src_tar_ds_pm = None
+        self.tar_src_ds_pm = None
         
-        self.src_tar_pm = self.load_pm_files(self.src_tar_pm_paths)
-        self.tar_src_pm = self.load_pm_files(self.tar_src_pm_paths)
+        self.src_tar_pm = None
+        self.tar_src_pm = None
         
-        # create the nearest neighbour transform for any images labelled as ANNOTATION
+        # the nearest neighbour transform for any images labelled as ANNOTATION
         # eg. source-annotations-path or target-annotation-path
+         # is also created from the loaded parameter maps on first use
         self.src_tar_ds_pm_anno = None
         self.src_tar_pm_anno = None
         self.tar_src_ds_pm_anno = None
         self.tar_src_pm_anno = None
         
-        if self.source_anno_path != []:
-            self.src_tar_ds_pm_anno = self.edit_pms_nearest_neighbour(self.src_tar_ds_pm)
-            self.src_tar_pm_anno = self.edit_pms_nearest_neighbour(self.src_tar_pm)
-        
-        if self.target_anno_path != []:
-            self.tar_src_ds_pm_anno = self.edit_pms_nearest_neighbour(self.tar_src_ds_pm)
-            self.tar_src_pm_anno = self.edit_pms_nearest_neighbour(self.tar_src_pm)
-        
         
         # can load the src to tar and tar to src scale factors now
         # to compute the downsampling
@@ -957,14 +1144,50 @@ class BrainRegister(object):
         else: # source and target are same size!
             self.downsampling_img = 'none' # so do NO DOWNSAMPLING!
         
+        # relative paths written to the output target parameters file - fixed 
+         # once the source and target params are resolved
+        # annotations are annotations from the current target params
+        # PLUS any annotations from current source params
+        # brp_dir is passed as its cached str, so it is not re-coerced per path
+        brp_root = self._brp_dir_str
+        self._target_anno_relpaths = [os.path.relpath(os.fspath(p), brp_root) 
+                for p in itertools.chain(self.target_anno_path_source, 
+                                         self.source_anno_path) ]
+        # same for structure trees
+        self._target_tree_relpaths = [os.path.relpath(os.fspath(p), brp_root) 
+                for p in itertools.chain(self.target_tree_path_source, 
+                                         self.source_tree_path) ]
+        
+        # int mode for the move_* methods, so they do not compare strings per call
+        self._ds_mode = {'source': _DS_SOURCE, 'target': _DS_TARGET, 
+                         'none': _DS_NONE}[self.downsampling_img]
+        
+        # downsampling filter settings are fixed from here, so decide once if 
+         # the filter is applied - pipeline is built on first use and reused
+        self._ds_filter_enabled = (self.brp['downsampling-filter'] != 'false')
+        self.img_ds_filter_pipeline = None
+        
         # initialise bools for prefiltering
         # use to determine whether the src->tar or tar->src prefiltering has been applied
         self.src_tar_prefiltered = False
         self.tar_src_prefiltered = False
+        self._prefilter_string = None # filter string the _filt templates were made with
+    
     
     
     
     
+    def _check_same_len(self, direction):
+        '''
+        Exit if transform-parameter-files and elastix-parameter-files lists 
+        for direction ('source-to-target' or 'target-to-source') differ in length
+        '''
+        if (len(self.brp[direction + '-transform-parameter-files']) != 
+            len(self.brp[direction + '-elastix-parameter-files'])):
+            sys.exit('  ERROR - ' + direction + ' : transform-params-filenames'+
+                 ' and parameters-files are not equal in length')
+    
+    
     
     def create_output_dirs(self):
         '''
@@ -984,27 +1207,23 @@ class BrainRegister(object):
         if self.src_tar_ds is True:
             self.print_and_log('    making source-to-target downsampling dir : '+ 
                       self.get_relative_path(self.src_tar_ds_dir) )
-            if self.src_tar_ds_dir.exists() == False:
-                self.src_tar_ds_dir.mkdir(parents = True, exist_ok=True)
+            self.src_tar_ds_dir.mkdir(parents = True, exist_ok=True) # no-op if dir exists
             
         
         if self.tar_src_ds is True:
             self.print_and_log('    making source-to-target downsampling dir : '+ 
                       self.get_relative_path(self.tar_src_ds_dir) )
-            if self.tar_src_ds_dir.exists() == False:
-                self.tar_src_ds_dir.mkdir(parents = True, exist_ok=True)
+            self.tar_src_ds_dir.mkdir(parents = True, exist_ok=True) # no-op if dir exists
             
         
         
         self.print_and_log('    making source-to-target dir  : '+ 
               self.get_relative_path(self.src_tar_dir) )
-        if self.src_tar_dir.exists() == False:
-            self.src_tar_dir.mkdir(parents = True, exist_ok=True)
+        self.src_tar_dir.mkdir(parents = True, exist_ok=True) # no-op if dir exists
         
         self.print_and_log('    making target-to-source dir : '+ 
               self.get_relative_path(self.tar_src_dir) )
-        if self.tar_src_dir.exists() == False:
-            self.tar_src_dir.mkdir(parents = True, exist_ok=True)
+        self.tar_src_dir.mkdir(parents = True, exist_ok=True) # no-op if dir exists
         
         self.print_and_log('')
         
@@ -1014,10 +1233,8 @@ class BrainRegister(object):
     def save_target_params(self):
         
         # load template target_parameters.yaml from package
-        target_params_output_path = Path( 
-            str(self.brp_dir ) 
-            + os.path.sep
-            + self.brp['target-template-output'])
+        target_params_output_path = Path( os.path.join(
+            self._brp_dir_str, self.brp['target-template-output']) )
         
         self.print_and_log('  building output target parameters file..')
         
@@ -1026,38 +1243,20 @@ class BrainRegister(object):
                         BRAINREGISTER_MODULE_DIR, 
                         'resources', 'target_parameters.yaml')
         
-        # read yaml to dict
+        # read yaml ONCE, and parse to dict and split to list from memory
         with open(tar_params_path, 'r') as file:
-            tp = yaml.safe_load(file)
+            tp_raw = file.read()
+        tp = yaml.load(tp_raw, Loader=_YAML_LOADER)
         
-        # read yaml to list - THIS CONTAINS THE COMMENTS
-        with open(tar_params_path, 'r') as file:
-            tpf = file.readlines()
+        # yaml as list - THIS CONTAINS THE COMMENTS
+        tpf = tp_raw.splitlines(keepends=True)
         
         # write variables to param list
         tp['target-template-path'] = self.brp['source-template-path']
         
-        # annotations are annotations from the current target params
-        # PLUS any annotations from current source params
-        target_anno_paths = []
-        for ta in self.target_anno_path_source:
-            target_anno_paths.append(
-                os.path.relpath(ta, start=self.brp_dir))
-        for sa in self.source_anno_path:
-            target_anno_paths.append(
-                os.path.relpath(sa, start=self.brp_dir))
-        tp['target-annotations-path'] = target_anno_paths
-        
-        # annotations are annotations from the current target params
-        # PLUS any annotations from current source params
-        target_tree_paths = []
-        for ta in self.target_tree_path_source:
-            target_tree_paths.append(
-                os.path.relpath(ta, start=self.brp_dir))
-        for sa in self.source_tree_path:
-            target_tree_paths.append(
-                os.path.relpath(sa, start=self.brp_dir))
-        tp['target-structure-tree'] = target_tree_paths
+        # annotations and structure trees relative paths - from resolve_params()
+        tp['target-annotations-path'] = self._target_anno_relpaths
+        tp['target-structure-tree'] = self._target_tree_relpaths
         
         tp['target-template-resolution']['x-um'] = self.brp['source-template-resolution']['x-um']
         tp['target-template-resolution']['y-um'] = self.brp['source-template-resolution']['y-um']
@@ -1072,30 +1271,25 @@ class BrainRegister(object):
         
         # write param list to brainregister output DIR
         self.print_and_log('    saving target parameters file..')
-        with open(target_params_output_path, 'w') as file:
-            yaml.dump(tp, file, sort_keys=False)
+        # dump to string in memory - no need to write and read back the file
+        tpf2 = yaml.dump(tp, sort_keys=False, Dumper=_YAML_DUMPER).splitlines(keepends=True)
         
         # add COMMENTS from original file
-        with open(target_params_output_path, 'r') as file:
-            tpf2 = file.readlines()
-        
         # get index of sample-template-orientation 
          # as sample-images length can VARY!
-        til = [i for i, s in enumerate(tpf2) if 'target-template-resolution' in s]
+        # stop at the first match - only this index is needed
+        til0 = next(i for i, s in enumerate(tpf2) if 'target-template-resolution' in s)
         
         
-        # concat comments and yaml lines into one list:
-        tpf3 = [ tpf[0:24] + # target paths
-                  tpf2[ 0:(til[0]) ] + # source- params
-                  tpf[29:44] + # target params
-                  tpf2[ (til[0]):(til[0]+10)] # target- params
-                                                          ]
-        tpf3 = tpf3[0] # remove the nesting of this list
+        # chain comments and yaml lines - no intermediate concatenated lists
+        tpf3 = itertools.chain( tpf[0:24], # target paths
+                                tpf2[ 0:til0 ], # source- params
+                                tpf[29:44], # target params
+                                tpf2[ til0:(til0+10)] ) # target- params
         
-        # write this OVER the current yaml
+        # write the yaml with comments to file ONCE
         with open(target_params_output_path, 'w') as file:
-            for t in tpf3:
-                file.write('%s' % t)
+            file.write(''.join(tpf3))
         
         self.print_and_log('      written target_parameters.yaml file : ' +
                os.path.relpath(target_params_output_path, os.getcwd()  ) )
@@ -1119,8 +1313,7 @@ class BrainRegister(object):
             The relative path as a string.
 
         """
-        path = path.resolve()
-        return os.path.relpath(path, start=self.wd)
+        return _relpath_cached(os.fspath(path), self.wd_str)
         
     
     
@@ -1152,67 +1345,71 @@ class BrainRegister(object):
         """
         
         
-        if (self.downsampling_img == 'source'):
-            # ds source
-            self.print_and_log('')
-            self.print_and_log('source template higher resolution than target - downsampling source..')
-            self.print_and_log('')
-            self.print_and_log('')
-            self.print_and_log('=====================')
-            self.print_and_log('SOURCE TO DOWNSAMPLED')
-            self.print_and_log('=====================')
-            self.print_and_log('')
-            
-            # generate scaling param files as needed
-            self.generate_ds_scaling_param_files()
-            
-            # transform and save source template ds image as needed
-            self.transform_save_high_ds_template()
-            
-            # also transform and save source annotation images - if requested in the params file
-            self.transform_save_high_ds_anno()
-            
-            # also transform and save other source images - if requested in the params file
-            self.transform_save_high_ds_images()
-            
-            
-        elif (self.downsampling_img == 'target'):
-            
-            self.print_and_log('')
-            self.print_and_log('target template higher resolution than source - downsampling target..')
-            self.print_and_log('')
-            self.print_and_log('')
-            self.print_and_log('=====================')
-            self.print_and_log('TARGET TO DOWNSAMPLED')
-            self.print_and_log('=====================')
-            self.print_and_log('')
-            
-            # generate scaling param files as needed
-            self.generate_ds_scaling_param_files()
-            
-            # transform and save template ds image as needed
-            self.transform_save_high_ds_template()
-            
-            # also transform and save source annotation images - if requested in the params file
-            self.transform_save_high_ds_anno()
-            
-            # also transform and save other source images - if requested in the params file
-            self.transform_save_high_ds_images()
-            
-        else:
-            # no downsampling!
-            self.print_and_log('source and target template same resolution - no downsampling performed.')
+        try:
+            if (self.downsampling_img == 'source'):
+                # ds source
+                self.print_and_log('')
+                self.print_and_log('source template higher resolution than target - downsampling source..')
+                self.print_and_log('')
+                self.print_and_log('')
+                self.print_and_log('=====================')
+                self.print_and_log('SOURCE TO DOWNSAMPLED')
+                self.print_and_log('=====================')
+                self.print_and_log('')
+                
+                # generate scaling param files as needed
+                self.generate_ds_scaling_param_files()
+                
+                # transform and save source template ds image as needed
+                self.transform_save_high_ds_template()
+                
+                # also transform and save source annotation images - if requested in the params file
+                self.transform_save_high_ds_anno()
+                
+                # also transform and save other source images - if requested in the params file
+                self.transform_save_high_ds_images()
+                
+                
+            elif (self.downsampling_img == 'target'):
+                
+                self.print_and_log('')
+                self.print_and_log('target template higher resolution than source - downsampling target..')
+                self.print_and_log('')
+                self.print_and_log('')
+                self.print_and_log('=====================')
+                self.print_and_log('TARGET TO DOWNSAMPLED')
+                self.print_and_log('=====================')
+                self.print_and_log('')
+                
+                # generate scaling param files as needed
+                self.generate_ds_scaling_param_files()
+                
+                # transform and save template ds image as needed
+                self.transform_save_high_ds_template()
+                
+                # also transform and save source annotation images - if requested in the params file
+                self.transform_save_high_ds_anno()
+                
+                # also transform and save other source images - if requested in the params file
+                self.transform_save_high_ds_images()
+                
+            else:
+                # no downsampling!
+                self.print_and_log('source and target template same resolution - no downsampling performed.')
+        finally:
+            # shut the worker pool down on errors too - see _process_ds_all()
+            self._shutdown_ds_pool()
         
     
     
     
     def src_tar_ds_pm_path_exists(self):
-        return self.src_tar_ds_pm_path[0].exists()
+        return os.path.exists(os.fspath(self.src_tar_ds_pm_path[0]))
     
     
     
     def tar_src_ds_pm_path_exists(self):
-        return self.tar_src_ds_pm_path[0].exists()
+        return os.path.exists(os.fspath(self.tar_src_ds_pm_path[0]))
     
     
     
@@ -1220,23 +1417,25 @@ class BrainRegister(object):
         
         if (self.downsampling_img == 'source'):
             # save the source -> target downsampling template - if requested in params file!
-            if self.brp['source-to-target-downsampling-save-template'] == True:
-                if self.source_template_img_ds != None:
+            if self.brp['source-to-target-downsampling-save-template'] is True:
+                if self.source_template_img_ds is not None:
                     self.print_and_log('  saving source downsampled template image : ' +
                       self.get_relative_path(self.source_template_path_ds ) )
                     self.save_image(self.source_template_img_ds, 
-                                    self.source_template_path_ds)
+                                    self.source_template_path_ds, 
+                                    compression_level=_DS_COMPRESSION_LEVEL)
                 else:
                     self.print_and_log('  source template image in ds space does not exist - run get_template_ds()')
                 
             
         elif (self.downsampling_img == 'target'):
             # save the target -> source downsampling template - if requested in params file!
-            if self.brp['target-to-source-downsampling-save-template'] == True:
-                if self.target_template_img_ds != None:
+            if self.brp['target-to-source-downsampling-save-template'] is True:
+                if self.target_template_img_ds is not None:
                     self.print_and_log('  saving target downsampled template image : ' +
                       self.get_relative_path(self.target_template_path_ds ) )
-                    self.save_image(self.target_template_img_ds, self.target_template_path_ds)
+                    self.save_image(self.target_template_img_ds, self.target_template_path_ds, 
+                                    compression_level=_DS_COMPRESSION_LEVEL)
                 else:
                     self.print_and_log('  target template image in ds space does not exist - run get_template_ds()')
                 
@@ -1267,87 +1466,13 @@ class BrainRegister(object):
 
         '''
         
-        
-        if (self.downsampling_img == 'source'):
-            # img -> ds is source to ds source image space
-            
-            # apply img to ds filter first
-            if self.brp['downsampling-filter'] != 'false':
-                self.print_and_log('    running downsampling filter..')
-                self.img_ds_filter_pipeline = self.compute_adaptive_filter_img_ds()
-                img_filt = self.apply_adaptive_filter(
-                                    img, self.img_ds_filter_pipeline)
-            else:
-                img_filt = img
-            
-            # to move FROM SOURCE TO DS, need the src -> tar ds pm files
-            if self.src_tar_ds_pm == None:
-                self.print_and_log('  loading source-to-downsampled transform parameters file : ' +
-                      self.get_relative_path(self.src_tar_ds_pm_path[0] ) )
-                self.src_tar_ds_pm = self.load_pm_files(self.src_tar_ds_pm_path)
-                if self.src_tar_ds_pm == None:
-                    print("ERROR : src_tar_ds_pm files do not exist - run register() first")
-            
-            # transform all input images with transformix
-            self.print_and_log('  transforming image..')
-            self.print_and_log('    source-to-downsampled elastix pm file : ' + 
-                    self.get_relative_path(self.src_tar_ds_pm_path[0] ) )
-            self.print_and_log('')
-            self.print_and_log('========================================================================')
-            self.print_and_log('')
-            self.print_and_log('')
-            img_t = self.transform_image(img_filt, self.src_tar_ds_pm)
-            img_filt = None
-            img = None
-            garbage = gc.collect()
-            return img_t
-            
-            
-        elif (self.downsampling_img == 'target'):
-            # img -> ds is target ti ds target image space
-            
-            # apply img to ds filter first
-            if self.brp['downsampling-filter'] != 'false':
-                self.print_and_log('    running downsampling filter..')
-                self.img_ds_filter_pipeline = self.compute_adaptive_filter_img_ds()
-                img_filt = self.apply_adaptive_filter(
-                                    img, self.img_ds_filter_pipeline)
-            else:
-                img_filt = img
-            
-            # to move FROM TARGET TO DS, need the tar -> src ds pm files
-            if self.tar_src_ds_pm == None:
-                self.print_and_log('  loading target-to-downsampled transform parameters file : ' +
-                      self.get_relative_path(self.tar_src_ds_pm_path[0] ) )
-                self.tar_src_ds_pm = self.load_pm_files(self.tar_src_ds_pm_path)
-                if self.tar_src_ds_pm == None:
-                    print("ERROR : tar_src_ds_pm files do not exist - run register() first")
-            
-            # transform all input images with transformix
-            self.print_and_log('  transforming image..')
-            self.print_and_log('    target-to-downsampled elastix pm file : ' + 
-                    self.get_relative_path(self.tar_src_ds_pm_path[0] ) )
-            self.print_and_log('')
-            self.print_and_log('========================================================================')
-            self.print_and_log('')
-            self.print_and_log('')
-            img_t = self.transform_image(img_filt, self.tar_src_ds_pm)
-            img_filt = None
-            img = None
-            garbage = gc.collect()
-            return img_t
-            
-            
-        elif (self.downsampling_img == 'none'):
-            return None # cannot move as no downsampling defined!
-        
-        
-    
-    
-    
-    def move_anno_img_ds(self, img):
-        '''
-        Move annotation from raw space to downsampled image space
+        return self._move(img, to_ds=True, is_anno=False)
+    
+    
+    
+    def move_anno_img_ds(self, img):
+        '''
+        Move annotation from raw space to downsampled image space
         
         This depends which image has been downsampled (source or target).  If no 
         downsampling, this method returns None.
@@ -1367,79 +1492,8 @@ class BrainRegister(object):
 
         '''
         
-        
-        if (self.downsampling_img == 'source'):
-            # img -> ds is source to ds source image space
-            
-            # apply img to ds filter first
-            #if self.brp['downsampling-filter'] != 'false':
-            #    self.print_and_log('    running downsampling filter..')
-            #    self.img_ds_filter_pipeline = self.compute_adaptive_filter_img_ds()
-            #    img_filt = self.apply_adaptive_filter(
-            #                        img, self.img_ds_filter_pipeline)
-            #else:
-            #    img_filt = img
-            
-            # to move FROM SOURCE TO DS, need the src -> tar ds pm files
-            if self.src_tar_ds_pm_anno == None:
-                self.print_and_log('  loading source-to-downsampled transform parameters file : ' +
-                      self.get_relative_path(self.src_tar_ds_pm_path[0] ) )
-                self.src_tar_ds_pm = self.load_pm_files(self.src_tar_ds_pm_path)
-                if self.src_tar_ds_pm == None:
-                    print("ERROR : src_tar_ds_pm files do not exist - run register() first")
-                self.src_tar_ds_pm_anno = self.edit_pms_nearest_neighbour(self.src_tar_ds_pm)
-            
-            # transform all input images with transformix
-            self.print_and_log('  transforming annotation image..')
-            self.print_and_log('    source-to-downsampled elastix pm file : ' + 
-                    self.get_relative_path(self.src_tar_ds_pm_path[0] ) )
-            self.print_and_log('')
-            self.print_and_log('========================================================================')
-            self.print_and_log('')
-            self.print_and_log('')
-            anno_t = self.transform_image(img, self.src_tar_ds_pm_anno)
-            img = None
-            garbage = gc.collect()
-            return anno_t
-            
-            
-        elif (self.downsampling_img == 'target'):
-            # img -> ds is target ti ds target image space
-            
-            # apply img to ds filter first
-            #if self.brp['downsampling-filter'] != 'false':
-            #    self.print_and_log('    running downsampling filter..')
-            #    self.img_ds_filter_pipeline = self.compute_adaptive_filter_img_ds()
-            #    img_filt = self.apply_adaptive_filter(
-            #                        img, self.img_ds_filter_pipeline)
-            #else:
-            #    img_filt = img
-            
-            # to move FROM TARGET TO DS, need the tar -> src ds pm files
-            if self.tar_src_ds_pm_anno == None:
-                self.print_and_log('  loading target-to-downsampled transform parameters file : ' +
-                      self.get_relative_path(self.tar_src_ds_pm_path[0] ) )
-                self.tar_src_ds_pm = self.load_pm_files(self.tar_src_ds_pm_path)
-                if self.tar_src_ds_pm == None:
-                    print("ERROR : tar_src_ds_pm files do not exist - run register() first")
-                self.tar_src_ds_pm_anno = self.edit_pms_nearest_neighbour(self.tar_src_ds_pm)
-            
-            # transform all input images with transformix
-            self.print_and_log('  transforming annotation image..')
-            self.print_and_log('    target-to-downsampled elastix pm file : ' + 
-                    self.get_relative_path(self.tar_src_ds_pm_path[0] ) )
-            self.print_and_log('')
-            self.print_and_log('========================================================================')
-            self.print_and_log('')
-            self.print_and_log('')
-            anno_t = self.transform_image(img, self.tar_src_ds_pm_anno)
-            return anno_t
-            
-            
-        elif (self.downsampling_img == 'none'):
-            return None # cannot move as no downsampling defined!
-        
-        
+        return self._move(img, to_ds=True, is_anno=True)
+    
     
     
     def move_image_ds_img(self, img):
@@ -1461,62 +1515,7 @@ class BrainRegister(object):
 
         '''
         
-        
-        if (self.downsampling_img == 'source'):
-            # ds -> img is ds to source image space
-            
-            # to move FROM DS TO SOURCE, need the tar -> src ds pm files
-            if self.tar_src_ds_pm == None:
-                self.print_and_log('  loading downsampled-to-source transform parameters file : ' +
-                      self.get_relative_path(self.tar_src_ds_pm_path[0] ) )
-                self.tar_src_ds_pm = self.load_pm_files(self.tar_src_ds_pm_path)
-                if self.tar_src_ds_pm == None:
-                    print("ERROR : tar_src_ds_pm files do not exist - run register() first")
-            
-            # transform all input images with transformix
-            self.print_and_log('  transforming image..')
-            self.print_and_log('    downsampled-to-source elastix pm file : ' + 
-                    self.get_relative_path(self.tar_src_ds_pm_path[0] ) )
-            self.print_and_log('')
-            self.print_and_log('========================================================================')
-            self.print_and_log('')
-            self.print_and_log('')
-            img_t = self.transform_image(img, self.tar_src_ds_pm)
-            self.print_and_log('  move_image_ds_img : garbage collect input image')
-            img = None
-            garbage = gc.collect()
-            return img_t
-            
-            
-        elif (self.downsampling_img == 'target'):
-            # ds -> ims is ds to target image space
-            
-            # to move FROM DS TO TARGET, need the src -> tar ds pm files
-            if self.src_tar_ds_pm == None:
-                self.print_and_log('  loading downsampled-to-target transform parameters file : ' +
-                      self.get_relative_path(self.src_tar_ds_pm_path[0] ) )
-                self.src_tar_ds_pm = self.load_pm_files(self.src_tar_ds_pm_path)
-                if self.src_tar_ds_pm == None:
-                    print("ERROR : src_tar_ds_pm files do not exist - run register() first")
-            
-            # transform all input images with transformix
-            self.print_and_log('  transforming image..')
-            self.print_and_log('    downsampled-to-target elastix pm file : ' + 
-                    self.get_relative_path(self.src_tar_ds_pm_path[0] ) )
-            self.print_and_log('')
-            self.print_and_log('========================================================================')
-            self.print_and_log('')
-            self.print_and_log('')
-            img_t = self.transform_image(img, self.src_tar_ds_pm)
-            img = None
-            garbage = gc.collect()
-            return img_t
-            
-        
-        elif (self.downsampling_img == 'none'):
-            return None # cannot move as no downsampling defined!
-        
-        
+        return self._move(img, to_ds=False, is_anno=False)
     
     
     
@@ -1539,180 +1538,266 @@ class BrainRegister(object):
 
         '''
         
+        return self._move(img, to_ds=False, is_anno=True)
+    
+    
+    
+    def _move(self, img, to_ds, is_anno):
+        '''
+        Move image or annotation between raw and downsampled image spaces
         
-        if (self.downsampling_img == 'source'):
-            # ds -> img is ds to source image space
-            
-            # to move FROM DS TO SOURCE, need the tar -> src ds pm files
-            if self.tar_src_ds_pm_anno == None:
-                self.print_and_log('  loading target-to-downsampled transform parameters file : ' +
-                      self.get_relative_path(self.tar_src_ds_pm_path[0] ) )
-                self.tar_src_ds_pm = self.load_pm_files(self.tar_src_ds_pm_path)
-                if self.tar_src_ds_pm == None:
-                    print("ERROR : tar_src_ds_pm files do not exist - run register() first")
-                self.tar_src_ds_pm_anno = self.edit_pms_nearest_neighbour(self.tar_src_ds_pm)
-            
-            # transform all input images with transformix
-            self.print_and_log('  transforming image..')
-            self.print_and_log('    downsampled-to-source elastix pm file : ' + 
-                    self.get_relative_path(self.tar_src_ds_pm_path[0] ) )
-            self.print_and_log('')
-            self.print_and_log('========================================================================')
-            self.print_and_log('')
-            self.print_and_log('')
-            anno_t = self.transform_image(img, self.tar_src_ds_pm_anno)
-            img = None
-            garbage = gc.collect()
-            return anno_t
-            
-            
-        elif (self.downsampling_img == 'target'):
-            # ds -> ims is ds to target image space
-            
-            # to move FROM DS TO TARGET, need the src -> tar ds pm files
-            if self.src_tar_ds_pm_anno == None:
-                self.print_and_log('  loading source-to-downsampled transform parameters file : ' +
-                      self.get_relative_path(self.src_tar_ds_pm_path[0] ) )
-                self.src_tar_ds_pm = self.load_pm_files(self.src_tar_ds_pm_path)
-                if self.src_tar_ds_pm == None:
-                    print("ERROR : src_tar_ds_pm files do not exist - run register() first")
-                self.src_tar_ds_pm_anno = self.edit_pms_nearest_neighbour(self.src_tar_ds_pm)
-            
-            # transform all input images with transformix
-            self.print_and_log('  transforming image..')
-            self.print_and_log('    downsampled-to-target elastix pm file : ' + 
-                    self.get_relative_path(self.src_tar_ds_pm_path[0] ) )
-            self.print_and_log('')
-            self.print_and_log('========================================================================')
-            self.print_and_log('')
-            self.print_and_log('')
-            anno_t = self.transform_image(img, self.src_tar_ds_pm)
-            img = None
-            garbage = gc.collect()
-            return anno_t
-            
+        Shared implementation of the move_* methods : the transform parameter 
+        maps are selected from _MOVE_DS_TABLE by the downsampling mode and the
+        direction, and loaded on first use.  Only images moving TO the 
+        downsampled space are filtered first, and annotations are transformed
+        with the nearest neighbour parameter maps.
+
+        Parameters
+        ----------
+        img : SITK Image
+            Image in the raw space if to_ds, otherwise in the downsampled space.
         
-        elif (self.downsampling_img == 'none'):
+        to_ds : bool
+            Move from raw to downsampled space if True, otherwise move from 
+            downsampled to raw space.
+        
+        is_anno : bool
+            Whether img is an annotation image.
+
+        Returns
+        -------
+        None : if no downsampling, otherwise the img transformed into the 
+        appropriate image space.
+
+        '''
+        
+        if self._ds_mode == _DS_NONE:
             return None # cannot move as no downsampling defined!
         
+        prefix, label = _MOVE_DS_TABLE[(self._ds_mode, to_ds)]
+        pm_path = getattr(self, prefix + '_pm_path')
+        pm_path0_rel = self.get_relative_path(pm_path[0]) # logged below
         
+        # apply img to ds filter first - images only
+        if to_ds and not is_anno and self._ds_filter_enabled:
+            self.print_and_log('    running downsampling filter..')
+            if self.img_ds_filter_pipeline is None: # only build pipeline once
+                self.img_ds_filter_pipeline = self.compute_adaptive_filter_img_ds()
+            img = self.apply_adaptive_filter(img, self.img_ds_filter_pipeline)
+        
+        # load pm files on first use - and nearest neighbour pms for annotations
+        pm = getattr(self, prefix + ('_pm_anno' if is_anno else '_pm') )
+        if pm is None:
+            self.print_and_log('  loading ' + label + ' transform parameters file : ' +
+                  pm_path0_rel )
+            pm = self.load_pm_files(pm_path)
+            if pm is None:
+                print("ERROR : " + prefix + "_pm files do not exist - run register() first")
+            setattr(self, prefix + '_pm', pm)
+            if is_anno:
+                pm = self.edit_pms_nearest_neighbour(pm)
+                setattr(self, prefix + '_pm_anno', pm)
+        
+        # transform all input images with transformix
+        if is_anno:
+            self.print_and_log('  transforming annotation image..')
+        else:
+            self.print_and_log('  transforming image..')
+        self.print_and_log('    ' + label + ' elastix pm file : ' + pm_path0_rel )
+        self.print_and_log(_BANNER_END)
+        img_t = self.transform_image(img, pm, scaling=True)
+        img = None
+        garbage = gc.collect()
+        return img_t
+    
     
     
     
-    def get_template_ds(self):
+    def _template_ds_cache_path(self, template_path, pm_list):
+        """
+        Path to the cached downsampled copy of template_path under pm_list
         
-        if (self.downsampling_img == 'source'):
-            # template_ds is source_template_ds!
-            
-            if self.source_template_path_ds.exists() == False: # only transform if the output does not exist
-                
-                if self.source_template_img_ds == None: # and if the output image is not already loaded!
-                    # TRANSFORM : will transform sample template to ds space
-                    
-                    if self.source_template_img == None:
-                        self.print_and_log('  loading source template image : ' + 
-                          self.get_relative_path(self.source_template_path) )
-                        self.source_template_img = self.load_image(self.source_template_path)
-                    
-                    
-                    if self.src_tar_ds_pm == None:
-                        self.print_and_log('  loading source-to-downsampled transform parameters file : ' +
-                              self.get_relative_path(self.src_tar_ds_pm_path[0] ) )
-                        self.src_tar_ds_pm = self.load_pm_files(self.src_tar_ds_pm_path)
-                        if self.src_tar_ds_pm == None:
-                            print("ERROR : src_tar_ds_pm files do not exist - run register() first")
-                    
-                    
-                    # apply downsampling filter - if requested in brp
-                    if self.brp['downsampling-filter'] != 'false':
-                        self.print_and_log('  running source to downsampled filter..')
-                        self.img_ds_filter_pipeline = self.compute_adaptive_filter_img_ds()
-                        self.source_template_img = self.apply_adaptive_filter(
-                                                    self.source_template_img, 
-                                                    self.img_ds_filter_pipeline)
-                    
-                    # transform all input images with transformix
-                    self.print_and_log('  transforming source template image..')
-                    self.print_and_log('    image : ' + 
-                            self.get_relative_path(self.source_template_path) )
-                    self.print_and_log('    source-to-downsampled elastix pm file : ' + 
-                            self.get_relative_path(self.src_tar_ds_pm_path[0] ) )
-                    self.print_and_log('')
-                    self.print_and_log('========================================================================')
-                    self.print_and_log('')
-                    self.print_and_log('')
-                    img = self.transform_image(self.source_template_img, 
-                                         self.src_tar_ds_pm)
-                    self.source_template_img = None
-                    garbage = gc.collect()
-                    return img
-                    
-                else:
-                    self.print_and_log('  downsampled source template image exists : returning image' )
-                    return self.source_template_img_ds
-            
-            else:
-                self.print_and_log('  downsampled source template image exists - loading image..')
-                return self.load_image(self.source_template_path_ds)
-                #return self.source_template_img_ds
-            
-            
-        if (self.downsampling_img == 'target'):
-            # template_ds is target_template_ds!
-            
-            if self.target_template_path_ds.exists() == False: # only transform if the output does not exist
-                
-                if self.target_template_img_ds == None: # and if the output image is not already loaded!
-                    # TRANSFORM : will transform sample template to ds space
-                    
-                    if self.target_template_img == None:
-                        self.print_and_log('  loading target template image : ' + 
-                          self.get_relative_path(self.target_template_path) )
-                        self.target_template_img = self.load_image(self.target_template_path)
-                    
-                    
-                    if self.tar_src_ds_pm == None:
-                        self.print_and_log('  loading target-to-downsampled transform parameters file : ' +
-                              self.get_relative_path(self.tar_src_ds_pm_path[0] ) )
-                        self.tar_src_ds_pm = self.load_pm_files(self.tar_src_ds_pm_path)
-                        if self.tar_src_ds_pm == None:
-                            print("ERROR : tar_src_ds_pm files do not exist - run register() first")
-                    
-                    
-                    # apply downsampling filter - if requested in brp
-                    if self.brp['downsampling-filter'] != 'false':
-                        self.print_and_log('  running target to downsampled filter..')
-                        self.img_ds_filter_pipeline = self.compute_adaptive_filter_img_ds()
-                        self.target_template_img = self.apply_adaptive_filter(
-                                                    self.target_template_img, 
-                                                    self.img_ds_filter_pipeline)
-                    
-                    # transform all input images with transformix
-                    self.print_and_log('  transforming target template image..')
-                    self.print_and_log('    image : ' + 
-                            self.get_relative_path(self.target_template_path) )
-                    self.print_and_log('    target-to-downsampled elastix pm file : ' + 
-                            self.get_relative_path(self.tar_src_ds_pm_path[0] ) )
-                    self.print_and_log('')
-                    self.print_and_log('========================================================================')
-                    self.print_and_log('')
-                    self.print_and_log('')
-                    img = self.transform_image(self.target_template_img,
-                                         self.tar_src_ds_pm)
-                    self.target_template_img = None
-                    garbage = gc.collect()
-                    return img
-                    
-                else:
-                    self.print_and_log('  downsampled target template image exists : returning image' )
-                    return self.target_template_img_ds
-            
-            else:
-                self.print_and_log('  downsampled target template image exists - loading image..')
-                return self.load_image(self.target_template_path_ds)
-                #return self.target_template_img_ds
-            
+        Only used when the optional brp key template-cache-dir is set.  The 
+        file name is a hash of the template file (path, mtime, size), the 
+        parameter maps - which hold the downsampling resolution and size - and
+        the downsampling-filter settings, so a change to any of these gives a 
+        new cache file.
+
+        Returns
+        -------
+        str or None
+            Path to the cache NRRD file, or None if caching is not enabled.
+
+        """
+        cache_dir = self.brp.get('template-cache-dir')
+        if not cache_dir or pm_list is None:
+            return None
         
+        st = os.stat(template_path)
+        key = repr( (os.fspath(template_path), st.st_mtime_ns, st.st_size, 
+                     [sorted(pm.items()) for pm in pm_list], 
+                     self.brp['downsampling-filter'], 
+                     bool(self.brp.get('downsampling-filter-gpu')) ) )
+        return self._cache_file_path(cache_dir, key)
+    
+    
+    
+    def _template_filt_cache_path(self, kind, filter_string, pipeline):
+        """
+        Path to the cached copy of the kind template prefiltered with pipeline
+        
+        Only used when the optional brp key template-cache-dir is set.  The 
+        file name is a hash of the template file (path, mtime, size) - and for
+        a downsampled template, of the downsampling pm file and filter 
+        settings too - the filter string, and the filters and kernels it 
+        resolves to in pipeline with prefilter-gpu, so a change to any of 
+        these gives a new cache file.
+
+        Returns
+        -------
+        str or None
+            Path to the cache NRRD file, or None if caching is not enabled.
+
+        """
+        cache_dir = self.brp.get('template-cache-dir')
+        if not cache_dir:
+            return None
+        
+        files = [ getattr(self, kind + '_template_path') ]
+        ds_filter = None
+        if self.downsampling_img == kind: # template is filtered in downsampled space
+            prefix, _ = _MOVE_DS_TABLE[(self._ds_mode, True)]
+            files.append( getattr(self, prefix + '_pm_path')[0] )
+            ds_filter = ( self.brp['downsampling-filter'], 
+                          bool(self.brp.get('downsampling-filter-gpu')) )
+        
+        stats = []
+        for f in files:
+            st = os.stat(f)
+            stats.append( (os.fspath(f), st.st_mtime_ns, st.st_size) )
+        # the parsed pipeline - a named filter (eg. brainregister:autofl-filter)
+         # is keyed on the filters it resolves to, not just its name
+        prefilter = ( filter_string, list(pipeline.img_filter_name), 
+                      list(pipeline.img_filter_kernel), pipeline.use_gpu )
+        key = repr( (stats, ds_filter, prefilter) )
+        return self._cache_file_path(cache_dir, key)
+    
+    
+    
+    def _cache_file_path(self, cache_dir, key):
+        # cache NRRD file in cache_dir named by the hash of the key string
+        cache_dir = os.path.expanduser(cache_dir)
+        os.makedirs(cache_dir, exist_ok=True)
+        return os.path.join(cache_dir, 
+                hashlib.blake2b(key.encode(), digest_size=16).hexdigest() + '.nrrd')
+    
+    
+    
+    def _load_cache_image(self, cache_path):
+        # touch the file on read - the cache evicts the least recently USED files
+        os.utime(cache_path)
+        return self.load_image(cache_path)
+    
+    
+    
+    def _save_cache_image(self, img, cache_path):
+        # save to the cache then evict beyond template-cache-max-files (default 16)
+        self.save_image(img, cache_path, 
+                        compression_level=_DS_COMPRESSION_LEVEL)
+        _prune_cache_dir(os.path.dirname(cache_path), 
+                         self.brp.get('template-cache-max-files', 16))
+    
+    
+    
+    def get_template_ds(self, ds_exists=None):
+        """
+        Return the template image in downsampled space
+        
+        The downsampled template held in memory is returned if loaded, else it
+        is loaded from its saved file, else the template is filtered (if 
+        requested in brp) and transformed to downsampled space.  Returns None 
+        if no image is downsampled.
+
+        Parameters
+        ----------
+        ds_exists : bool, optional
+            Whether the downsampled template file exists - callers that have 
+            already checked this pass it so the path is not checked again.
+
+        Returns
+        -------
+        sitk.Image or None
+            The template image in downsampled space.
+
+        """
+        if self._ds_mode == _DS_NONE:
+            return None
+        
+        kind = self.downsampling_img # template_ds is source or target template
+        prefix, label = _MOVE_DS_TABLE[(self._ds_mode, True)]
+        
+        img_ds = getattr(self, kind + '_template_img_ds')
+        if img_ds is not None: # output image is already loaded!
+            self.print_and_log('  downsampled ' + kind + ' template image exists : returning image' )
+            return img_ds
+        
+        path_ds = getattr(self, kind + '_template_path_ds')
+        if ds_exists is None:
+            ds_exists = path_ds.exists()
+        if ds_exists: # saved output exists - load rather than transform
+            self.print_and_log('  downsampled ' + kind + ' template image exists - loading image..')
+            return self.load_image(path_ds)
+        
+        # TRANSFORM : will transform template to ds space
+        pm_path = getattr(self, prefix + '_pm_path')
+        if getattr(self, prefix + '_pm') is None:
+            self.print_and_log('  loading ' + label + ' transform parameters file : ' +
+                  self.get_relative_path(pm_path[0] ) )
+            setattr(self, prefix + '_pm', self.load_pm_files(pm_path) )
+            if getattr(self, prefix + '_pm') is None:
+                print("ERROR : " + prefix + "_pm files do not exist - run register() first")
+        pm = getattr(self, prefix + '_pm')
+        
+        
+        # reuse a cached transform of the same template and pm files
+        template_path = getattr(self, kind + '_template_path')
+        cache_path = self._template_ds_cache_path(template_path, pm)
+        if cache_path is not None and os.path.exists(cache_path):
+            self.print_and_log('  loading cached downsampled ' + kind + ' template image : ' + 
+                               cache_path )
+            return self._load_cache_image(cache_path)
+        
+        
+        if getattr(self, kind + '_template_img') is None:
+            self.print_and_log('  loading ' + kind + ' template image : ' + 
+              self.get_relative_path(template_path) )
+            setattr(self, kind + '_template_img', self.load_image(template_path) )
+        
+        
+        # apply downsampling filter - if requested in brp
+        if self._ds_filter_enabled:
+            self.print_and_log('  running ' + kind + ' to downsampled filter..')
+            if self.img_ds_filter_pipeline is None: # only build pipeline once
+                self.img_ds_filter_pipeline = self.compute_adaptive_filter_img_ds()
+            setattr(self, kind + '_template_img', self.apply_adaptive_filter(
+                                        getattr(self, kind + '_template_img'), 
+                                        self.img_ds_filter_pipeline) )
+        
+        # transform all input images with transformix
+        self.print_and_log('  transforming ' + kind + ' template image..')
+        self.print_and_log('    image : ' + 
+                self.get_relative_path(template_path) )
+        self.print_and_log('    ' + label + ' elastix pm file : ' + 
+                self.get_relative_path(pm_path[0] ) )
+        self.print_and_log(_BANNER_END)
+        img = self.transform_image(getattr(self, kind + '_template_img'), pm, 
+                                   scaling=True)
+        setattr(self, kind + '_template_img', None)
+        garbage = gc.collect()
+        if cache_path is not None:
+            self._save_cache_image(img, cache_path)
+        return img
+    
     
     
     
@@ -1722,7 +1807,7 @@ class BrainRegister(object):
         if self.downsampling_img =='source':
             # downsampling from SOURCE TO TARGET : compute source <-> downsampled spaces
             
-            if self.src_tar_ds_pm_path_exists() == False:
+            if not self.src_tar_ds_pm_path_exists():
                 
                 self.print_and_log('  defining source to downsampled scaling parameters..')
                 self.src_tar_ds_pm = self.get_img_ds_scaling()
@@ -1738,7 +1823,7 @@ class BrainRegister(object):
                 self.src_tar_ds_pm = self.load_pm_files(self.src_tar_ds_pm_path)
             
             
-            if self.tar_src_ds_pm_path_exists() == False:
+            if not self.tar_src_ds_pm_path_exists():
                 
                 self.print_and_log('  defining downsampled to source scaling parameters..')
                 self.tar_src_ds_pm = self.get_ds_img_scaling()
@@ -1760,7 +1845,7 @@ class BrainRegister(object):
         elif self.downsampling_img =='target':
             # downsampling from TARGET TO SOURCE : compute target <-> downsampled spaces
             
-            if self.tar_src_ds_pm_path_exists() == False:
+            if not self.tar_src_ds_pm_path_exists():
                 
                 self.print_and_log('  defining target to downsampled scaling parameters..')
                 self.tar_src_ds_pm = self.get_img_ds_scaling()
@@ -1776,7 +1861,7 @@ class BrainRegister(object):
                 self.tar_src_ds_pm = self.load_pm_files(self.tar_src_ds_pm_path)
             
             
-            if self.src_tar_ds_pm_path_exists() == False:
+            if not self.src_tar_ds_pm_path_exists():
                 
                 self.print_and_log('  defining downsampled to target scaling parameters..')
                 self.src_tar_ds_pm = self.get_ds_img_scaling()
@@ -1798,20 +1883,19 @@ class BrainRegister(object):
     
     def  get_source_target_scale_factors(self):
         
-        #str(self.target_string+'-template-resolution')
-        # round to 6 dp - used by elastix!
-        s2c = {key: round( 
-            self.brp['source-template-resolution'][key] / 
-            self.ccfp[str(self.target_string+'-template-resolution')].get(key, 0), 6 )
-                            for key in self.brp['source-template-resolution'].keys()}
+        # look up both resolution dicts once - not per key
+        src_res = self.brp['source-template-resolution']
+        tar_res = self.ccfp[str(self.target_string+'-template-resolution')]
+        
+        # scale-factors in XYZ sample -> ccf
+         # round to 6 dp - used by elastix!
+        s2c = {key: round( src_res[key] / tar_res.get(key, 0), 6 )
+                            for key in src_res}
         
         # scale-factors in XYZ ccf -> sample
           # round to 6 dp - used by elastix!
-        c2s = {key: round(
-            self.ccfp[str(self.target_string+'-template-resolution')][key] / 
-            self.brp['source-template-resolution'].get(key, 0), 6 )
-                            for key in self.ccfp[str(self.target_string+
-                                                '-template-resolution')].keys()}
+        c2s = {key: round( tar_res[key] / src_res.get(key, 0), 6 )
+                            for key in tar_res}
         
         #scale_matrix = np.zeros((4, 4))
         #scale_matrix[0,0] = s2c['x-um']
@@ -1832,20 +1916,27 @@ class BrainRegister(object):
         if (self.downsampling_img == 'source'):
             # target-to-source resolution diff. used to compute filter radius
             # Median of res. diff for smoothed downsampling
-            return ImageFilterPipeline(
+            filter_pipeline = ImageFilterPipeline(
                     str("M,"+
                     str(round( (self.t2s['x-um'] ) / 2)) + ',' +
                     str(round( (self.t2s['y-um'] ) / 2)) + ',' +
                     str(round( (self.t2s['z-um'] ) / 2)) ) )
         
-        if (self.downsampling_img == 'target'):
+        elif (self.downsampling_img == 'target'):
             # source-to-target resolution diff. used to comptue filter radius
-            return ImageFilterPipeline(
+            filter_pipeline = ImageFilterPipeline(
                 str("M,"+
                 str(round( (self.s2t['x-um']) / 2)) + ',' +
                 str(round( (self.s2t['y-um']) / 2)) + ',' +
                 str(round( (self.s2t['z-um']) / 2)) )  )
         
+        else:
+            return None
+        
+        # optional brp key - median filter on the GPU if cupy + cucim are installed
+        filter_pipeline.use_gpu = bool(self.brp.get('downsampling-filter-gpu', False))
+        return filter_pipeline
+    
     
     
     
@@ -1856,83 +1947,25 @@ class BrainRegister(object):
         
         if self.downsampling_img =='source':
             # downsampling the source image : source -> downsampled (target res.)
-            
-            img_ds_pm = sitk.ReadParameterFile(
-                        os.path.join(BRAINREGISTER_MODULE_DIR, 'resources',
-                                          'transformix-parameter-files', 
-                                          '00_scaling.txt') )
-            # see keys with list(img_ds_pm)
-            # see contents of keys with img_ds_pm['key']
-            
-            # edit TransformParameters to correct tuple
-             # use t2s - as the registration is FROM fixed TO moving!!!
-            img_ds_pm['TransformParameters'] = tuple( 
-                [str("{:.6f}".format(self.t2s['x-um'])), 
-                 '0.000000', '0.000000','0.000000', 
-                 str("{:.6f}".format(self.t2s['y-um'])), 
-                 '0.000000','0.000000','0.000000', 
-                 str("{:.6f}".format(self.t2s['z-um'])), 
-                 '0.000000','0.000000','0.000000'] )
-            
-            # AND edit the Size to correct tuple
-             # here want to use s2t - as this defines the size of the final FIXED image!
-            img_ds_pm['Size'] = tuple( 
-                [str("{:.6f}".format( round(
-                     self.brp['source-template-size']['x'] * self.s2t['x-um']) ) ), 
-                 str("{:.6f}".format( round(
-                     self.brp['source-template-size']['y'] * self.s2t['y-um']) ) ),
-                 str("{:.6f}".format( round(
-                     self.brp['source-template-size']['z'] * self.s2t['z-um']))) ] )
-            
-            # set the output format
-            img_ds_pm['ResultImageFormat'] = tuple( [ self.brp['downsampling-save-image-type'] ] )
-            
-            img_ds_pm = [img_ds_pm]
-            # wrap in list so this works with transform_image like any other set of parameter maps!
-            
-            return img_ds_pm
-            
+            # use t2s - as the registration is FROM fixed TO moving!!!
+            # size uses s2t - as this defines the size of the final FIXED image!
+            size = self.brp['source-template-size']
+            return _make_scaling_pm(self.t2s, 
+                         ( size['x'] * self.s2t['x-um'], 
+                           size['y'] * self.s2t['y-um'], 
+                           size['z'] * self.s2t['z-um'] ), 
+                         self.brp['downsampling-save-image-type'] )
             
         elif self.downsampling_img =='target':
             # downsampling the target image : target -> downsampled (source res.)
-            
-            img_ds_pm = sitk.ReadParameterFile(
-                        os.path.join(BRAINREGISTER_MODULE_DIR, 'resources',
-                                          'transformix-parameter-files', 
-                                          '00_scaling.txt') )
-            # see keys with list(img_ds_pm)
-            # see contents of keys with img_ds_pm['key']
-            
-            # edit TransformParameters to correct tuple
-             # use s2t - as the registration is FROM fixed TO moving!!!
-            img_ds_pm['TransformParameters'] = tuple( 
-                [str("{:.6f}".format(self.s2t['x-um'])), 
-                 '0.000000', '0.000000','0.000000', 
-                 str("{:.6f}".format(self.s2t['y-um'])), 
-                 '0.000000','0.000000','0.000000', 
-                 str("{:.6f}".format(self.s2t['z-um'])), 
-                 '0.000000','0.000000','0.000000'] )
-            
-            # AND edit the Size to correct tuple
-             # here want to use t2s - as this defines the size of the final FIXED image!
-            img_ds_pm['Size'] = tuple( 
-                [str("{:.6f}".format( round(
-                    self.ccfp[str(self.target_string+'-template-size')]['x'] 
-                      * self.t2s['x-um']) ) ), 
-                 str("{:.6f}".format( round(
-                     self.ccfp[str(self.target_string+'-template-size')]['y'] 
-                       * self.t2s['y-um']) ) ),
-                 str("{:.6f}".format( round(
-                     self.ccfp[str(self.target_string+'-template-size')]['z'] 
-                       * self.t2s['z-um']))) ] )
-            
-            # set the output format
-            img_ds_pm['ResultImageFormat'] = tuple( [ self.brp['downsampling-save-image-type'] ] )
-            
-            img_ds_pm = [img_ds_pm]
-            # wrap in list so this works with transform_image like any other set of parameter maps!
-            
-            return img_ds_pm
+            # use s2t - as the registration is FROM fixed TO moving!!!
+            # size uses t2s - as this defines the size of the final FIXED image!
+            size = self.ccfp[str(self.target_string+'-template-size')]
+            return _make_scaling_pm(self.s2t, 
+                         ( size['x'] * self.t2s['x-um'], 
+                           size['y'] * self.t2s['y-um'], 
+                           size['z'] * self.t2s['z-um'] ), 
+                         self.brp['downsampling-save-image-type'] )
         else:
             return None
     
@@ -1942,97 +1975,57 @@ class BrainRegister(object):
         
         if self.downsampling_img =='source':
             # downsampling the source image : downsampled (target res.) -> source
-            ds_img_pm = sitk.ReadParameterFile(
-                        os.path.join(BRAINREGISTER_MODULE_DIR, 'resources',
-                                          'transformix-parameter-files', 
-                                          '00_scaling.txt') )
-            # see keys with list(ds_img_pm)
-            # see contents of keys with ds_img_pm['key']
-            
-            # edit TransformParameters to correct tuple
-             # use s2c - as the registration is FROM fixed TO moving!!!
-            ds_img_pm['TransformParameters'] = tuple( 
-                [str("{:.6f}".format(self.s2t['x-um'])), 
-                 '0.000000', '0.000000','0.000000', 
-                 str("{:.6f}".format(self.s2t['y-um'])), 
-                 '0.000000','0.000000','0.000000', 
-                 str("{:.6f}".format(self.s2t['z-um'])), 
-                 '0.000000','0.000000','0.000000'] )
-            
-            # AND edit the Size to correct tuple
-             # here want to use source template size - as this defines the size of the final FIXED image!
-            ds_img_pm['Size'] = tuple( 
-                [str("{:.6f}".format( round( self.brp['source-template-size']['x'] ))), 
-                 str("{:.6f}".format( round( self.brp['source-template-size']['y'] ))),
-                 str("{:.6f}".format( round( self.brp['source-template-size']['z'] ))) ] )
-            
-            # set the output format
-            ds_img_pm['ResultImageFormat'] = tuple( [ self.brp['downsampling-save-image-type'] ] )
-            
-            ds_img_pm = [ds_img_pm]
-            # wrap in list so this works with transform_image like any other set of parameter maps!
-            
-            return ds_img_pm
-        
+            # use s2t - as the registration is FROM fixed TO moving!!!
+            # size is the source template size - the size of the final FIXED image!
+            size = self.brp['source-template-size']
+            return _make_scaling_pm(self.s2t, 
+                         ( size['x'], size['y'], size['z'] ), 
+                         self.brp['downsampling-save-image-type'] )
         
         elif self.downsampling_img =='target':
-            # downsampling the target image : target -> downsampled (source res.)
-            ds_img_pm = sitk.ReadParameterFile(
-                        os.path.join(BRAINREGISTER_MODULE_DIR, 'resources',
-                                          'transformix-parameter-files', 
-                                          '00_scaling.txt') )
-            # see keys with list(ds_img_pm)
-            # see contents of keys with ds_img_pm['key']
-            
-            # edit TransformParameters to correct tuple
-             # use t2s - as the registration is FROM fixed TO moving!!!
-            ds_img_pm['TransformParameters'] = tuple( 
-                [str("{:.6f}".format(self.t2s['x-um'])), 
-                 '0.000000', '0.000000','0.000000', 
-                 str("{:.6f}".format(self.t2s['y-um'])), 
-                 '0.000000','0.000000','0.000000', 
-                 str("{:.6f}".format(self.t2s['z-um'])), 
-                 '0.000000','0.000000','0.000000'] )
-            
-            # AND edit the Size to correct tuple
-             # here want to use target template size ONLY
-            ds_img_pm['Size'] = tuple( 
-                [str("{:.6f}".format( round(
-                    self.ccfp[str(self.target_string+'-template-size')]['x'] ))),
-                      #* self.t2s['x-um']) ) ), 
-                 str("{:.6f}".format( round(
-                     self.ccfp[str(self.target_string+'-template-size')]['y'] ))),
-                       #* self.t2s['y-um']) ) ),
-                 str("{:.6f}".format( round(
-                     self.ccfp[str(self.target_string+'-template-size')]['z'] ))) ] )
-                       #* self.t2s['z-um']))) ] )
-            
-            # set the output format
-            ds_img_pm['ResultImageFormat'] = tuple( [ self.brp['downsampling-save-image-type'] ] )
-            
-            ds_img_pm = [ds_img_pm]
-            # wrap in list so this works with transform_image like any other set of parameter maps!
-            
-            return ds_img_pm
+            # downsampling the target image : downsampled (source res.) -> target
+            # use t2s - as the registration is FROM fixed TO moving!!!
+            # size is the target template size ONLY
+            size = self.ccfp[str(self.target_string+'-template-size')]
+            return _make_scaling_pm(self.t2s, 
+                         ( size['x'], size['y'], size['z'] ), 
+                         self.brp['downsampling-save-image-type'] )
         
     
     
     
-    def save_image(self, image, path):
+    def save_image(self, image, path, compress=True, compression_level=-1):
+        
+        if self._save_executor is not None:
+            # write in the background - after the previous write completes, so
+             # at most one image is held in memory for writing
+            self._wait_save()
+            self._save_future = self._save_executor.submit(sitk.WriteImage, 
+                                image, str(path), compress, compression_level)
+            return
         
         # save with simpleITK - much FASTER even for nrrd images!
         sitk.WriteImage(
             image,   # sitk image
             str(path), # dir plus file name
-            True # useCompression set to TRUE
+            compress, # useCompression - TRUE by default
+            compression_level # -1 uses the image IO default level
             )
         
         
     
     
+    def _wait_save(self):
+        # wait for any background save_image() write - re-raises its errors
+        if self._save_future is not None:
+            future, self._save_future = self._save_future, None
+            future.result()
+    
+    
+    
     def load_image(self, path):
         img = sitk.ReadImage(str(path))
-        img.SetSpacing( tuple([1.0, 1.0, 1.0]) )
+        img.SetSpacing(_UNIT_SPACING)
         return img
     
     
@@ -2053,9 +2046,70 @@ class BrainRegister(object):
     
     
     
-    def transform_image(self, template_img, pm_list):
+    def _ds_resample(self, img, pm_list):
+        '''
+        Resample img with the sitk ResampleImageFilter for a single affine pm
+        
+        Only for the raw <-> downsampled scaling parameter maps : these are one
+        AffineTransform each, which the native multi-threaded resampler applies 
+        directly - without transformix parsing the map and writing its result 
+        files.  Returns None for any other parameter maps - including any with
+        an initial transform - which must go through transformix.
+        '''
+        if len(pm_list) != 1:
+            return None
+        pm = pm_list[0]
+        order = _pm_interpolation_order(pm)
+        if ( pm.get('Transform', ('',))[0] != 'AffineTransform' or
+             pm.get('InitialTransformParametersFileName', 
+                    ('NoInitialTransform',))[0] != 'NoInitialTransform' or
+             pm.get('ResampleInterpolator', ('',))[0] != 'FinalBSplineInterpolator' or
+             pm.get('Resampler', ('DefaultResampler',))[0] != 'DefaultResampler' or
+             order not in _BSPLINE_ORDER_INTERPOLATOR ):
+            return None
+        
+        # elastix affine : moving point = A (p - c) + t + c, as for sitk.AffineTransform
+        params = [ float(v) for v in pm['TransformParameters'] ]
+        transform = sitk.AffineTransform(3)
+        transform.SetMatrix(params[:9])
+        transform.SetTranslation(params[9:12])
+        transform.SetCenter([ float(v) for v in pm['CenterOfRotationPoint'] ])
+        
+        resampler = sitk.ResampleImageFilter()
+        # resample with all cores - optional brp key num-threads overrides this
+        resampler.SetNumberOfThreads( 
+                          self.brp.get('num-threads') or os.cpu_count() or 1 )
+        resampler.SetTransform(transform)
+        resampler.SetInterpolator(_BSPLINE_ORDER_INTERPOLATOR[order])
+        resampler.SetSize([ round(float(v)) for v in pm['Size'] ])
+        resampler.SetOutputSpacing([ float(v) for v in pm['Spacing'] ])
+        resampler.SetOutputOrigin([ float(v) for v in pm['Origin'] ])
+        # elastix Direction is column-major - sitk takes it row-major
+        resampler.SetOutputDirection( 
+                _transpose_direction([ float(v) for v in pm['Direction'] ]) )
+        resampler.SetDefaultPixelValue( float(pm.get('DefaultPixelValue', ('0',))[0]) )
+        # 32-bit float like transformix - nearest neighbour only copies pixel 
+         # values, so can keep the input type and skip the cast afterwards
+        resampler.SetOutputPixelType( 
+            img.GetPixelID() if order == 0 else sitk.sitkFloat32 )
+        return resampler.Execute(img)
+    
+    
+    
+    def transform_image(self, template_img, pm_list, scaling=False):
+        
+        # the raw <-> downsampled scaling pms - flagged by scaling - use the 
+         # native resampler, all other pms (eg. registration output) transformix
+        img = self._ds_resample(template_img, pm_list) if scaling else None
+        if img is not None:
+            self.print_and_log(_BANNER_END)
+            nearest = _pm_interpolation_order(pm_list[0]) == 0
+            return self.cast_image(template_img, img, clamp=not nearest)
         
         transformixImageFilter = sitk.TransformixImageFilter()
+        # resample with all cores - optional brp key num-threads overrides this
+        transformixImageFilter.SetNumberOfThreads( 
+                          self.brp.get('num-threads') or os.cpu_count() or 1 )
         
         # add the first PM with Set
         transformixImageFilter.SetTransformParameterMap(pm_list[0])
@@ -2079,46 +2133,55 @@ class BrainRegister(object):
         #img.SetSpacing( tuple([1.0, 1.0, 1.0]) )
         
         
-        self.print_and_log('')
-        self.print_and_log('========================================================================')
-        self.print_and_log('')
-        self.print_and_log('')
+        self.print_and_log(_BANNER_END)
         
         # cast to the original image bitdepth as needed
         # output is 32-bit float - convert this to the ORIGINAL image type!
-        img = self.cast_image(template_img, img)
+        # nearest neighbour transforms (annotations) only copy input pixel values
+         # so cannot overshoot the input min/max - no need to scan and clamp
+        nearest = all( _pm_interpolation_order(pm) == 0 for pm in pm_list )
+        img = self.cast_image(template_img, img, clamp=not nearest)
         
         
         return img
         
     
     
-    def cast_image(self, img, img_t):
+    def cast_image(self, img, img_t, clamp=True):
         
         self.print_and_log('  cast image to original bitdepth')
         self.print_and_log('')
-        # get the minimum and maximum values in img
-        minMax = sitk.MinimumMaximumImageFilter()
-        minMax.Execute(img)
-        
-        self.print_and_log('    clamp min/max..')
-        # to be MEMORY EFFICIENT will use the ClampImageFilter
-        clamp = sitk.ClampImageFilter()
-        clamp.SetLowerBound(minMax.GetMinimum())
-        clamp.SetUpperBound(minMax.GetMaximum())
-        img_t = clamp.Execute(img_t)
-        # now any pixels in output image will be in the bound of the input min/max
-        # this overcomes “overshoot-property” of higher-order B-spline interpolation
-        
-        # NOW cast the image
-        # cannot do this before, as the cast converts pixels bit-wise
-        # this may result in aberrant pixel values if there is any overshoot pixels
-        # eg. if pixels are set to BELOW 0.0 they will come up as HIGH PIXEL VALS when
-        # cast to an unsigned pixel type..
-        self.print_and_log('    cast to original bitdepth..')
-        img_t = sitk.Cast(img_t, img.GetPixelID())
+        
+        if img_t.GetPixelID() == img.GetPixelID():
+            # already the original type (eg. nearest neighbour resample) - no cast
+            img_t.SetSpacing(_UNIT_SPACING)
+            return img_t
+        
+        if clamp:
+            self.print_and_log('    clamp min/max and cast to original bitdepth..')
+            # get the minimum and maximum values in img
+            minMax = sitk.MinimumMaximumImageFilter()
+            minMax.Execute(img)
+            
+            # to be MEMORY EFFICIENT will use the ClampImageFilter - setting its
+             # output pixel type clamps AND casts in one pass, so no intermediate 
+             # clamped float image is allocated before the cast
+            clamp = sitk.ClampImageFilter()
+            clamp.SetLowerBound(minMax.GetMinimum())
+            clamp.SetUpperBound(minMax.GetMaximum())
+            clamp.SetOutputPixelType(img.GetPixelID())
+            img_t = clamp.Execute(img_t)
+            # now any pixels in output image will be in the bound of the input min/max
+            # this overcomes “overshoot-property” of higher-order B-spline interpolation
+            
+        else:
+            # nearest neighbour output only holds input pixel values, so cannot 
+             # overshoot - cast bit-wise without the clamp
+            self.print_and_log('    cast to original bitdepth..')
+            img_t = sitk.Cast(img_t, img.GetPixelID())
+        
         self.print_and_log('    set spacing..')
-        img_t.SetSpacing( tuple([1.0, 1.0, 1.0]) ) # can do this to be sure spacing is set!
+        img_t.SetSpacing(_UNIT_SPACING) # can do this to be sure spacing is set!
         
         
         return img_t
@@ -2130,18 +2193,16 @@ class BrainRegister(object):
         
         if self.downsampling_img =='source':
             
-            if self.src_tar_ds_pm_path_exists() == False:
+            if not self.src_tar_ds_pm_path_exists():
                 
-                sitk.WriteParameterFile(self.src_tar_ds_pm[0], 
-                                         str(self.src_tar_ds_pm_path[0]) )
+                _write_pm_file(self.src_tar_ds_pm[0], self.src_tar_ds_pm_path[0])
                 
             
         elif self.downsampling_img =='target':
             
-            if self.tar_src_ds_pm_path_exists() == False:
+            if not self.tar_src_ds_pm_path_exists():
                 
-                sitk.WriteParameterFile(self.tar_src_ds_pm[0], 
-                                         str(self.tar_src_ds_pm_path[0]) )
+                _write_pm_file(self.tar_src_ds_pm[0], self.tar_src_ds_pm_path[0])
                 
             
         
@@ -2154,18 +2215,16 @@ class BrainRegister(object):
         
         if self.downsampling_img =='source':
             
-            if self.tar_src_ds_pm_path_exists() == False:
+            if not self.tar_src_ds_pm_path_exists():
                 
-                sitk.WriteParameterFile(self.tar_src_ds_pm[0], 
-                                         str(self.tar_src_ds_pm_path[0]) )
+                _write_pm_file(self.tar_src_ds_pm[0], self.tar_src_ds_pm_path[0])
                 
             
         elif self.downsampling_img =='target':
             
-            if self.src_tar_ds_pm_path_exists() == False:
+            if not self.src_tar_ds_pm_path_exists():
                 
-                sitk.WriteParameterFile(self.src_tar_ds_pm[0], 
-                                         str(self.src_tar_ds_pm_path[0]) )
+                _write_pm_file(self.src_tar_ds_pm[0], self.src_tar_ds_pm_path[0])
         
         
         
@@ -2178,10 +2237,10 @@ class BrainRegister(object):
         
         if self.downsampling_img == 'source':
             
-            if self.brp['source-to-target-downsampling-save-template'] == True:
+            if self.brp['source-to-target-downsampling-save-template'] is True:
                 
-                if self.source_template_path_ds.exists() == False:
-                    self.source_template_img_ds = self.get_template_ds()
+                if not self.source_template_path_ds.exists():
+                    self.source_template_img_ds = self.get_template_ds(ds_exists=False)
                     self.save_template_ds()
                     # DISCARD the template_img - as this can be a large file, best to discard!
                     self.source_template_img = None
@@ -2198,10 +2257,10 @@ class BrainRegister(object):
             
         elif self.downsampling_img == 'target':
             
-            if self.brp['target-to-source-downsampling-save-template'] == True:
+            if self.brp['target-to-source-downsampling-save-template'] is True:
                 
-                if self.target_template_path_ds.exists() == False:
-                    self.target_template_img_ds = self.get_template_ds()
+                if not self.target_template_path_ds.exists():
+                    self.target_template_img_ds = self.get_template_ds(ds_exists=False)
                     self.save_template_ds()
                     self.target_template_img = None
                     garbage = gc.collect() # run garbage collection to ensure memory is freed
@@ -2222,16 +2281,18 @@ class BrainRegister(object):
         
         if (self.downsampling_img == 'source'):
             #source-to-target-downsampling-save-annotations
-            if self.brp['source-to-target-downsampling-save-annotations'] == True:
+            if self.brp['source-to-target-downsampling-save-annotations'] is True:
                 
                 # now transform and save each source annotation
-                if self.source_anno_path != []:
+                if self.source_anno_path:
                     self.print_and_log('')
                     self.print_and_log('  transforming and saving source annotations to ds..')
                     
-                    for i, s in enumerate(self.source_anno_path):
-                        
-                        self.process_anno_ds(i)
+                    self._process_ds_all(self._process_anno_ds_todo, 
+                                         self._ds_todo(self.source_anno_path, 
+                                                       self.source_anno_path_ds, 
+                                                       'source annotations'), 
+                                         'anno-workers')
                     
                 else:
                     self.print_and_log('')
@@ -2240,19 +2301,19 @@ class BrainRegister(object):
                 
                 
                 # ALSO copy the annotation structure tree files
-                if self.source_tree_path != []:
+                if self.source_tree_path:
                     self.print_and_log('')
                     self.print_and_log('  transforming and saving source annotation structure trees to ds..')
                     
                     for i, st_path in enumerate(self.source_tree_path):
                         
-                        if self.source_tree_path_ds[i].exists() == False:
+                        if not self.source_tree_path_ds[i].exists():
                             self.print_and_log('  copying source annotation structure tree to ds : '+
-                                  str( self.source_tree_path_ds[i].resolve() ) )
+                                  self.get_relative_path(self.source_tree_path_ds[i]) )
                             shutil.copy(st_path, self.source_tree_path_ds[i])
                         else:
                             self.print_and_log('  source annotation structure tree to ds exists : '+
-                                  str( self.source_tree_path_ds[i].resolve() ) )
+                                  self.get_relative_path(self.source_tree_path_ds[i]) )
                         #self.process_anno_ds(i)
                     
                 else:
@@ -2270,16 +2331,18 @@ class BrainRegister(object):
             
         elif (self.downsampling_img == 'target'):
             #target-to-source-downsampling-save-annotations
-            if self.brp['target-to-source-downsampling-save-annotations'] == True:
+            if self.brp['target-to-source-downsampling-save-annotations'] is True:
                 
                 # now transform and save each target annotation
-                if self.target_anno_path != []:
+                if self.target_anno_path:
                     self.print_and_log('')
                     self.print_and_log('  transforming and saving target annotations to ds..')
                     
-                    for i, s in enumerate(self.target_anno_path):
-                        
-                        self.process_anno_ds(i)
+                    self._process_ds_all(self._process_anno_ds_todo, 
+                                         self._ds_todo(self.target_anno_path, 
+                                                       self.target_anno_path_ds, 
+                                                       'target annotations'), 
+                                         'anno-workers')
                     
                 else:
                     self.print_and_log('')
@@ -2288,19 +2351,19 @@ class BrainRegister(object):
                 
                 
                 # ALSO copy the annotation structure tree files
-                if self.target_tree_path != []:
+                if self.target_tree_path:
                     self.print_and_log('')
                     self.print_and_log('  transforming and saving target annotation structure tree to ds..')
                     
                     for i, st_path in enumerate(self.target_tree_path):
                         
-                        if self.target_tree_path_ds[i].exists() == False:
+                        if not self.target_tree_path_ds[i].exists():
                             self.print_and_log('  copying target annotation structure tree to ds : '+
-                                  str( self.target_tree_path_ds[i].resolve() ) )
+                                  self.get_relative_path(self.target_tree_path_ds[i]) )
                             shutil.copy(st_path, self.target_tree_path_ds[i])
                         else:
                             self.print_and_log('  target annotation structure tree to ds exists : '+
-                                  str( self.target_tree_path_ds[i].resolve() ) )
+                                  self.get_relative_path(self.target_tree_path_ds[i]) )
                         #self.process_anno_ds(i)
                     
                 else:
@@ -2320,13 +2383,94 @@ class BrainRegister(object):
     
     
     
-    def process_anno_ds(self, index):
+    def _process_ds_all(self, process, indices, workers_key):
+        """
+        Run process(i) for each image index in indices
+        
+        Images are processed in a thread pool when the optional brp key 
+        workers_key is above 1 - file IO, filtering and transformix release 
+        the GIL, so processing of several images overlaps.  The pool is kept 
+        for both annotation and image loops, and shut down by 
+        _shutdown_ds_pool() once each step is done, or fails.  Each worker 
+        holds a full image volume in memory, so the default is 1 : process 
+        serially.
+        """
+        workers = min(self.brp.get(workers_key) or 1, len(indices))
+        if workers > 1:
+            # one pool serves both loops - sized for the larger workers key, so
+             # each loop runs workers lanes of indices to keep its own limit
+            if self._ds_pool is None:
+                self._ds_pool = ThreadPoolExecutor( max_workers=max( 
+                                    self.brp.get('anno-workers') or 1, 
+                                    self.brp.get('downsampling-workers') or 1, 
+                                    self.brp.get('transform-workers') or 1 ) )
+            lanes = [ indices[w::workers] for w in range(workers) ]
+            list( self._ds_pool.map( lambda lane: [process(i) for i in lane], 
+                                     lanes ) ) # re-raises errors
+        else:
+            # serial : save_image() writes each image in a background thread,
+             # so the write overlaps loading + transforming the next image
+            self._save_executor = ThreadPoolExecutor(max_workers=1)
+            try:
+                for i in indices:
+                    process(i)
+            except BaseException:
+                # wait for the last background write on errors too - but raise
+                 # the processing error, logging any write error behind it
+                try:
+                    self._wait_save()
+                except Exception as e:
+                    self.print_and_log('  background image write also failed : ' + repr(e))
+                raise
+            else:
+                self._wait_save() # last write - re-raises any write error
+            finally:
+                self._save_executor.shutdown(wait=True)
+                self._save_executor = None
+                self._save_future = None
+    
+    
+    
+    def _shutdown_ds_pool(self):
+        # discard the shared worker pool - if one was started
+        if self._ds_pool is not None:
+            self._ds_pool.shutdown(wait=True)
+            self._ds_pool = None
+    
+    
+    
+    def _transform_save(self, get, save, label, index):
+        # transform the image at index with get, then save it with save
+        self.print_and_log('  ' + label + ' ' + str(index))
+        # save from a local var, do not hold onto refs on self - 
+         # user can use the load_* methods to do this!
+        save(index, get(index))
+    
+    
+    
+    def _ds_todo(self, paths, paths_ds, kind):
+        """
+        Indices of paths whose downsampled path in paths_ds does not exist
+        
+        Each ds path is checked once here, and one summary line logged, so 
+        the process_*_ds calls for these indices need not check it again.
+        """
+        todo = [ i for i, p in enumerate(paths_ds) if not p.exists() ]
+        self.print_and_log('    ' + str(len(todo)) + ' of ' + str(len(paths)) + 
+                           ' ' + kind + ' to downsample')
+        return todo
+    
+    
+    
+    def process_anno_ds(self, index, ds_exists=None):
         
         if (self.downsampling_img == 'source'):
         #source_anno images
-            if (self.source_anno_path_ds != []):
+            if self.source_anno_path_ds:
                 
-                if self.source_anno_path_ds[index].exists() == False: 
+                if ds_exists is None:
+                    ds_exists = self.source_anno_path_ds[index].exists()
+                if not ds_exists:
                     self.print_and_log('')
                     self.print_and_log('    loading source annotation image : ' 
                            + self.get_relative_path(
@@ -2335,7 +2479,7 @@ class BrainRegister(object):
                     anno_ds = self.load_transform_anno_img_ds(
                                     self.source_anno_path[index] ) #source_anno_path_ds BUG
                     
-                    self.save_anno_ds(index, anno_ds)
+                    self.save_anno_ds(index, anno_ds, ds_exists=False)
                     
                 else:
                     self.print_and_log('    downsampled source annotation image exists : ' 
@@ -2348,9 +2492,11 @@ class BrainRegister(object):
                 
         elif (self.downsampling_img == 'target'):
         #target_anno images
-            if (self.target_anno_path_ds != []):
+            if self.target_anno_path_ds:
                 
-                if self.target_anno_path_ds[index].exists() == False:
+                if ds_exists is None:
+                    ds_exists = self.target_anno_path_ds[index].exists()
+                if not ds_exists:
                     self.print_and_log('')
                     self.print_and_log('    loading target annotation image : ' 
                            + self.get_relative_path(
@@ -2359,7 +2505,7 @@ class BrainRegister(object):
                     anno_ds = self.load_transform_anno_img_ds(
                                     self.target_anno_path[index] ) # target_anno_path_ds BUG
                     
-                    self.save_anno_ds(index, anno_ds)
+                    self.save_anno_ds(index, anno_ds, ds_exists=False)
                     
                 else:
                     self.print_and_log('    downsampled target annotation image exists : ' 
@@ -2378,16 +2524,18 @@ class BrainRegister(object):
         
         if (self.downsampling_img == 'source'):
             #source-to-target-downsampling-save-images
-            if self.brp['source-to-target-downsampling-save-images'] == True:
+            if self.brp['source-to-target-downsampling-save-images'] is True:
                 # now transform and save each sample image
                 
-                if self.source_image_paths != []:
+                if self.source_image_paths:
                     
                     self.print_and_log('')
                     self.print_and_log('  transforming and saving source images to ds..')
-                    for i, s in enumerate(self.source_image_paths):
-                        self.print_and_log('  source image ' + str(i))
-                        self.process_image_ds(i)
+                    self._process_ds_all(self._process_image_ds_logged, 
+                                         self._ds_todo(self.source_image_paths, 
+                                                       self.source_image_paths_ds, 
+                                                       'source images'), 
+                                         'downsampling-workers')
                     
                 else:
                     self.print_and_log('')
@@ -2401,15 +2549,17 @@ class BrainRegister(object):
             
         elif (self.downsampling_img == 'target'):
             #target-to-source-downsampling-save-images
-            if self.brp['target-to-source-downsampling-save-images'] == True:
+            if self.brp['target-to-source-downsampling-save-images'] is True:
                 # now transform and save each sample image
                 
-                if self.target_image_paths != []:
+                if self.target_image_paths:
                     self.print_and_log('')
                     self.print_and_log('  transforming and saving target images to ds..')
-                    for i, s in enumerate(self.target_image_paths):
-                        self.print_and_log('  target image ' + str(i))
-                        self.process_image_ds(i)
+                    self._process_ds_all(self._process_image_ds_logged, 
+                                         self._ds_todo(self.target_image_paths, 
+                                                       self.target_image_paths_ds, 
+                                                       'target images'), 
+                                         'downsampling-workers')
                     
                 else:
                     self.print_and_log('')
@@ -2424,13 +2574,28 @@ class BrainRegister(object):
     
     
     
-    def process_image_ds(self, index):
+    def _process_anno_ds_todo(self, index):
+        # index is from _ds_todo() - its ds path is known not to exist
+        self.process_anno_ds(index, ds_exists=False)
+    
+    
+    
+    def _process_image_ds_logged(self, index):
+        # index is from _ds_todo() - its ds path is known not to exist
+        self.print_and_log('  ' + self.downsampling_img + ' image ' + str(index))
+        self.process_image_ds(index, ds_exists=False)
+    
+    
+    
+    def process_image_ds(self, index, ds_exists=None):
         
         if (self.downsampling_img == 'source'):
             # source_images
             if (self.source_image_paths_ds is not None):
                 
-                if self.source_image_paths_ds[index].exists() == False:
+                if ds_exists is None:
+                    ds_exists = self.source_image_paths_ds[index].exists()
+                if not ds_exists:
                     
                     self.print_and_log('')
                     self.print_and_log('    loading source image : ' 
@@ -2440,7 +2605,7 @@ class BrainRegister(object):
                     sample_ds = self.load_transform_image_img_ds(
                                  self.source_image_paths[index] )
                     
-                    self.save_image_ds(index, sample_ds)
+                    self.save_image_ds(index, sample_ds, ds_exists=False)
                     
                 else:
                     self.print_and_log('    downsampled source image exists : ' 
@@ -2457,7 +2622,9 @@ class BrainRegister(object):
             # target_images
             if (self.target_image_paths_ds is not None):
                 
-                if self.target_image_paths_ds[index].exists() == False:
+                if ds_exists is None:
+                    ds_exists = self.target_image_paths_ds[index].exists()
+                if not ds_exists:
                     
                     self.print_and_log('')
                     self.print_and_log('    loading target image : ' 
@@ -2467,7 +2634,7 @@ class BrainRegister(object):
                     sample_ds = self.load_transform_image_img_ds(
                                  self.target_image_paths[index] )
                     
-                    self.save_image_ds(index, sample_ds)
+                    self.save_image_ds(index, sample_ds, ds_exists=False)
                     
                 else:
                     self.print_and_log('    downsampled target image exists : ' 
@@ -2484,50 +2651,59 @@ class BrainRegister(object):
     
     
     
-    def save_anno_ds(self, index, sample_ds):
+    def save_anno_ds(self, index, sample_ds, ds_exists=None):
+        """
+        Save downsampled annotation image sample_ds to its ds path at index
         
+        The image is only saved if the ds path does not exist - ds_exists may 
+        be passed by callers that have already checked this, so the path is 
+        not checked again.
+        """
         if (self.downsampling_img == 'source'):
             # save to source anno image path
-            if self.source_anno_path_ds[index].exists() == False:
-                self.print_and_log('    saving downsampled image : ' 
-                   + self.get_relative_path(self.source_anno_path_ds[index]) )
-                self.save_image(sample_ds, self.source_anno_path_ds[index])
-                
-            
+            path_ds = self.source_anno_path_ds[index]
         elif (self.downsampling_img == 'target'):
             # save to target anno image path
-            if self.target_anno_path_ds[index].exists() == False:
-                self.print_and_log('    saving downsampled image : ' 
-                   + self.get_relative_path(self.target_anno_path_ds[index]) )
-                self.save_image(sample_ds, self.target_anno_path_ds[index])
-                
-            
+            path_ds = self.target_anno_path_ds[index]
+        else:
+            return
+        
+        if ds_exists is None:
+            ds_exists = path_ds.exists()
+        if not ds_exists:
+            self.print_and_log('    saving downsampled image : ' 
+               + self.get_relative_path(path_ds) )
+            self.save_image(sample_ds, path_ds, 
+                            compression_level=_DS_COMPRESSION_LEVEL)
         
     
     
     
-    def save_image_ds(self, index, sample_ds):
+    def save_image_ds(self, index, sample_ds, ds_exists=None):
+        """
+        Save downsampled image sample_ds to its ds path at index
         
+        The image is only saved if the ds path does not exist - ds_exists may 
+        be passed by callers that have already checked this, so the path is 
+        not checked again.
+        """
         if (self.downsampling_img == 'source'):
             # source_images
-            if self.source_image_paths_ds[index].exists() == False:
-                self.print_and_log('    saving source downsampled image : ' 
-                   + self.get_relative_path(
-                       self.source_image_paths_ds[index]) )
-                
-                self.save_image(sample_ds, 
-                                 self.source_image_paths_ds[index] )
-                
-            
+            path_ds = self.source_image_paths_ds[index]
         elif (self.downsampling_img == 'target'):
             # target_images
-            if self.target_image_paths_ds[index].exists() == False:
-                self.print_and_log('    saving target downsampled image : ' 
-                   + self.get_relative_path(
-                       self.target_image_paths_ds[index]) )
-                
-                self.save_image(sample_ds, 
-                                 self.target_image_paths_ds[index] )
+            path_ds = self.target_image_paths_ds[index]
+        else:
+            return
+        
+        if ds_exists is None:
+            ds_exists = path_ds.exists()
+        if not ds_exists:
+            self.print_and_log('    saving ' + self.downsampling_img + 
+                               ' downsampled image : ' + 
+                               self.get_relative_path(path_ds) )
+            self.save_image(sample_ds, path_ds, 
+                            compression_level=_DS_COMPRESSION_LEVEL)
         
     
     
@@ -2535,246 +2711,14 @@ class BrainRegister(object):
     
     def register_source_to_target(self):
         
-        self.print_and_log('')
-        self.print_and_log('')
-        self.print_and_log('================')
-        self.print_and_log('SOURCE TO TARGET')
-        self.print_and_log('================')
-        self.print_and_log('')
+        self.print_and_log(_BANNER_S2T)
         
         
         if self.src_tar_pm_files_exist() is False:
             # if the param files do not exist, generate them by registering
             # src template to tar template (using the correct downsampled stack!)
+            self._register_templates('source', 'target')
             
-            
-            if (self.downsampling_img == 'source'):
-                # source image is downsampled to target img resolution
-                # so use this to register to target img
-                
-                if self.source_template_img_ds == None:
-                    
-                    if self.source_template_path_ds.exists() == True:
-                        
-                        self.print_and_log('  loading ds source template image : '+ 
-                                        self.source_template_path_ds.name)
-                        self.source_template_img_ds = self.load_image(self.source_template_path_ds)
-                    else:
-                        self.print_and_log('  ds source template image does not exist -'+
-                                ' generating from source template')
-                        self.source_template_img_ds = self.get_template_ds()
-                
-                
-                if self.target_template_img == None:
-                    
-                    self.print_and_log('  loading target template image : '+ 
-                                      self.target_template_path.name)
-                    self.target_template_img = self.load_image(self.target_template_path)
-                
-                
-                # apply source-to-target filter - if requested in brp and not performed already
-                self.src_tar_prefiltering()
-                    
-                
-                if self.src_tar_prefiltered == False: # if src_tar_filter is set to 'none'
-                    # REGISTRATION - use unfiltered images
-                    self.print_and_log('  registering source to target..')
-                    self.print_and_log('    source : ' + 
-                                self.get_relative_path(self.source_template_path_ds) )
-                    self.print_and_log('    target : ' + 
-                                self.get_relative_path(self.target_template_path) )
-                    self.print_and_log('')
-                    self.print_and_log('========================================================================')
-                    self.print_and_log('')
-                    self.print_and_log('')
-                    self.register_image(self.source_template_img_ds, 
-                                        self.target_template_img, 
-                                        self.src_tar_ep )
-                    # FREE MEMORY
-                    self.target_template_img = None
-                    self.source_template_img_ds = None
-                    garbage = gc.collect() # run garbage collection to ensure memory is freed
-                    
-                elif self.src_tar_prefiltered == True:
-                    # FREE MEMORY of unfiltered images FIRST
-                    self.target_template_img = None
-                    self.source_template_img_ds = None
-                    garbage = gc.collect() # run garbage collection to ensure memory is freed
-                    # REGISTRATION - use filt images
-                    self.print_and_log('  registering source to target after prefilter..')
-                    self.print_and_log('    source : ' + 
-                                self.get_relative_path(self.source_template_path_ds) )
-                    self.print_and_log('    target : ' + 
-                                self.get_relative_path(self.target_template_path) )
-                    self.print_and_log('')
-                    self.print_and_log('========================================================================')
-                    self.print_and_log('')
-                    self.print_and_log('')
-                    self.register_image(self.source_template_img_ds_filt, 
-                                        self.target_template_img_filt,
-                                        self.src_tar_ep )
-                    # FREE MEMORY
-                    self.source_template_img_ds_filt = None
-                    self.target_template_img_filt = None
-                    garbage = gc.collect() # run garbage collection to ensure memory is freed
-                
-                self.print_and_log('  saving source to target parameter map file[s]..')
-                self.save_pm_files( self.src_tar_pm_paths )
-                
-                
-                
-            if (self.downsampling_img == 'target'):
-                # target image is downsampled to source img resolution
-                # so use source to register to ds target img
-                 
-                if self.source_template_img == None:
-                     
-                     self.print_and_log( str('  loading source template image : '+ 
-                                       self.source_template_path.name) )
-                     self.source_template_img = sitk.ReadImage( 
-                                                 str(self.source_template_path) )
-                     self.source_template_img.SetSpacing( tuple([1.0, 1.0, 1.0]) )
-                
-                
-                if self.target_template_img_ds == None:
-                    
-                    if self.target_template_path_ds.exists() == True:
-                        
-                        self.print_and_log( str('  loading ds target template image : '+ 
-                                        self.target_template_path_ds.name) )
-                        self.target_template_img_ds = sitk.ReadImage( 
-                                             str(self.target_template_path_ds) )
-                        self.target_template_img_ds.SetSpacing( 
-                                                        tuple([1.0, 1.0, 1.0]) )
-                    else:
-                        self.print_and_log('  ds target template image does not exist -'+
-                                ' generating from target template')
-                        self.target_template_img_ds = self.get_template_ds()
-                
-                
-                # apply source-to-target filter - if requested in brp and not performed already
-                self.src_tar_prefiltering()
-                    
-                
-                if self.src_tar_prefiltered == False: # if src_tar_filter is set to 'none'
-                    # REGISTRATION - use unfiltered images
-                    self.print_and_log('  registering source to target..')
-                    self.print_and_log('    source : ' + 
-                                self.get_relative_path(self.source_template_path) )
-                    self.print_and_log('    target : ' + 
-                                self.get_relative_path(self.target_template_path_ds) )
-                    self.print_and_log('')
-                    self.print_and_log('========================================================================')
-                    self.print_and_log('')
-                    self.print_and_log('')
-                    self.register_image(self.source_template_img, 
-                                        self.target_template_img_ds, 
-                                        self.src_tar_ep )
-                    # FREE MEMORY
-                    self.source_template_img = None 
-                    self.target_template_img_ds = None
-                    garbage = gc.collect() # run garbage collection to ensure memory is freed
-                    
-                elif self.src_tar_prefiltered == True:
-                    # FREE MEMORY
-                    self.source_template_img = None 
-                    self.target_template_img_ds = None
-                    garbage = gc.collect() # run garbage collection to ensure memory is freed
-                    # REGISTRATION - use filt images
-                    self.print_and_log('  registering source to target after prefilter..')
-                    self.print_and_log('    source : ' + 
-                                self.get_relative_path(self.source_template_path) )
-                    self.print_and_log('    target : ' + 
-                                self.get_relative_path(self.target_template_path_ds) )
-                    self.print_and_log('')
-                    self.print_and_log('========================================================================')
-                    self.print_and_log('')
-                    self.print_and_log('')
-                    self.register_image(self.source_template_img_filt, 
-                                        self.target_template_img_ds_filt,
-                                        self.src_tar_ep )
-                    # FREE MEMORY
-                    self.source_template_img_filt = None 
-                    self.target_template_img_ds_filt = None
-                    garbage = gc.collect() # run garbage collection to ensure memory is freed
-                
-                self.print_and_log('  saving source to target parameter map file[s]..')
-                self.save_pm_files( self.src_tar_pm_paths )
-                
-                
-                
-            if (self.downsampling_img == 'none'):
-                # target image is source img resolution
-                # so use source to register to target img
-                
-                if self.source_template_img == None:
-                    
-                    self.print_and_log('  loading source template image : '+ 
-                                      self.source_template_path.name)
-                    self.source_template_img = sitk.ReadImage( 
-                                                str(self.source_template_path) )
-                    self.source_template_img.SetSpacing( tuple([1.0, 1.0, 1.0]) )
-                
-                
-                if self.target_template_img == None:
-                    
-                    self.print_and_log('  loading target template image : '+ 
-                                      self.target_template_path.name)
-                    self.target_template_img = sitk.ReadImage( 
-                                                str(self.target_template_path) )
-                    self.target_template_img.SetSpacing( tuple([1.0, 1.0, 1.0]) )
-                
-                
-                # apply source-to-target filter - if requested in brp and not performed already
-                self.src_tar_prefiltering()
-                    
-                
-                if self.src_tar_prefiltered == False: # if src_tar_filter is set to 'none'
-                    # REGISTRATION - use unfiltered images
-                    self.print_and_log('  registering source to target..')
-                    self.print_and_log('    source : ' + 
-                                self.get_relative_path(self.source_template_path) )
-                    self.print_and_log('    target : ' + 
-                                self.get_relative_path(self.target_template_path) )
-                    self.print_and_log('')
-                    self.print_and_log('========================================================================')
-                    self.print_and_log('')
-                    self.print_and_log('')
-                    self.register_image(self.source_template_img, 
-                                        self.target_template_img, 
-                                        self.src_tar_ep )
-                    # FREE MEMORY
-                    self.source_template_img = None
-                    self.target_template_img = None
-                    garbage = gc.collect() # run garbage collection to ensure memory is freed
-                    
-                elif self.src_tar_prefiltered == True:
-                    # FREE MEMORY
-                    self.source_template_img = None
-                    self.target_template_img = None
-                    garbage = gc.collect() # run garbage collection to ensure memory is freed
-                    # REGISTRATION - use filt images
-                    self.print_and_log('  registering source to target after prefilter..')
-                    self.print_and_log('    source : ' + 
-                                self.get_relative_path(self.source_template_path) )
-                    self.print_and_log('    target : ' + 
-                                self.get_relative_path(self.target_template_path) )
-                    self.print_and_log('')
-                    self.print_and_log('========================================================================')
-                    self.print_and_log('')
-                    self.print_and_log('')
-                    self.register_image(self.source_template_img_filt, 
-                                        self.target_template_img_filt, 
-                                        self.src_tar_ep )
-                    # FREE MEMORY
-                    self.source_template_img_filt = None
-                    self.target_template_img_filt = None
-                    garbage = gc.collect() # run garbage collection to ensure memory is freed
-                
-                self.print_and_log('  saving source to target parameter map file[s]..')
-                self.save_pm_files( self.src_tar_pm_paths )
-                
-                
         else:
             self.print_and_log('  source to target parameter map file[s] already exist : No Registration')
             
@@ -2785,522 +2729,203 @@ class BrainRegister(object):
     
     def register_target_to_source(self):
         
-        self.print_and_log('')
-        self.print_and_log('')
-        self.print_and_log('================')
-        self.print_and_log('TARGET TO SOURCE')
-        self.print_and_log('================')
-        self.print_and_log('')
+        self.print_and_log(_BANNER_T2S)
         
         
         if self.tar_src_pm_files_exist() is False:
             # if the param files do not exist, generate them by registering
             # tar template to src template (using the correct downsampled stack!)
+            self._register_templates('target', 'source')
             
-            
-            if (self.downsampling_img == 'source'):
-                # source image is downsampled to target img resolution
-                # register target to downsampled source image
-                
-                if self.source_template_img_ds == None:
-                    
-                    if self.source_template_path_ds.exists() == True:
-                        
-                        self.print_and_log('  loading ds source template image : '+ 
-                                        self.source_template_path_ds.name)
-                        self.source_template_img_ds = self.load_image(self.source_template_path_ds)
-                    else:
-                        self.print_and_log('  ds source template image does not exist -'+
-                                ' generating from source template')
-                        self.source_template_img_ds = self.get_template_ds()
-                
-                
-                if self.target_template_img == None:
-                    
-                    self.print_and_log('  loading target template image : '+ 
-                                      self.target_template_path.name)
-                    self.target_template_img = self.load_image(self.target_template_path)
-                
-                
-                # apply target-to-source filter - if requested in brp and not performed already
-                self.tar_src_prefiltering()
-                    
-                
-                if self.tar_src_prefiltered == False: # if src_tar_filter is set to 'none'
-                    # REGISTRATION - use unfiltered images
-                    self.print_and_log('  registering target to source..')
-                    self.print_and_log('    target : ' + 
-                                self.get_relative_path(self.target_template_path) )
-                    self.print_and_log('    source : ' + 
-                                self.get_relative_path(self.source_template_path_ds) )
-                    self.print_and_log('')
-                    self.print_and_log('========================================================================')
-                    self.print_and_log('')
-                    self.print_and_log('')
-                    self.register_image( self.target_template_img, 
-                                        self.source_template_img_ds, 
-                                        self.tar_src_ep )
-                    # FREE MEMORY
-                    self.target_template_img = None
-                    self.source_template_img_ds = None
-                    garbage = gc.collect() # run garbage collection to ensure memory is freed
-                    
-                elif self.tar_src_prefiltered == True:
-                    # FREE MEMORY
-                    self.target_template_img = None
-                    self.source_template_img_ds = None
-                    garbage = gc.collect() # run garbage collection to ensure memory is freed
-                    # REGISTRATION - use filt images
-                    self.print_and_log('  registering target to source after prefilter..')
-                    self.print_and_log('    target : ' + 
-                                self.get_relative_path(self.target_template_path) )
-                    self.print_and_log('    source : ' + 
-                                self.get_relative_path(self.source_template_path_ds) )
-                    self.print_and_log('')
-                    self.print_and_log('========================================================================')
-                    self.print_and_log('')
-                    self.print_and_log('')
-                    self.register_image(self.target_template_img_filt, 
-                                        self.source_template_img_ds_filt, 
-                                        self.tar_src_ep )
-                    # FREE MEMORY
-                    self.target_template_img_filt = None
-                    self.source_template_img_ds_filt = None
-                    garbage = gc.collect() # run garbage collection to ensure memory is freed
-                
-                self.print_and_log('  saving target to source parameter map file[s]..')
-                self.save_pm_files( self.tar_src_pm_paths )
-                
-                
-                
-            if (self.downsampling_img == 'target'):
-                # target image is downsampled to source img resolution
-                # so use source to register to ds target img
-                 
-                if self.source_template_img == None:
-                     
-                     self.print_and_log('  loading source template image : '+ 
-                                       self.source_template_path.name)
-                     self.source_template_img = self.load_image(self.source_template_path)
-                
-                
-                if self.target_template_img_ds == None:
-                    
-                    if self.target_template_path_ds.exists() == True:
-                        
-                        self.print_and_log('  loading ds target template image : '+ 
-                                        self.target_template_path_ds.name)
-                        self.target_template_img_ds = self.load_image(self.target_template_path_ds)
-                    else:
-                        self.print_and_log('  ds target template image does not exist -'+
-                                ' generating from target template')
-                        self.target_template_img_ds = self.get_template_ds()
-                
-                
-                # apply target-to-source filter - if requested in brp and not performed already
-                self.tar_src_prefiltering()
-                    
-                
-                if self.tar_src_prefiltered == False: # if src_tar_filter is set to 'none'
-                    # REGISTRATION - use unfiltered images
-                    self.print_and_log('  registering target to source..')
-                    self.print_and_log('    target : ' + 
-                                self.get_relative_path(self.target_template_path_ds) )
-                    self.print_and_log('    source : ' + 
-                                self.get_relative_path(self.source_template_path) )
-                    self.print_and_log('')
-                    self.print_and_log('========================================================================')
-                    self.print_and_log('')
-                    self.print_and_log('')
-                    self.register_image(self.target_template_img_ds, 
-                                        self.source_template_img,
-                                        self.tar_src_ep )
-                    # FREE MEMORY
-                    self.target_template_img_ds = None
-                    self.source_template_img = None
-                    garbage = gc.collect() # run garbage collection to ensure memory is freed
-                    
-                elif self.tar_src_prefiltered == True:
-                    # FREE MEMORY
-                    self.target_template_img_ds = None
-                    self.source_template_img = None
-                    garbage = gc.collect() # run garbage collection to ensure memory is freed
-                    # REGISTRATION - use filt images
-                    self.print_and_log('  registering target to source after prefilter..')
-                    self.print_and_log('    target : ' + 
-                                self.get_relative_path(self.target_template_path_ds) )
-                    self.print_and_log('    source : ' + 
-                                self.get_relative_path(self.source_template_path) )
-                    self.print_and_log('')
-                    self.print_and_log('========================================================================')
-                    self.print_and_log('')
-                    self.print_and_log('')
-                    self.register_image(self.target_template_img_ds_filt, 
-                                        self.source_template_img_filt, 
-                                        self.tar_src_ep )
-                    # FREE MEMORY
-                    self.target_template_img_ds_filt = None
-                    self.source_template_img_filt = None
-                    garbage = gc.collect() # run garbage collection to ensure memory is freed
-                
-                self.print_and_log('  saving source to target parameter map file[s]..')
-                self.save_pm_files( self.tar_src_pm_paths )
-                
-                
-                
-            if (self.downsampling_img == 'none'):
-                # target image is source img resolution
-                # so use source to register to target img
-                
-                if self.source_template_img == None:
-                    
-                    self.print_and_log('  loading source template image : '+ 
-                                      self.source_template_path.name)
-                    self.source_template_img = self.load_image(self.source_template_path)
-                
-                
-                if self.target_template_img == None:
-                    
-                    self.print_and_log('  loading target template image : '+ 
-                                      self.target_template_path.name)
-                    self.target_template_img = self.load_image(self.target_template_path)
-                
-                
-                # apply target-to-source filter - if requested in brp and not performed already
-                self.tar_src_prefiltering()
-                    
-                
-                if self.tar_src_prefiltered == False: # if src_tar_filter is set to 'none'
-                    # REGISTRATION - use unfiltered images
-                    self.print_and_log('  registering target to source..')
-                    self.print_and_log('    target : ' + 
-                                self.get_relative_path(self.target_template_path) )
-                    self.print_and_log('    source : ' + 
-                                self.get_relative_path(self.source_template_path) )
-                    self.print_and_log('')
-                    self.print_and_log('========================================================================')
-                    self.print_and_log('')
-                    self.print_and_log('')
-                    self.register_image(self.target_template_img, 
-                                        self.source_template_img, 
-                                        self.tar_src_ep )
-                    # FREE MEMORY
-                    self.target_template_img = None
-                    self.source_template_img = None
-                    garbage = gc.collect() # run garbage collection to ensure memory is freed
-                    
-                elif self.tar_src_prefiltered == True:
-                    # FREE MEMORY
-                    self.target_template_img = None
-                    self.source_template_img = None
-                    garbage = gc.collect() # run garbage collection to ensure memory is freed
-                    # REGISTRATION - use filt images
-                    self.print_and_log('  registering target to source after prefilter..')
-                    self.print_and_log('    target : ' + 
-                                self.get_relative_path(self.target_template_path) )
-                    self.print_and_log('    source : ' + 
-                                self.get_relative_path(self.source_template_path) )
-                    self.print_and_log('')
-                    self.print_and_log('========================================================================')
-                    self.print_and_log('')
-                    self.print_and_log('')
-                    self.register_image(self.target_template_img_filt,
-                                        self.source_template_img_filt, 
-                                        self.tar_src_ep )
-                    # FREE MEMORY
-                    self.target_template_img_filt = None
-                    self.source_template_img_filt = None
-                    garbage = gc.collect() # run garbage collection to ensure memory is freed
-                
-                self.print_and_log('  saving source to target parameter map file[s]..')
-                self.save_pm_files( self.tar_src_pm_paths )
-                
-                
         else:
             self.print_and_log('  target to source parameter map file[s] already exist : No Registration')
             
             
+    
+    
+    
+    def _template_attr_path(self, kind):
+        # template image attribute and path for kind (source or target) in the
+         # space used for registration : downsampled if kind is downsampled
+        if self.downsampling_img == kind:
+            return kind + '_template_img_ds', getattr(self, kind + '_template_path_ds')
+        return kind + '_template_img', getattr(self, kind + '_template_path')
+    
+    
+    
+    def _ensure_template_loaded(self, kind):
+        """
+        Load the kind (source or target) template in registration space
+        
+        Only loads if the image is not already held : the downsampled template
+        is loaded from its saved file, or generated with get_template_ds() if
+        this does not exist.
+        """
+        attr, path = self._template_attr_path(kind)
+        if getattr(self, attr) is not None:
+            return
+        
+        if self.downsampling_img != kind:
+            self.print_and_log('  loading ' + kind + ' template image : '+ 
+                              path.name)
+            setattr(self, attr, self.load_image(path) )
+        
+        elif path.exists():
+            self.print_and_log('  loading ds ' + kind + ' template image : '+ 
+                            path.name)
+            setattr(self, attr, self.load_image(path) )
+        else:
+            self.print_and_log('  ds ' + kind + ' template image does not exist -'+
+                    ' generating from ' + kind + ' template')
+            setattr(self, attr, self.get_template_ds(ds_exists=False) )
+    
+    
+    
+    def _register_templates(self, moving, fixed):
+        """
+        Register the moving template to the fixed template and save the pms
         
+        moving and fixed are 'source' and 'target' in either order.  Each 
+        template is used in downsampled space if it is the downsampled image, 
+        and filtered first if the prefilter for this direction is requested.
+        """
+        prefix = 'src_tar' if moving == 'source' else 'tar_src'
+        
+        # a template registered to itself gives the identity transform - write 
+         # identity pm files on the fixed template grid without loading the 
+         # templates or running elastix.  Only without downsampling : otherwise
+         # one template is registered in downsampled space, on another grid
+        if ( self._ds_mode == _DS_NONE and 
+             _same_file(self.source_template_path, self.target_template_path) ):
+            self.print_and_log('  ' + moving + ' and ' + fixed + 
+                               ' templates are the same file : identity transform')
+            self.print_and_log('  saving ' + moving + ' to ' + fixed + ' parameter map file[s]..')
+            ep = getattr(self, prefix + '_ep')
+            identity = _identity_pm( getattr(self, fixed + '_template_path'), 
+                                     dict(ep[len(ep) - 1]) if len(ep) else None )
+            for pm_path in getattr(self, prefix + '_pm_paths'):
+                _write_pm_file(identity, pm_path)
+            self._pm_files_exist[prefix] = True
+            return
+        
+        # load in source then target order - unless both are held already 
+         # filtered with this direction's filter, see the FREE MEMORY step below
+        if not ( self._prefilter_string == self.brp[moving + '-to-' + fixed + '-filter'] and 
+                 all( getattr(self, self._template_attr_path(kind)[0] + '_filt') is not None 
+                      for kind in ('source', 'target') ) ):
+            self._ensure_template_loaded('source')
+            self._ensure_template_loaded('target')
+        
+        # apply prefilter for this direction - if requested in brp and not performed already
+        getattr(self, prefix + '_prefiltering')()
+        
+        moving_attr, moving_path = self._template_attr_path(moving)
+        fixed_attr, fixed_path = self._template_attr_path(fixed)
+        
+        if getattr(self, prefix + '_prefiltered'):
+            # FREE MEMORY of unfiltered images FIRST
+            setattr(self, moving_attr, None)
+            setattr(self, fixed_attr, None)
+            garbage = gc.collect() # run garbage collection to ensure memory is freed
+            # REGISTRATION - use filt images
+            moving_attr, fixed_attr = moving_attr + '_filt', fixed_attr + '_filt'
+            self.print_and_log('  registering ' + moving + ' to ' + fixed + ' after prefilter..')
+        else: # if the prefilter is set to 'none'
+            # REGISTRATION - use unfiltered images
+            self.print_and_log('  registering ' + moving + ' to ' + fixed + '..')
+        
+        self.print_and_log('    ' + moving + ' : ' + self.get_relative_path(moving_path) )
+        self.print_and_log('    ' + fixed + ' : ' + self.get_relative_path(fixed_path) )
+        self.print_and_log(_BANNER_END)
+        # elastix writes to its own temporary directory - not the working 
+         # directory, where another registration could write the same file names
+        with tempfile.TemporaryDirectory(prefix='brainregister_elastix_') as elastix_dir:
+            self.register_image(getattr(self, moving_attr), 
+                                getattr(self, fixed_attr), 
+                                getattr(self, prefix + '_ep'), 
+                                output_dir=elastix_dir )
+            # FREE MEMORY - but keep filtered templates that the other direction 
+             # would filter again with the same filter, if it is still to register
+            other = 'tar_src' if prefix == 'src_tar' else 'src_tar'
+            if not ( getattr(self, prefix + '_prefiltered') and 
+                     self.brp[fixed + '-to-' + moving + '-filter'] == 
+                         self.brp[moving + '-to-' + fixed + '-filter'] and 
+                     not getattr(self, other + '_pm_files_exist')() ):
+                setattr(self, moving_attr, None)
+                setattr(self, fixed_attr, None)
+                garbage = gc.collect() # run garbage collection to ensure memory is freed
+            
+            self.print_and_log('  saving ' + moving + ' to ' + fixed + ' parameter map file[s]..')
+            self.save_pm_files( getattr(self, prefix + '_pm_paths'), 
+                                output_dir=elastix_dir )
+        self._pm_files_exist[prefix] = True
     
     
     
     
     
     def src_tar_prefiltering(self):
-        
-        if (self.downsampling_img == 'source'):
-            # source image is downsampled to target img resolution
-        
-            if self.brp['source-to-target-filter'] != "none":
-                
-                self.print_and_log('  running source to target prefilter..')
-                self.src_tar_filter_pipeline = self.compute_adaptive_filter(
-                                            self.brp['source-to-target-filter'] )
-                
-                
-                if self.source_template_img_ds_filt != None:
-                    if self.src_tar_prefiltered: # already correctly filtered!
-                        self.print_and_log('    ds source template')
-                    else: # filter correctly
-                        self.print_and_log('    ds source template')
-                        self.source_template_img_ds_filt = self.apply_adaptive_filter(
-                                                    self.source_template_img_ds, 
-                                                    self.src_tar_filter_pipeline )
-                else: # no filtered image exists!
-                    self.print_and_log('    ds source template')
-                    self.source_template_img_ds_filt = self.apply_adaptive_filter(
-                                                self.source_template_img_ds, 
-                                                self.src_tar_filter_pipeline )
-                    
-                
-                if self.target_template_img_filt != None:
-                    if self.src_tar_prefiltered: # already correctly filtered!
-                        self.print_and_log('    target template')
-                    else: # filter correctly
-                        self.print_and_log('    target template')
-                        self.target_template_img_filt = self.apply_adaptive_filter(
-                                                    self.target_template_img, 
-                                                    self.src_tar_filter_pipeline )
-                else: # no filtered image exists!
-                    self.print_and_log('    target template')
-                    self.target_template_img_filt = self.apply_adaptive_filter(
-                                                self.target_template_img, 
-                                                self.src_tar_filter_pipeline )
-                
-                # set bools to indicate filtering
-                self.src_tar_prefiltered = True
-                self.tar_src_prefiltered = False
-                
-            else: # no src-to-tar filtering, log this
-                self.print_and_log('  no source to target prefilter..')
-                
-                
-                
-        elif (self.downsampling_img == 'target'):
-            # target image is downsampled to source img resolution
-        
-            if self.brp['source-to-target-filter'] != "none":
-                
-                self.print_and_log('  running source to target prefilter..')
-                self.src_tar_filter_pipeline = self.compute_adaptive_filter(
-                                            self.brp['source-to-target-filter'] )
-                
-                
-                if self.source_template_img_filt != None:
-                    if self.src_tar_prefiltered: # already correctly filtered!
-                        self.print_and_log('    source template')
-                    else: # filter correctly
-                        self.print_and_log('    source template')
-                        self.source_template_img_filt = self.apply_adaptive_filter(
-                                                    self.source_template_img, 
-                                                    self.src_tar_filter_pipeline )
-                else: # no filtered image exists!
-                    self.print_and_log('    source image')
-                    self.source_template_img_filt = self.apply_adaptive_filter(
-                                                self.source_template_img, 
-                                                self.src_tar_filter_pipeline )
-                    
-                
-                if self.target_template_img_ds_filt != None:
-                    if self.src_tar_prefiltered: # already correctly filtered!
-                        self.print_and_log('    ds target template') # just log as if filtering took place
-                    else: # filter correctly
-                        self.print_and_log('    ds target template')
-                        self.target_template_img_ds_filt = self.apply_adaptive_filter(
-                                                    self.target_template_img_ds, 
-                                                    self.src_tar_filter_pipeline )
-                else: # no filtered image exists!
-                    self.print_and_log('    ds target template')
-                    self.target_template_img_ds_filt = self.apply_adaptive_filter(
-                                                self.target_template_img_ds, 
-                                                self.src_tar_filter_pipeline )
-                
-                # set bools to indicate filtering
-                self.src_tar_prefiltered = True
-                self.tar_src_prefiltered = False
-                
-            else: # no src-to-tar filtering, log this
-                self.print_and_log('  no source to target prefilter..')
-                
-                
-        elif (self.downsampling_img == 'none'):
-            # target image & source img same resolution!
-            # so no downsampling to use!
-            if self.brp['source-to-target-filter'] != "none":
-                
-                self.print_and_log('  running source to target prefilter..')
-                self.src_tar_filter_pipeline = self.compute_adaptive_filter(
-                                            self.brp['source-to-target-filter'] )
-                
-                if self.source_template_img_filt != None:
-                    if self.src_tar_prefiltered: # already correctly filtered!
-                        self.print_and_log('    source template')
-                    else: # filter correctly
-                        self.print_and_log('    source template')
-                        self.source_template_img_filt = self.apply_adaptive_filter(
-                                                    self.source_template_img, 
-                                                    self.src_tar_filter_pipeline )
-                else: # no filtered image exists!
-                    self.print_and_log('    source image')
-                    self.source_template_img_filt = self.apply_adaptive_filter(
-                                                self.source_template_img, 
-                                                self.src_tar_filter_pipeline )
-                    
-                
-                if self.target_template_img_filt != None:
-                    if self.src_tar_prefiltered: # already correctly filtered!
-                        self.print_and_log('    target template')
-                    else: # filter correctly
-                        self.print_and_log('    target template')
-                        self.target_template_img_filt = self.apply_adaptive_filter(
-                                                    self.target_template_img, 
-                                                    self.src_tar_filter_pipeline )
-                else: # no filtered image exists!
-                    self.print_and_log('    target template')
-                    self.target_template_img_filt = self.apply_adaptive_filter(
-                                                self.target_template_img, 
-                                                self.src_tar_filter_pipeline )
-                
-                # set bools to indicate filtering
-                self.src_tar_prefiltered = True
-                self.tar_src_prefiltered = False
-                
-            else: # no src-to-tar filtering, log this
-                self.print_and_log('  no source to target prefilter..')
-                
-                
+        self._prefiltering('src_tar')
     
     
     
     def tar_src_prefiltering(self):
+        self._prefiltering('tar_src')
+    
+    
+    
+    def _prefiltering(self, direction):
+        """
+        Prefilter the source and target templates for direction
         
-        if self.brp['target-to-source-filter'] != "none":
-            
-            self.print_and_log('  running target to source prefilter..')
-            self.tar_src_filter_pipeline = self.compute_adaptive_filter(
-                                        self.brp['target-to-source-filter'] )
-            
-            # now run on images depending on which were downsampled
-            
-            if (self.downsampling_img == 'source'):
-                # source image is downsampled to target img resolution
-                
-                
-                if self.source_template_img_ds_filt != None:
-                    if self.src_tar_prefiltered: # already correctly filtered!
-                        self.print_and_log('    ds source template')
-                    else: # filter correctly
-                        self.print_and_log('    ds source template')
-                        self.source_template_img_ds_filt = self.apply_adaptive_filter(
-                                                    self.source_template_img_ds, 
-                                                    self.tar_src_filter_pipeline )
-                else: # no filtered image exists!
-                    self.print_and_log('    ds source template')
-                    self.source_template_img_ds_filt = self.apply_adaptive_filter(
-                                                self.source_template_img_ds, 
-                                                self.tar_src_filter_pipeline )
-                    
-                
-                if self.target_template_img_filt != None:
-                    if self.src_tar_prefiltered: # already correctly filtered!
-                        self.print_and_log('    target template')
-                    else: # filter correctly
-                        self.print_and_log('    target template')
-                        self.target_template_img_filt = self.apply_adaptive_filter(
-                                                    self.target_template_img, 
-                                                    self.tar_src_filter_pipeline )
-                else: # no filtered image exists!
-                    self.print_and_log('    target template')
-                    self.target_template_img_filt = self.apply_adaptive_filter(
-                                                self.target_template_img, 
-                                                self.tar_src_filter_pipeline )
-                
-                # set bools to indicate filtering
-                self.src_tar_prefiltered = False
-                self.tar_src_prefiltered = True
-                
-                
-                
-                
-            elif (self.downsampling_img == 'target'):
-            # target image is downsampled to source img resolution
-                
-                
-                if self.source_template_img_filt != None:
-                    if self.src_tar_prefiltered: # already correctly filtered!
-                        self.print_and_log('    source template')
-                    else: # filter correctly
-                        self.print_and_log('    source template')
-                        self.source_template_img_filt = self.apply_adaptive_filter(
-                                                    self.source_template_img, 
-                                                    self.tar_src_filter_pipeline )
-                else: # no filtered image exists!
-                    self.print_and_log('    source image')
-                    self.source_template_img_filt = self.apply_adaptive_filter(
-                                                self.source_template_img, 
-                                                self.tar_src_filter_pipeline )
-                    
-                
-                if self.target_template_img_ds_filt != None:
-                    if self.src_tar_prefiltered: # already correctly filtered!
-                        self.print_and_log('    target template')
-                    else: # filter correctly
-                        self.print_and_log('    target template')
-                        self.target_template_img_ds_filt = self.apply_adaptive_filter(
-                                                    self.target_template_img_ds, 
-                                                    self.tar_src_filter_pipeline )
-                else: # no filtered image exists!
-                    self.print_and_log('    target template')
-                    self.target_template_img_ds_filt = self.apply_adaptive_filter(
-                                                self.target_template_img_ds, 
-                                                self.tar_src_filter_pipeline )
-                
-                # set bools to indicate filtering
-                self.src_tar_prefiltered = False
-                self.tar_src_prefiltered = True
-                
-                
-            elif (self.downsampling_img == 'none'):
-                # target image & source img same resolution!
-                # so no downsampling to use!
-                
-                if self.source_template_img_filt != None:
-                    if self.src_tar_prefiltered: # already correctly filtered!
-                        self.print_and_log('    source template')
-                    else: # filter correctly
-                        self.print_and_log('    source template')
-                        self.source_template_img_filt = self.apply_adaptive_filter(
-                                                    self.source_template_img, 
-                                                    self.src_tar_filter_pipeline )
-                else: # no filtered image exists!
-                    self.print_and_log('    source image')
-                    self.source_template_img_filt = self.apply_adaptive_filter(
-                                                self.source_template_img, 
-                                                self.src_tar_filter_pipeline )
-                    
-                
-                if self.target_template_img_ds_filt != None:
-                    if self.src_tar_prefiltered: # already correctly filtered!
-                        self.print_and_log('    target template') # just log as if filtering took place
-                    else: # filter correctly
-                        self.print_and_log('    target template')
-                        self.target_template_img_filt = self.apply_adaptive_filter(
-                                                    self.target_template_img, 
-                                                    self.src_tar_filter_pipeline )
-                else: # no filtered image exists!
-                    self.print_and_log('    target template')
-                    self.target_template_img_filt = self.apply_adaptive_filter(
-                                                self.target_template_img, 
-                                                self.src_tar_filter_pipeline )
-                
-                # set bools to indicate filtering
-                self.src_tar_prefiltered = False
-                self.tar_src_prefiltered = True
-                
-        else: # no src-to-tar filtering, log this
-            self.print_and_log('  no source to target prefilter..')
-                
-                
+        direction is 'src_tar' or 'tar_src' : both templates are filtered in 
+        the space used for registration - downsampled if it is the downsampled
+        image - with the brp filter for this direction.  Filtered templates 
+        are kept, and only filtered again if they were last filtered for the
+        other direction.
+        """
+        moving, fixed = ('source', 'target') if direction == 'src_tar' else ('target', 'source')
+        filter_string = self.brp[moving + '-to-' + fixed + '-filter']
+        
+        if filter_string == "none": # no prefiltering, log this
+            self.print_and_log('  no ' + moving + ' to ' + fixed + ' prefilter..')
+            return
+        
+        self.print_and_log('  running ' + moving + ' to ' + fixed + ' prefilter..')
+        pipeline = self.compute_adaptive_filter(filter_string)
+        setattr(self, direction + '_filter_pipeline', pipeline)
+        # templates filtered with this same filter string - for either direction - are reused
+        already_filtered = (self._prefilter_string == filter_string)
+        
+        # each template in registration space - in source then target order
+        for kind in ('source', 'target'):
+            attr, _ = self._template_attr_path(kind)
+            self.print_and_log('    ' + ('ds ' if self.downsampling_img == kind else '') + 
+                               kind + ' template')
+            if already_filtered and getattr(self, attr + '_filt') is not None:
+                continue # already correctly filtered!
+            
+            # reuse a cached filtered template from a previous run
+            cache_path = self._template_filt_cache_path(kind, filter_string, pipeline)
+            if cache_path is not None and os.path.exists(cache_path):
+                self.print_and_log('      loading cached filtered template : ' + cache_path)
+                setattr(self, attr + '_filt', self._load_cache_image(cache_path) )
+                setattr(self, attr, None) # registration uses the filtered template
+                continue
+            
+            img_filt = self.apply_adaptive_filter(getattr(self, attr), pipeline)
+            setattr(self, attr + '_filt', img_filt)
+            # FREE MEMORY of the unfiltered template before filtering the next - 
+             # registration uses the filtered template, _ensure_template_loaded()
+             # reloads the unfiltered one if needed again
+            setattr(self, attr, None)
+            if cache_path is not None:
+                self._save_cache_image(img_filt, cache_path)
+        
+        # set bools to indicate filtering
+        self.src_tar_prefiltered = (direction == 'src_tar')
+        self.tar_src_prefiltered = (direction == 'tar_src')
+        self._prefilter_string = filter_string
     
     
     
@@ -3318,15 +2943,17 @@ class BrainRegister(object):
         
         parameterMapVector = sitk.VectorOfParameterMap()
         
+        # parsed files are shared via _PM_CACHE - each call gets its own copy
+         # to edit, so the same file is only parsed once for both directions
         for pf in param_files:
             
             if pf == 'brainregister:affine':
-                pm = sitk.ReadParameterFile(
+                pm = _read_pm_cached(
                          os.path.join(BRAINREGISTER_MODULE_DIR, 'resources', 
                                  'elastix-parameter-files', '01_affine.txt') )
                 
             elif pf == 'brainregister:bspline':
-                pm = sitk.ReadParameterFile(
+                pm = _read_pm_cached(
                          os.path.join(BRAINREGISTER_MODULE_DIR, 'resources', 
                                  'elastix-parameter-files', '02_bspline.txt') )
                 # CORRECT the FinalGridSpacingInVoxels
@@ -3335,7 +2962,7 @@ class BrainRegister(object):
                 pm['FinalGridSpacingInVoxels'] = ('10.000000', '10.000000', '10.000000')
                 
             else: # open relative file specified in pf
-                pm = sitk.ReadParameterFile( 
+                pm = _read_pm_cached( 
                       str(Path(os.path.join(str(self.brp_dir), pf)).resolve())
                 )
             
@@ -3346,7 +2973,8 @@ class BrainRegister(object):
         
     
     
-    def register_image(self, moving_img, fixed_img, parameter_map_vector):
+    def register_image(self, moving_img, fixed_img, parameter_map_vector, 
+                       output_dir='.'):
         
         # perform elastix registration
         elastixImageFilter = sitk.ElastixImageFilter()
@@ -3356,20 +2984,22 @@ class BrainRegister(object):
         
         elastixImageFilter.SetParameterMap(parameter_map_vector)
         
+        # elastix writes its TransformParameters and IterationInfo files here
+        elastixImageFilter.SetOutputDirectory( os.fspath(output_dir) )
+        
         elastixImageFilter.Execute()
         
-        # remove the registration logs
-        reg_logs = [f for f in os.listdir('.') if 
-                    os.path.isfile(f) & 
-                    os.path.basename(f).startswith("IterationInfo.")]
+        # remove the registration logs - scandir entries cache the file type,
+         # so no stat per file in the output directory
+        with os.scandir(output_dir) as entries:
+            reg_logs = [e.name for e in entries if 
+                        e.name.startswith("IterationInfo.") and 
+                        e.is_file(follow_symlinks=False)]
         for rl in reg_logs:
-            os.remove(rl)
+            os.remove( os.path.join(output_dir, rl) )
             
         
-        self.print_and_log('')
-        self.print_and_log('========================================================================')
-        self.print_and_log('')
-        self.print_and_log('')
+        self.print_and_log(_BANNER_END)
         
         # get the registered image
         #img = elastixImageFilter.GetResultImage()
@@ -3378,29 +3008,37 @@ class BrainRegister(object):
     
     
     
-    def save_pm_files(self, pm_paths):
+    def save_pm_files(self, pm_paths, output_dir='.'):
         
-        # move TransformParameters files to pm_paths
-        transform_params = [f for f in os.listdir('.') if os.path.isfile(f) & 
-                            os.path.basename(f).startswith("TransformParameters.")]
+        # move TransformParameters files from the elastix output_dir to pm_paths
+        with os.scandir(output_dir) as entries:
+            transform_params = [e.name for e in entries if 
+                                e.name.startswith("TransformParameters.") and 
+                                e.is_file(follow_symlinks=False)]
         
         transform_params.sort() # into ASCENDING ORDER
         
+        if not transform_params:
+            return
+        
+        # atomic rename when the elastix output_dir is on the same file system
+         # as the pm files - otherwise shutil.move copies across file systems!
+        pm_paths = [ os.fspath(pm) for pm in pm_paths ]
+        same_fs = ( os.stat(output_dir).st_dev == 
+                    os.stat(os.path.dirname(os.path.abspath(pm_paths[0]))).st_dev )
+        move = os.replace if same_fs else shutil.move
+        
         for i, tp in enumerate(transform_params):
-            shutil.move( tp, str(pm_paths[i]) ) # works across file systems!
-            #os.rename(tp, str(pm_paths[i]) )
+            move( os.path.join(output_dir, tp), pm_paths[i] )
         
         
     
     
     def load_pm_files(self, pm_paths ):
         
-        if pm_paths[0].exists() == True: # assume if first pm file exists they all do!
-            pms = []
-            for pm in pm_paths:
-                pms.append(sitk.ReadParameterFile( str(pm) ) )
-            
-            return pms
+        if os.path.exists(os.fspath(pm_paths[0])): # assume if first pm file exists they all do!
+            # parsed files are shared across instances via _PM_CACHE
+            return [ _read_pm_cached(pm) for pm in pm_paths ]
         else:
             return None # if doesnt exist return none - mainly for call in resolve_params()
         
@@ -3416,10 +3054,13 @@ class BrainRegister(object):
 
         """
         
-        exists = True
-        for pm in self.src_tar_pm_paths:
-            if pm.exists() is False:
-                exists = False
+        # checked once per instance - _register_templates() sets this to True
+         # once it has saved the pm files
+        exists = self._pm_files_exist.get('src_tar')
+        if exists is None:
+            # stops at the first missing file
+            exists = all( pm.exists() for pm in self.src_tar_pm_paths )
+            self._pm_files_exist['src_tar'] = exists
         
         return exists
         
@@ -3435,10 +3076,13 @@ class BrainRegister(object):
 
         """
         
-        exists = True
-        for pm in self.tar_src_pm_paths:
-            if pm.exists() is False:
-                exists = False
+        # checked once per instance - _register_templates() sets this to True
+         # once it has saved the pm files
+        exists = self._pm_files_exist.get('tar_src')
+        if exists is None:
+            # stops at the first missing file
+            exists = all( pm.exists() for pm in self.tar_src_pm_paths )
+            self._pm_files_exist['tar_src'] = exists
         
         return exists
         
@@ -3446,6 +3090,22 @@ class BrainRegister(object):
     
     def compute_adaptive_filter(self, filter_string):
         
+        # each filter string is parsed once - filter_image() keeps no state on
+         # the pipeline and builds new sitk filters per call, so one instance
+         # serves every call with this string, from any worker thread
+        if filter_string in self._filter_cache:
+            return self._filter_cache[filter_string]
+        filter_pipeline = self._compute_adaptive_filter(filter_string)
+        if filter_pipeline is not None:
+            # optional brp key - median prefilters on the GPU if cupy + cucim are installed
+            filter_pipeline.use_gpu = bool(self.brp.get('prefilter-gpu', False))
+        self._filter_cache[filter_string] = filter_pipeline
+        return filter_pipeline
+    
+    
+    
+    def _compute_adaptive_filter(self, filter_string):
+        
         if filter_string == 'brainregister:autofl-filter':
             # autofluorescence default filter is a radius 4 median filter
             return ImageFilterPipeline('M,4,4,4')
@@ -3466,11 +3126,9 @@ class BrainRegister(object):
         
         if filter_pipeline is not None:
             
-            filter_pipeline.set_image(img)
-            img = filter_pipeline.execute_pipeline()
-            filter_pipeline.dereference_image() # remove ref to raw data
-            
-            img = filter_pipeline.get_filtered_image()
+            # filter_image() keeps no ref to the raw or filtered data on the 
+             # pipeline - and is safe when images are processed in parallel
+            img = filter_pipeline.filter_image(img)
             
             filter_pipeline = None
             garbage = gc.collect() # prevent memory leak!
@@ -3488,9 +3146,9 @@ class BrainRegister(object):
         #if (self.downsampling_img == 'source'): 
         # NOT NEEDED as no refs to ds or raw image data/paths!
         
-        if self.brp['source-to-target-save-template'] == True:
+        if self.brp['source-to-target-save-template'] is True:
             
-            if self.source_template_path_target.exists() == False:
+            if not self.source_template_path_target.exists():
                 self.source_template_img_target = self.get_src_template_tar()
                 self.save_src_template_tar()
             else:
@@ -3504,84 +3162,85 @@ class BrainRegister(object):
             self.print_and_log('')
         
         
-        if self.brp['source-to-target-save-annotations'] == True:
-            
-            
-            if self.source_anno_path_target != []: # not a blank list
-                self.print_and_log('')
-                self.print_and_log('  source annotations to target : ')
-                self.print_and_log('')
-                for i,im_ds in enumerate(self.source_anno_path_target):
-                    # source_anno_path + _ds + _target all are SAME LENGTH!
-                    self.print_and_log('  annotation image ' + str(i))
-                    anno_img = self.get_src_anno_tar(i)
-                    # save to local var, do not hold onto refs with self.source_image_imgs_target[i].append()
-                    # user can use load_src_anno_tar() to do this!s
-                    self.save_src_anno_tar(i, anno_img)
-                    anno_img = None # GUARANTEE memory is freed
-                    garbage = gc.collect()
-            else:
-                self.print_and_log('')
-                self.print_and_log('  source annotations to target : no annotation images')
-                self.print_and_log('')
+        try:
+            if self.brp['source-to-target-save-annotations'] is True:
+                
+                
+                if self.source_anno_path_target: # not a blank list
+                    self.print_and_log('')
+                    self.print_and_log('  source annotations to target : ')
+                    self.print_and_log('')
+                    # each image in turn - or in a thread pool if the optional brp 
+                     # key transform-workers is above 1, see _process_ds_all()
+                    self._process_ds_all( functools.partial(self._transform_save, 
+                                              self.get_src_anno_tar, self.save_src_anno_tar, 
+                                              'annotation image'), 
+                                          list(range(len(self.source_anno_path_target))), 
+                                          'transform-workers' )
+                else:
+                    self.print_and_log('')
+                    self.print_and_log('  source annotations to target : no annotation images')
+                    self.print_and_log('')
+                    
+                
+                # ALSO SAVE the structure trees associated with the annos
+                if self.source_tree_path_target: # not a blank list
+                    self.print_and_log('')
+                    self.print_and_log('  source annotation structure tree to target : ')
+                    self.print_and_log('')
+                    for i,st_path in enumerate(self.source_tree_path):
+                        # source_anno_path + _ds + _target all are SAME LENGTH!
+                        if not self.source_tree_path_target[i].exists():
+                            self.print_and_log('  copying annotation structure tree to target ' + 
+                              self.get_relative_path(self.source_tree_path_target[i]))
+                            shutil.copy(st_path, self.source_tree_path_target[i])
+                        else:
+                            self.print_and_log('  annotation structure tree to target exists : ' + 
+                              self.get_relative_path(self.source_tree_path_target[i]))
+                        #anno_img = self.get_src_tree_tar(i)
+                        #self.save_src_tree_tar(i, anno_img)
+                else:
+                    self.print_and_log('')
+                    self.print_and_log('  source annotation structure trees to target : no trees to process')
+                    self.print_and_log('')
                 
-            
-            # ALSO SAVE the structure trees associated with the annos
-            if self.source_tree_path_target != []: # not a blank list
-                self.print_and_log('')
-                self.print_and_log('  source annotation structure tree to target : ')
-                self.print_and_log('')
-                for i,st_path in enumerate(self.source_tree_path):
-                    # source_anno_path + _ds + _target all are SAME LENGTH!
-                    if self.source_tree_path_target[i].exists() == False:
-                        self.print_and_log('  copying annotation structure tree to target ' + 
-                          str(self.source_tree_path_target[i].resolve()))
-                        shutil.copy(st_path, self.source_tree_path_target[i])
-                    else:
-                        self.print_and_log('  annotation structure tree to target exists : ' + 
-                          str(self.source_tree_path_target[i].resolve()))
-                    #anno_img = self.get_src_tree_tar(i)
-                    #self.save_src_tree_tar(i, anno_img)
             else:
                 self.print_and_log('')
-                self.print_and_log('  source annotation structure trees to target : no trees to process')
+                self.print_and_log('  saving source annotations to target : not requested')
                 self.print_and_log('')
             
-        else:
-            self.print_and_log('')
-            self.print_and_log('  saving source annotations to target : not requested')
-            self.print_and_log('')
-        
-        
-        if self.brp['source-to-target-save-images'] == True:
             
+            if self.brp['source-to-target-save-images'] is True:
+                
+                
+                if self.source_image_paths_target: # not a blank list
+                    self.print_and_log('')
+                    self.print_and_log('  source images to target :')
+                    self.print_and_log('')
+                    # each image in turn - or in a thread pool if the optional brp 
+                     # key transform-workers is above 1, see _process_ds_all()
+                    self._process_ds_all( functools.partial(self._transform_save, 
+                                              self.get_src_image_tar, self.save_src_image_tar, 
+                                              'source image'), 
+                                          list(range(len(self.source_image_paths_target))), 
+                                          'transform-workers' )
+                else:
+                    self.print_and_log('')
+                    self.print_and_log('  source images to target : no further images')
+                    self.print_and_log('')
             
-            if self.source_image_paths_target != []: # not a blank list
-                self.print_and_log('')
-                self.print_and_log('  source images to target :')
-                self.print_and_log('')
-                for i,im_ds in enumerate(self.source_image_paths_target):
-                    # source_image_path + _ds + _target all are SAME LENGTH!
-                    self.print_and_log('  source image ' + str(i))
-                    img_tar = self.get_src_image_tar(i)
-                    # save to local var, do not hold onto refs with self.source_image_imgs_target[i].append()
-                    # user can use load_src_images_tar() to do this!s
-                    self.save_src_image_tar(i, img_tar)
-                    img_Tar = None
-                    garbage = gc.collect()
             else:
                 self.print_and_log('')
-                self.print_and_log('  source images to target : no further images')
+                self.print_and_log('  saving source images to target : not requested')
                 self.print_and_log('')
-        
-        else:
-            self.print_and_log('')
-            self.print_and_log('  saving source images to target : not requested')
-            self.print_and_log('')
-            
+        finally:
+            # shut the worker pool down on errors too - see _process_ds_all()
+            self._shutdown_ds_pool()
         
         # discard from memory all images/martices not needed - just point vars to None
-        garbage = gc.collect() # run garbage collection to ensure memory is freed
+         # sitk images are freed as soon as their last reference is dropped
+        self.src_tar_pm = None
+        self.src_tar_pm_anno = None
         
         
     
@@ -3592,9 +3251,9 @@ class BrainRegister(object):
         #if (self.downsampling_img == 'source'): 
         # NOT NEEDED as no refs to ds or raw image data/paths!
         
-        if self.brp['target-to-source-save-template'] == True:
+        if self.brp['target-to-source-save-template'] is True:
             
-            if self.target_template_path_source.exists() == False:
+            if not self.target_template_path_source.exists():
                 self.target_template_img_source = self.get_tar_template_src()
                 self.save_tar_template_src()
             else:
@@ -3607,85 +3266,86 @@ class BrainRegister(object):
             self.print_and_log('')
         
         
-        if self.brp['target-to-source-save-annotations'] == True:
-            
-            
-            if self.target_anno_path_source != []: # not a blank list
-                self.print_and_log('')
-                self.print_and_log('  target annotations to source : ')
-                self.print_and_log('')
-                for i,im_ds in enumerate(self.target_anno_path_source):
-                    # source_anno_path + _ds + _target all are SAME LENGTH!
-                    self.print_and_log('  annotation image ' + str(i))
-                    anno_img = self.get_tar_anno_src(i)
-                    # save to local var, do not hold onto refs with self.source_image_imgs_target[i].append()
-                    # user can use load_src_anno_tar() to do this!s
-                    self.save_tar_anno_src(i, anno_img)
-                    anno_img = None
-                    garbage = gc.collect()
-            else:
-                self.print_and_log('')
-                self.print_and_log('  target annotations to source : no annotation images')
-                self.print_and_log('')
-            
+        try:
+            if self.brp['target-to-source-save-annotations'] is True:
+                
+                
+                if self.target_anno_path_source: # not a blank list
+                    self.print_and_log('')
+                    self.print_and_log('  target annotations to source : ')
+                    self.print_and_log('')
+                    # each image in turn - or in a thread pool if the optional brp 
+                     # key transform-workers is above 1, see _process_ds_all()
+                    self._process_ds_all( functools.partial(self._transform_save, 
+                                              self.get_tar_anno_src, self.save_tar_anno_src, 
+                                              'annotation image'), 
+                                          list(range(len(self.target_anno_path_source))), 
+                                          'transform-workers' )
+                else:
+                    self.print_and_log('')
+                    self.print_and_log('  target annotations to source : no annotation images')
+                    self.print_and_log('')
+                
+                
+                # ALSO SAVE the structure trees associated with the annos
+                if self.target_tree_path_source: # not a blank list
+                    self.print_and_log('')
+                    self.print_and_log('  target annotation structure tree to source : ')
+                    self.print_and_log('')
+                    for i,st_path in enumerate(self.target_tree_path):
+                        # source_anno_path + _ds + _target all are SAME LENGTH!
+                        if not self.target_tree_path_source[i].exists():
+                            self.print_and_log('  copying annotation structure tree to source ' + 
+                              self.get_relative_path(self.target_tree_path_source[i]))
+                            shutil.copy(st_path, self.target_tree_path_source[i])
+                        else:
+                            self.print_and_log('  annotation structure tree to source exists : ' + 
+                              self.get_relative_path(self.target_tree_path_source[i]))
+                        #anno_img = self.get_src_tree_tar(i)
+                        #self.save_src_tree_tar(i, anno_img)
+                else:
+                    self.print_and_log('')
+                    self.print_and_log('  target annotation structure trees to source : no trees to process')
+                    self.print_and_log('')
+                
             
-            # ALSO SAVE the structure trees associated with the annos
-            if self.target_tree_path_source != []: # not a blank list
-                self.print_and_log('')
-                self.print_and_log('  target annotation structure tree to source : ')
-                self.print_and_log('')
-                for i,st_path in enumerate(self.target_tree_path):
-                    # source_anno_path + _ds + _target all are SAME LENGTH!
-                    if self.target_tree_path_source[i].exists() == False:
-                        self.print_and_log('  copying annotation structure tree to source ' + 
-                          str(self.target_tree_path_source[i].resolve()))
-                        shutil.copy(st_path, self.target_tree_path_source[i])
-                    else:
-                        self.print_and_log('  annotation structure tree to source exists : ' + 
-                          str(self.target_tree_path_source[i].resolve()))
-                    #anno_img = self.get_src_tree_tar(i)
-                    #self.save_src_tree_tar(i, anno_img)
             else:
                 self.print_and_log('')
-                self.print_and_log('  target annotation structure trees to source : no trees to process')
+                self.print_and_log('  saving target annotations to source : not requested')
                 self.print_and_log('')
             
-        
-        else:
-            self.print_and_log('')
-            self.print_and_log('  saving target annotations to source : not requested')
-            self.print_and_log('')
-        
-        
-        if self.brp['target-to-source-save-images'] == True:
             
+            if self.brp['target-to-source-save-images'] is True:
+                
+                
+                if self.target_image_paths_source: # not a blank list
+                    self.print_and_log('')
+                    self.print_and_log('  target images to source :')
+                    self.print_and_log('')
+                    # each image in turn - or in a thread pool if the optional brp 
+                     # key transform-workers is above 1, see _process_ds_all()
+                    self._process_ds_all( functools.partial(self._transform_save, 
+                                              self.get_tar_image_src, self.save_tar_image_src, 
+                                              'target image'), 
+                                          list(range(len(self.target_image_paths_source))), 
+                                          'transform-workers' )
+                else:
+                    self.print_and_log('')
+                    self.print_and_log('  target images to source : no further images')
+                    self.print_and_log('')
             
-            if self.target_image_paths_source != []: # not a blank list
-                self.print_and_log('')
-                self.print_and_log('  target images to source :')
-                self.print_and_log('')
-                for i,im_ds in enumerate(self.target_image_paths_source):
-                    # source_image_path + _ds + _target all are SAME LENGTH!
-                    self.print_and_log('  target image ' + str(i))
-                    img_tar = self.get_tar_image_src(i)
-                    # save to local var, do not hold onto refs with self.source_image_imgs_target[i].append()
-                    # user can use load_src_images_tar() to do this!s
-                    self.save_tar_image_src(i, img_tar)
-                    img_tar = None
-                    garbage = gc.collect()
             else:
                 self.print_and_log('')
-                self.print_and_log('  target images to source : no further images')
+                self.print_and_log('  saving target images to source : not requested')
                 self.print_and_log('')
+        finally:
+            # shut the worker pool down on errors too - see _process_ds_all()
+            self._shutdown_ds_pool()
         
-        else:
-            self.print_and_log('')
-            self.print_and_log('  saving target images to source : not requested')
-            self.print_and_log('')
-            
-        
-        # discard from memory all images/martices not needed - just point vars to blank list!
-        garbage = gc.collect() # run garbage collection to ensure memory is freed
+        # discard from memory all images/martices not needed - just point vars to None
+         # sitk images are freed as soon as their last reference is dropped
+        self.tar_src_pm = None
+        self.tar_src_pm_anno = None
         
         
     
@@ -3707,9 +3367,9 @@ class BrainRegister(object):
             # source image is downsampled to target img transformation
             # so get ds source and transform this to target img
             
-            if self.source_template_path_target.exists() == False: 
+            if not self.source_template_path_target.exists(): 
                 # only transform if output does not exist
-                if self.source_template_img_target == None: 
+                if self.source_template_img_target is None: 
                     # and if the output image is not already loaded!
                     
                     # get the source img DS for transforming
@@ -3729,9 +3389,7 @@ class BrainRegister(object):
                                 str(i) + ' : ' + 
                                 self.get_relative_path(pm) )
                     
-                    self.print_and_log('========================================================================')
-                    self.print_and_log('')
-                    self.print_and_log('')
+                    self.print_and_log(_BANNER_RULE)
                     img = self.transform_image(self.source_template_img_ds, 
                                                   self.src_tar_pm )
                     self.source_template_img_ds = None
@@ -3751,9 +3409,9 @@ class BrainRegister(object):
         elif (self.downsampling_img == 'target'):
             # source images to ds target img THEN ds to target image space
             
-            if self.source_template_path_target.exists() == False: 
+            if not self.source_template_path_target.exists(): 
                 # only transform if output does not exist
-                if self.source_template_img_target == None: 
+                if self.source_template_img_target is None: 
                     # and if the output image is not already loaded!
                     
                     # get source image
@@ -3775,9 +3433,7 @@ class BrainRegister(object):
                                 str(i) + ' : ' + 
                                 self.get_relative_path(pm) )
                     
-                    self.print_and_log('========================================================================')
-                    self.print_and_log('')
-                    self.print_and_log('')
+                    self.print_and_log(_BANNER_RULE)
                     img = self.transform_image(self.source_template_img, 
                                                   self.src_tar_pm )
                     self.source_template_img = None
@@ -3798,9 +3454,9 @@ class BrainRegister(object):
         elif (self.downsampling_img == 'none'):
             # source image to target image space (no downsampling in this instance!)
             
-            if self.source_template_path_target.exists() == False: 
+            if not self.source_template_path_target.exists(): 
                 # only transform if output does not exist
-                if self.source_template_img_target == None: 
+                if self.source_template_img_target is None: 
                     # and if the output image is not already loaded!
                     
                     if self.source_template_img is None: # AND path exists!
@@ -3821,9 +3477,7 @@ class BrainRegister(object):
                                 str(i) + ' : ' + 
                                 self.get_relative_path(pm) )
                     
-                    self.print_and_log('========================================================================')
-                    self.print_and_log('')
-                    self.print_and_log('')
+                    self.print_and_log(_BANNER_RULE)
                     img = self.transform_image(self.source_template_img, 
                                                   self.src_tar_pm )
                     self.source_template_img = None
@@ -3844,8 +3498,8 @@ class BrainRegister(object):
     
     def save_src_template_tar(self):
         
-        if self.source_template_path_target.exists() == False:
-            if self.source_template_img_target != None:
+        if not self.source_template_path_target.exists():
+            if self.source_template_img_target is not None:
                 self.print_and_log('  saving source template to target : ' + 
                       self.get_relative_path(self.source_template_path_target))
                 self.save_image(self.source_template_img_target, self.source_template_path_target)
@@ -3869,12 +3523,12 @@ class BrainRegister(object):
             # so get ds source and transform this to target img
             im_path = self.source_anno_path_ds[index]
             
-            if self.source_anno_path_target[index].exists() == False: 
+            if not self.source_anno_path_target[index].exists(): 
                 # only transform if output does not exist
-                if self.source_anno_img_target[index] == None: 
+                if self.source_anno_img_target[index] is None: 
                     # and if the output anno is not already loaded!
                     
-                    if im_path.exists() == False:
+                    if not im_path.exists():
                         self.print_and_log('  transforming downsampled source annotation from source anno..')
                         img_ds = self.load_transform_anno_img_ds(self.source_anno_path[index])
                     
@@ -3886,7 +3540,7 @@ class BrainRegister(object):
                     if self.src_tar_pm_anno is None:
                         self.print_and_log('  source to target annotation paramater maps not loaded - loading files..')
                         self.src_tar_pm = self.load_pm_files( self.src_tar_pm_paths )
-                        if self.src_tar_pm == None:
+                        if self.src_tar_pm is None:
                             print("ERROR : src_tar_ds_pm files do not exist - run register() first")
                         self.src_tar_pm_anno = self.edit_pms_nearest_neighbour(self.src_tar_pm)
                     
@@ -3897,9 +3551,7 @@ class BrainRegister(object):
                     for i, pm in enumerate(self.src_tar_pm_paths):
                         self.print_and_log('    source-to-target parameter map file '+
                                 str(i) + ' : ' + self.get_relative_path(pm) )
-                    self.print_and_log('========================================================================')
-                    self.print_and_log('')
-                    self.print_and_log('')
+                    self.print_and_log(_BANNER_RULE)
                     
                     img_ds_tar = self.transform_image(img_ds, self.src_tar_pm_anno)
                     img_ds = None
@@ -3921,9 +3573,9 @@ class BrainRegister(object):
             
             im_path = self.source_anno_path[index]
             
-            if self.source_anno_path_target[index].exists() == False: 
+            if not self.source_anno_path_target[index].exists(): 
                 # only transform if output does not exist
-                if self.source_anno_img_target[index] == None: 
+                if self.source_anno_img_target[index] is None: 
                     # and if the output anno is not already loaded!
                     
                     self.print_and_log('  loading source annotation..')
@@ -3933,7 +3585,7 @@ class BrainRegister(object):
                     if self.src_tar_pm_anno is None:
                         self.print_and_log('  source to target annotation paramater maps not loaded - loading files..')
                         self.src_tar_pm = self.load_pm_files( self.src_tar_pm_paths )
-                        if self.src_tar_pm == None:
+                        if self.src_tar_pm is None:
                             print("ERROR : src_tar_ds_pm files do not exist - run register() first")
                         self.src_tar_pm_anno = self.edit_pms_nearest_neighbour(self.src_tar_pm)
                     
@@ -3944,9 +3596,7 @@ class BrainRegister(object):
                     for i, pm in enumerate(self.src_tar_pm_paths):
                         self.print_and_log('    source-to-target parameter map file '+
                                 str(i) + ' : ' + self.get_relative_path(pm) )
-                    self.print_and_log('========================================================================')
-                    self.print_and_log('')
-                    self.print_and_log('')
+                    self.print_and_log(_BANNER_RULE)
                     
                     anno_ds_tar = self.transform_image(img_ds, self.src_tar_pm_anno)
                     img_ds = None
@@ -3968,9 +3618,9 @@ class BrainRegister(object):
             
             im_path = self.source_anno_path[index]
             
-            if self.source_anno_path_target[index].exists() == False: 
+            if not self.source_anno_path_target[index].exists(): 
                 # only transform if output does not exist
-                if self.source_anno_img_target[index] == None: 
+                if self.source_anno_img_target[index] is None: 
                     # and if the output anno is not already loaded!
                     
                     self.print_and_log('  loading source annotation..')
@@ -3980,7 +3630,7 @@ class BrainRegister(object):
                     if self.src_tar_pm_anno is None:
                         self.print_and_log('  source to target annotation paramater maps not loaded - loading files..')
                         self.src_tar_pm = self.load_pm_files( self.src_tar_pm_paths )
-                        if self.src_tar_pm == None:
+                        if self.src_tar_pm is None:
                             print("ERROR : src_tar_ds_pm files do not exist - run register() first")
                         self.src_tar_pm_anno = self.edit_pms_nearest_neighbour(self.src_tar_pm)
                     
@@ -3991,9 +3641,7 @@ class BrainRegister(object):
                     for i, pm in enumerate(self.src_tar_pm_paths):
                         self.print_and_log('    source-to-target parameter map file '+
                                 str(i) + ' : ' + self.get_relative_path(pm) )
-                    self.print_and_log('========================================================================')
-                    self.print_and_log('')
-                    self.print_and_log('')
+                    self.print_and_log(_BANNER_RULE)
                     
                     img = self.transform_image(img_ds, self.src_tar_pm_anno)
                     img_ds = None
@@ -4018,7 +3666,7 @@ class BrainRegister(object):
         
         #if (self.downsampling_img == 'source'):
         # ds source images to target img 
-        if self.source_anno_path_target[index].exists() == False: # only save if output does not exist
+        if not self.source_anno_path_target[index].exists(): # only save if output does not exist
             self.print_and_log('  saving source annotation to target : ' +
                   self.get_relative_path(self.source_anno_path_target[index] ) )
             self.save_image(image, self.source_anno_path_target[index])
@@ -4046,12 +3694,12 @@ class BrainRegister(object):
             # ds source images to target img 
             im_path = self.source_image_paths_ds[index]
             
-            if self.source_image_paths_target[index].exists() == False: 
+            if not self.source_image_paths_target[index].exists(): 
                 # only transform if output does not exist
-                if self.source_image_imgs_target[index] == None: 
+                if self.source_image_imgs_target[index] is None: 
                     # and if the output image is not already loaded!
                     
-                    if im_path.exists() == False:
+                    if not im_path.exists():
                         self.print_and_log('  transforming downsampled source image from source image..')
                         img_ds = self.load_transform_image_img_ds(self.source_image_paths[index])
                     
@@ -4073,9 +3721,7 @@ class BrainRegister(object):
                         self.print_and_log('    source-to-target parameter map file '+
                                 str(i) + ' : ' + 
                                 self.get_relative_path(pm) )
-                    self.print_and_log('========================================================================')
-                    self.print_and_log('')
-                    self.print_and_log('')
+                    self.print_and_log(_BANNER_RULE)
                     
                     img_tar = self.transform_image(img_ds, self.src_tar_pm)
                     img_ds = None
@@ -4097,9 +3743,9 @@ class BrainRegister(object):
             # source anno to ds target THEN ds to target image space
             im_path = self.source_image_paths[index]
             
-            if self.source_image_paths_target[index].exists() == False: 
+            if not self.source_image_paths_target[index].exists(): 
                 # only transform if output does not exist
-                if self.source_image_imgs_target[index] == None: 
+                if self.source_image_imgs_target[index] is None: 
                     # and if the output image is not already loaded!
                     
                     self.print_and_log('  loading source image..')
@@ -4119,9 +3765,7 @@ class BrainRegister(object):
                         self.print_and_log('    source-to-target parameter map file '+
                                 str(i) + ' : ' + 
                                 self.get_relative_path(pm) )
-                    self.print_and_log('========================================================================')
-                    self.print_and_log('')
-                    self.print_and_log('')
+                    self.print_and_log(_BANNER_RULE)
                     
                     img_tar = self.transform_image(img_ds, self.src_tar_pm)
                     img_ds = None
@@ -4143,9 +3787,9 @@ class BrainRegister(object):
             # source anno to ds target THEN ds to target image space
             im_path = self.source_image_paths[index]
             
-            if self.source_image_paths_target[index].exists() == False: 
+            if not self.source_image_paths_target[index].exists(): 
                 # only transform if output does not exist
-                if self.source_image_imgs_target[index] == None: 
+                if self.source_image_imgs_target[index] is None: 
                     # and if the output image is not already loaded!
                     
                     self.print_and_log('  loading source image..')
@@ -4165,9 +3809,7 @@ class BrainRegister(object):
                         self.print_and_log('    source-to-target parameter map file '+
                                 str(i) + ' : ' + 
                                 self.get_relative_path(pm) )
-                    self.print_and_log('========================================================================')
-                    self.print_and_log('')
-                    self.print_and_log('')
+                    self.print_and_log(_BANNER_RULE)
                     
                     img = self.transform_image(img_ds, self.src_tar_pm)
                     img_ds = None
@@ -4192,7 +3834,7 @@ class BrainRegister(object):
         
         #if (self.downsampling_img == 'source'):
         # ds source images to target img 
-        if self.source_image_paths_target[index].exists() == False: # only save if output does not exist
+        if not self.source_image_paths_target[index].exists(): # only save if output does not exist
             self.print_and_log('  saving source image to target : ' +
                   self.get_relative_path(self.source_image_paths_target[index] ) )
             self.save_image(image, self.source_image_paths_target[index])
@@ -4232,9 +3874,9 @@ class BrainRegister(object):
             # target image is downsampled to source img transformation
             # so get ds target and transform this to source img
             
-            if self.target_template_path_source.exists() == False: 
+            if not self.target_template_path_source.exists(): 
                 # only transform if output does not exist
-                if self.target_template_img_source == None: 
+                if self.target_template_img_source is None: 
                     # and if the output image is not already loaded!
                     
                     self.target_template_img_ds = self.get_template_ds()
@@ -4253,9 +3895,7 @@ class BrainRegister(object):
                                 str(i) + ' : ' + 
                                 self.get_relative_path(pm) )
                     
-                    self.print_and_log('========================================================================')
-                    self.print_and_log('')
-                    self.print_and_log('')
+                    self.print_and_log(_BANNER_RULE)
                     img = self.transform_image(self.target_template_img_ds, 
                                                   self.tar_src_pm )
                     self.target_template_img_ds = None
@@ -4275,9 +3915,9 @@ class BrainRegister(object):
         elif (self.downsampling_img == 'source'):
             # target images to ds source img THEN ds to source image space
             
-            if self.target_template_path_source.exists() == False: 
+            if not self.target_template_path_source.exists(): 
                 # only transform if output does not exist
-                if self.target_template_img_source == None: 
+                if self.target_template_img_source is None: 
                     # and if the output image is not already loaded!
                     
                     # get source image
@@ -4299,9 +3939,7 @@ class BrainRegister(object):
                                 str(i) + ' : ' + 
                                 self.get_relative_path(pm) )
                     
-                    self.print_and_log('========================================================================')
-                    self.print_and_log('')
-                    self.print_and_log('')
+                    self.print_and_log(_BANNER_RULE)
                     img = self.transform_image(self.target_template_img, 
                                                   self.tar_src_pm )
                     self.target_template_img = None
@@ -4322,9 +3960,9 @@ class BrainRegister(object):
         elif (self.downsampling_img == 'none'):
             # target image to source image space (no downsampling in this instance!)
             
-            if self.target_template_path_source.exists() == False: 
+            if not self.target_template_path_source.exists(): 
                 # only transform if output does not exist
-                if self.target_template_img_source == None: 
+                if self.target_template_img_source is None: 
                     # and if the output image is not already loaded!
                     
                     if self.target_template_img is None: # AND path exists!
@@ -4345,9 +3983,7 @@ class BrainRegister(object):
                                 str(i) + ' : ' + 
                                 self.get_relative_path(pm) )
                     
-                    self.print_and_log('========================================================================')
-                    self.print_and_log('')
-                    self.print_and_log('')
+                    self.print_and_log(_BANNER_RULE)
                     img = self.transform_image(self.target_template_img, 
                                                   self.src_tar_pm )
                     self.target_template_img = None
@@ -4368,8 +4004,8 @@ class BrainRegister(object):
     
     def save_tar_template_src(self):
         
-        if self.target_template_path_source.exists() == False:
-            if self.target_template_img_source != None:
+        if not self.target_template_path_source.exists():
+            if self.target_template_img_source is not None:
                 self.print_and_log('  saving target template to source : ' + 
                       self.get_relative_path(self.target_template_path_source))
                 self.save_image(self.target_template_img_source, self.target_template_path_source)
@@ -4391,12 +4027,12 @@ class BrainRegister(object):
             # so get ds target and transform this to source img
             im_path = self.target_anno_path_ds[index]
             
-            if self.target_anno_path_source[index].exists() == False: 
+            if not self.target_anno_path_source[index].exists(): 
                 # only transform if output does not exist
-                if self.target_anno_img_source[index] == None: 
+                if self.target_anno_img_source[index] is None: 
                     # and if the output anno is not already loaded!
                     
-                    if im_path.exists() == False:
+                    if not im_path.exists():
                         self.print_and_log('  transforming downsampled target annotation from target anno..')
                         img_ds = self.load_transform_anno_img_ds(self.target_anno_path[index])
                     
@@ -4408,7 +4044,7 @@ class BrainRegister(object):
                     if self.tar_src_pm_anno is None:
                         self.print_and_log('  target to source annotation paramater maps not loaded - loading files..')
                         self.tar_src_pm = self.load_pm_files( self.tar_src_pm_paths )
-                        if self.tar_src_pm == None:
+                        if self.tar_src_pm is None:
                             print("ERROR : tar_src_ds_pm files do not exist - run register() first")
                         self.tar_src_pm_anno = self.edit_pms_nearest_neighbour(self.tar_src_pm)
                     
@@ -4419,9 +4055,7 @@ class BrainRegister(object):
                     for i, pm in enumerate(self.tar_src_pm_paths):
                         self.print_and_log('    target-to-source parameter map file '+
                                 str(i) + ' : ' + self.get_relative_path(pm) )
-                    self.print_and_log('========================================================================')
-                    self.print_and_log('')
-                    self.print_and_log('')
+                    self.print_and_log(_BANNER_RULE)
                     
                     img_ds_tar = self.transform_image(img_ds, self.tar_src_pm_anno)
                     # not saving to self.target_anno_img_source[index] to minimise memory occupation
@@ -4442,9 +4076,9 @@ class BrainRegister(object):
             
             im_path = self.target_anno_path[index]
             
-            if self.target_anno_path_source[index].exists() == False: 
+            if not self.target_anno_path_source[index].exists(): 
                 # only transform if output does not exist
-                if self.target_anno_img_source[index] == None: 
+                if self.target_anno_img_source[index] is None: 
                     # and if the output anno is not already loaded!
                     
                     self.print_and_log('  loading target annotation..')
@@ -4454,7 +4088,7 @@ class BrainRegister(object):
                     if self.tar_src_pm_anno is None:
                         self.print_and_log('  target to source annotation paramater maps not loaded - loading files..')
                         self.tar_src_pm = self.load_pm_files( self.tar_src_pm_paths )
-                        if self.tar_src_pm == None:
+                        if self.tar_src_pm is None:
                             print("ERROR : tar_src_ds_pm files do not exist - run register() first")
                         self.tar_src_pm_anno = self.edit_pms_nearest_neighbour(self.tar_src_pm)
                     
@@ -4465,9 +4099,7 @@ class BrainRegister(object):
                     for i, pm in enumerate(self.tar_src_pm_paths):
                         self.print_and_log('    target-to-source parameter map file '+
                                 str(i) + ' : ' + self.get_relative_path(pm) )
-                    self.print_and_log('========================================================================')
-                    self.print_and_log('')
-                    self.print_and_log('')
+                    self.print_and_log(_BANNER_RULE)
                     
                     anno_ds_src = self.transform_image(img_ds, self.tar_src_pm_anno)
                     # not saving to self.source_anno_img_target[index] to minimise memory occupation
@@ -4487,9 +4119,9 @@ class BrainRegister(object):
             
             im_path = self.target_anno_path[index]
             
-            if self.target_anno_path_source[index].exists() == False: 
+            if not self.target_anno_path_source[index].exists(): 
                 # only transform if output does not exist
-                if self.target_anno_img_source[index] == None: 
+                if self.target_anno_img_source[index] is None: 
                     # and if the output anno is not already loaded!
                     
                     self.print_and_log('  loading downsampled target annotation..')
@@ -4499,7 +4131,7 @@ class BrainRegister(object):
                     if self.tar_src_pm_anno is None:
                         self.print_and_log('  target to source annotation paramater maps not loaded - loading files..')
                         self.tar_src_pm = self.load_pm_files( self.tar_src_pm_paths )
-                        if self.tar_src_pm == None:
+                        if self.tar_src_pm is None:
                             print("ERROR : tar_src_ds_pm files do not exist - run register() first")
                         self.tar_src_pm_anno = self.edit_pms_nearest_neighbour(self.tar_src_pm)
                     
@@ -4510,9 +4142,7 @@ class BrainRegister(object):
                     for i, pm in enumerate(self.tar_src_pm_paths):
                         self.print_and_log('    target-to-source parameter map file '+
                                 str(i) + ' : ' + self.get_relative_path(pm) )
-                    self.print_and_log('========================================================================')
-                    self.print_and_log('')
-                    self.print_and_log('')
+                    self.print_and_log(_BANNER_RULE)
                     
                     return self.transform_image(img_ds, self.tar_src_pm_anno)
                     # not saving to self.target_anno_img_source[index] to minimise memory occupation
@@ -4535,7 +4165,7 @@ class BrainRegister(object):
         
         #if (self.downsampling_img == 'source'):
         # ds source images to target img 
-        if self.target_anno_path_source[index].exists() == False: # only save if output does not exist
+        if not self.target_anno_path_source[index].exists(): # only save if output does not exist
             self.print_and_log('  saving target annotation to source : ' +
                   self.get_relative_path(self.target_anno_path_source[index] ) )
             self.save_image(image, self.target_anno_path_source[index])
@@ -4563,12 +4193,12 @@ class BrainRegister(object):
             # ds target images to source img 
             im_path = self.target_image_paths_ds[index]
             
-            if self.target_image_paths_source[index].exists() == False: 
+            if not self.target_image_paths_source[index].exists(): 
                 # only transform if output does not exist
-                if self.target_image_img_source[index] == None: 
+                if self.target_image_img_source[index] is None: 
                     # and if the output image is not already loaded!
                     
-                    if im_path.exists() == False:
+                    if not im_path.exists():
                         self.print_and_log('  transforming downsampled target image from target image..')
                         img_ds = self.load_transform_image_img_ds(self.target_image_path[index])
                     
@@ -4590,9 +4220,7 @@ class BrainRegister(object):
                         self.print_and_log('    target-to-source parameter map file '+
                                 str(i) + ' : ' + 
                                 self.get_relative_path(pm) )
-                    self.print_and_log('========================================================================')
-                    self.print_and_log('')
-                    self.print_and_log('')
+                    self.print_and_log(_BANNER_RULE)
                     
                     img_src = self.transform_image(img_ds, self.tar_src_pm)
                     # not saving to self.target_image_img_source[index] to minimise memory occupation
@@ -4613,9 +4241,9 @@ class BrainRegister(object):
             # target anno to ds source THEN ds to source image space
             im_path = self.target_image_path[index]
             
-            if self.target_image_paths_source[index].exists() == False: 
+            if not self.target_image_paths_source[index].exists(): 
                 # only transform if output does not exist
-                if self.target_image_img_source[index] == None: 
+                if self.target_image_img_source[index] is None: 
                     # and if the output image is not already loaded!
                     
                     self.print_and_log('  loading downsampled target image..')
@@ -4635,9 +4263,7 @@ class BrainRegister(object):
                         self.print_and_log('    target-to-source parameter map file '+
                                 str(i) + ' : ' + 
                                 self.get_relative_path(pm) )
-                    self.print_and_log('========================================================================')
-                    self.print_and_log('')
-                    self.print_and_log('')
+                    self.print_and_log(_BANNER_RULE)
                     
                     img_src = self.transform_image(img_ds, self.tar_src_pm)
                     img_ds = None
@@ -4660,9 +4286,9 @@ class BrainRegister(object):
             # target anno to source image space (no downsampling)
             im_path = self.target_image_path[index]
             
-            if self.target_image_paths_source[index].exists() == False: 
+            if not self.target_image_paths_source[index].exists(): 
                 # only transform if output does not exist
-                if self.target_image_img_source[index] == None: 
+                if self.target_image_img_source[index] is None: 
                     # and if the output image is not already loaded!
                     
                     self.print_and_log('  loading downsampled target image..')
@@ -4682,9 +4308,7 @@ class BrainRegister(object):
                         self.print_and_log('    target-to-source parameter map file '+
                                 str(i) + ' : ' + 
                                 self.get_relative_path(pm) )
-                    self.print_and_log('========================================================================')
-                    self.print_and_log('')
-                    self.print_and_log('')
+                    self.print_and_log(_BANNER_RULE)
                     
                     return self.transform_image(img_ds, self.tar_src_pm)
                     # not saving to self.target_image_img_source[index] to minimise memory occupation
@@ -4707,7 +4331,7 @@ class BrainRegister(object):
         
         #if (self.downsampling_img == 'source'):
         # ds target images to source img 
-        if self.target_image_paths_source[index].exists() == False: # only save if output does not exist
+        if not self.target_image_paths_source[index].exists(): # only save if output does not exist
             self.print_and_log('  saving target image to source : ' +
                   self.get_relative_path(self.target_image_paths_source[index] ) )
             self.save_image(image, self.target_image_paths_source[index])
@@ -4731,12 +4355,15 @@ class BrainRegister(object):
     
     def edit_pms_nearest_neighbour(self, pms):
         
-        if pms == None:
+        if pms is None:
             return None # this is so initial calls in resolve_param_paths()
                         # is set to None if pm files dont exist
         else:
             # FIRST alter the pm files FinalBSplineInterpolationOrder to 0
             # 0 - nearest neighbour interpolation for annotation images
+            # edit COPIES - the image pms passed in are still used for images,
+             # which may be transformed after or alongside the annotations
+            pms = [ dict(pm) for pm in pms ]
             for pm in pms:
                 pm['FinalBSplineInterpolationOrder'] = tuple( [ str(0) ] )
             
@@ -4797,11 +4424,11 @@ class BrainRegister(object):
         
         if self.downsampling_img == 'source':
             # transform and save target template to ds source image space as requested
-            if self.brp['target-to-source-downsampling-save-template'] == True:
+            if self.brp['target-to-source-downsampling-save-template'] is True:
                 
-                if self.target_template_path_ds.exists() == False: 
+                if not self.target_template_path_ds.exists(): 
                     # only transform if output does not exist
-                    if self.target_template_img == None:
+                    if self.target_template_img is None:
                         self.print_and_log('  loading target template image : ' + 
                           self.get_relative_path(self.target_template_path) )
                         self.target_template_img = self.load_image(self.target_template_path)
@@ -4820,9 +4447,7 @@ class BrainRegister(object):
                         self.print_and_log('    target-to-source parameter map file '+
                                 str(i) + ' : ' + 
                                 self.get_relative_path(pm) )
-                    self.print_and_log('========================================================================')
-                    self.print_and_log('')
-                    self.print_and_log('')
+                    self.print_and_log(_BANNER_RULE)
                     
                     img_ds_src = self.transform_image(self.target_template_img, self.tar_src_pm)
                     
@@ -4844,11 +4469,11 @@ class BrainRegister(object):
             
         elif self.downsampling_img == 'target':
             # transform and save source template to ds target image space as requested
-            if self.brp['source-to-target-downsampling-save-template'] == True:
+            if self.brp['source-to-target-downsampling-save-template'] is True:
                 
-                if self.source_template_path_ds.exists() == False: 
+                if not self.source_template_path_ds.exists(): 
                     # only transform if output does not exist
-                    if self.source_template_img == None:
+                    if self.source_template_img is None:
                         self.print_and_log('  loading source template image : ' + 
                           self.get_relative_path(self.source_template_path) )
                         self.source_template_img = self.load_image(self.source_template_path)
@@ -4866,9 +4491,7 @@ class BrainRegister(object):
                         self.print_and_log('    source-to-target parameter map file '+
                                 str(i) + ' : ' + 
                                 self.get_relative_path(pm) )
-                    self.print_and_log('========================================================================')
-                    self.print_and_log('')
-                    self.print_and_log('')
+                    self.print_and_log(_BANNER_RULE)
                     
                     img_ds_tar = self.transform_image(self.source_template_img, self.src_tar_pm)
                     
@@ -4895,17 +4518,17 @@ class BrainRegister(object):
         
         if self.downsampling_img == 'source':
             # transform and save target template to ds source image space as requested
-            if self.brp['target-to-source-downsampling-save-annotations'] == True:
+            if self.brp['target-to-source-downsampling-save-annotations'] is True:
                 
-                if self.target_anno_path != []:
+                if self.target_anno_path:
                     self.print_and_log('')
                     self.print_and_log('  transforming and saving target annotations to ds..')
                     
                     for i, s in enumerate(self.target_anno_path):
                         
-                        if self.target_anno_path_ds[i].exists() == False: 
+                        if not self.target_anno_path_ds[i].exists(): 
                             # only transform if output does not exist
-                            if self.target_anno_img[i] == None:
+                            if self.target_anno_img[i] is None:
                                 self.print_and_log('  loading target anno image : ' + 
                                   self.get_relative_path(self.target_anno_path[i]) )
                                 tar_anno_img = self.load_image(self.target_anno_path[i])
@@ -4913,10 +4536,10 @@ class BrainRegister(object):
                                 tar_anno_img = self.target_anno_img[i]
                             
                             
-                            if self.tar_src_pm is None:
+                            if self.tar_src_pm_anno is None:
                                 self.print_and_log('  target to source paramater maps not loaded - loading files..')
                                 self.tar_src_pm = self.load_pm_files( self.tar_src_pm_paths )
-                                if self.tar_src_pm == None:
+                                if self.tar_src_pm is None:
                                     print("ERROR : tar_src_ds_pm files do not exist - run register() first")
                                 self.tar_src_pm_anno = self.edit_pms_nearest_neighbour(self.tar_src_pm)
                             
@@ -4928,9 +4551,7 @@ class BrainRegister(object):
                                 self.print_and_log('    target-to-source parameter map file '+
                                         str(j) + ' : ' + 
                                         self.get_relative_path(pm) )
-                            self.print_and_log('========================================================================')
-                            self.print_and_log('')
-                            self.print_and_log('')
+                            self.print_and_log(_BANNER_RULE)
                             
                             img_ds_src = self.transform_image(tar_anno_img, self.tar_src_pm_anno)
                             
@@ -4949,19 +4570,19 @@ class BrainRegister(object):
                 
                 
                 # ALSO SAVE the structure trees associated with the annos
-                if self.target_tree_path_ds != []: # not a blank list
+                if self.target_tree_path_ds: # not a blank list
                     self.print_and_log('')
                     self.print_and_log('  target annotation structure tree to ds : ')
                     self.print_and_log('')
                     for i,st_path in enumerate(self.target_tree_path):
                         # source_anno_path + _ds + _target all are SAME LENGTH!
-                        if self.target_tree_path_ds[i].exists() == False:
+                        if not self.target_tree_path_ds[i].exists():
                             self.print_and_log('  copying annotation structure tree to ds ' + 
-                              str(self.target_tree_path_ds[i].resolve()))
+                              self.get_relative_path(self.target_tree_path_ds[i]))
                             shutil.copy(st_path, self.target_tree_path_ds[i])
                         else:
                             self.print_and_log('  annotation structure tree to ds exists : ' + 
-                              str(self.target_tree_path_ds[i].resolve()))
+                              self.get_relative_path(self.target_tree_path_ds[i]))
                         #anno_img = self.get_src_tree_tar(i)
                         #self.save_src_tree_tar(i, anno_img)
                 else:
@@ -4977,17 +4598,17 @@ class BrainRegister(object):
             
         elif self.downsampling_img == 'target':
             # transform and save source template to ds target image space as requested
-            if self.brp['source-to-target-downsampling-save-annotations'] == True:
+            if self.brp['source-to-target-downsampling-save-annotations'] is True:
                 
-                if self.source_anno_path != []:
+                if self.source_anno_path:
                     self.print_and_log('')
                     self.print_and_log('  transforming and saving source annotations to ds..')
                     
                     for i, s in enumerate(self.source_anno_path):
                         
-                        if self.source_anno_path_ds[i].exists() == False: 
+                        if not self.source_anno_path_ds[i].exists(): 
                             # only transform if output does not exist
-                            if self.source_anno_img[i] == None:
+                            if self.source_anno_img[i] is None:
                                 self.print_and_log('  loading source anno image : ' + 
                                   self.get_relative_path(self.source_anno_path[i]) )
                                 src_anno_img = self.load_image(self.source_anno_path[i])
@@ -4995,10 +4616,10 @@ class BrainRegister(object):
                                 src_anno_img = self.source_anno_img[i]
                             
                             
-                            if self.src_tar_pm is None:
+                            if self.src_tar_pm_anno is None:
                                 self.print_and_log('  source to target paramater maps not loaded - loading files..')
                                 self.src_tar_pm = self.load_pm_files( self.src_tar_pm_paths )
-                                if self.src_tar_pm == None:
+                                if self.src_tar_pm is None:
                                     print("ERROR : src_tar_ds_pm files do not exist - run register() first")
                                 self.src_tar_pm_anno = self.edit_pms_nearest_neighbour(self.src_tar_pm)
                             
@@ -5010,9 +4631,7 @@ class BrainRegister(object):
                                 self.print_and_log('    source-to-target parameter map file '+
                                         str(j) + ' : ' + 
                                         self.get_relative_path(pm) )
-                            self.print_and_log('========================================================================')
-                            self.print_and_log('')
-                            self.print_and_log('')
+                            self.print_and_log(_BANNER_RULE)
                             
                             img_ds_tar = self.transform_image(src_anno_img, self.src_tar_pm_anno)
                             
@@ -5030,19 +4649,19 @@ class BrainRegister(object):
                 
                 
                 # ALSO SAVE the structure trees associated with the annos
-                if self.source_tree_path_ds != []: # not a blank list
+                if self.source_tree_path_ds: # not a blank list
                     self.print_and_log('')
                     self.print_and_log('  source annotation structure tree to ds : ')
                     self.print_and_log('')
                     for i,st_path in enumerate(self.source_tree_path):
                         # source_anno_path + _ds + _target all are SAME LENGTH!
-                        if self.source_tree_path_ds[i].exists() == False:
+                        if not self.source_tree_path_ds[i].exists():
                             self.print_and_log('  copying annotation structure tree to ds ' + 
-                              str(self.source_tree_path_ds[i].resolve()))
+                              self.get_relative_path(self.source_tree_path_ds[i]))
                             shutil.copy(st_path, self.source_tree_path_ds[i])
                         else:
                             self.print_and_log('  annotation structure tree to ds exists : ' + 
-                              str(self.source_tree_path_ds[i].resolve()))
+                              self.get_relative_path(self.source_tree_path_ds[i]))
                         #anno_img = self.get_src_tree_tar(i)
                         #self.save_src_tree_tar(i, anno_img)
                 else:
@@ -5065,17 +4684,17 @@ class BrainRegister(object):
         
         if self.downsampling_img == 'source':
             # transform and save target template to ds source image space as requested
-            if self.brp['target-to-source-downsampling-save-images'] == True:
+            if self.brp['target-to-source-downsampling-save-images'] is True:
                 
-                if self.target_image_paths != []:
+                if self.target_image_paths:
                     self.print_and_log('')
                     self.print_and_log('  transforming and saving target images to ds..')
                     
                     for i, s in enumerate(self.target_image_paths):
                         
-                        if self.target_image_paths_ds[i].exists() == False: 
+                        if not self.target_image_paths_ds[i].exists(): 
                             # only transform if output does not exist
-                            if self.target_image_imgs[i] == None:
+                            if self.target_image_imgs[i] is None:
                                 self.print_and_log('  loading target image : ' + 
                                   self.get_relative_path(self.target_image_paths[i]) )
                                 tar_img = self.load_image(self.target_image_paths[i])
@@ -5086,7 +4705,7 @@ class BrainRegister(object):
                             if self.tar_src_pm is None:
                                 self.print_and_log('  target to source paramater maps not loaded - loading files..')
                                 self.tar_src_pm = self.load_pm_files( self.tar_src_pm_paths )
-                                if self.tar_src_pm == None:
+                                if self.tar_src_pm is None:
                                     print("ERROR : tar_src_ds_pm files do not exist - run register() first")
                             
                             self.print_and_log('  transforming target image to downsampled source..')
@@ -5097,9 +4716,7 @@ class BrainRegister(object):
                                 self.print_and_log('    target-to-source parameter map file '+
                                         str(j) + ' : ' + 
                                         self.get_relative_path(pm) )
-                            self.print_and_log('========================================================================')
-                            self.print_and_log('')
-                            self.print_and_log('')
+                            self.print_and_log(_BANNER_RULE)
                             
                             img_ds_src = self.transform_image(tar_img, self.tar_src_pm)
                             
@@ -5124,17 +4741,17 @@ class BrainRegister(object):
             
         elif self.downsampling_img == 'target':
             # transform and save source template to ds target image space as requested
-            if self.brp['source-to-target-downsampling-save-images'] == True:
+            if self.brp['source-to-target-downsampling-save-images'] is True:
                 
-                if self.source_image_paths != []:
+                if self.source_image_paths:
                     self.print_and_log('')
                     self.print_and_log('  transforming and saving source images to ds..')
                     
                     for i, s in enumerate(self.source_image_paths):
                         
-                        if self.source_anno_path_ds[i].exists() == False: 
+                        if not self.source_anno_path_ds[i].exists(): 
                             # only transform if output does not exist
-                            if self.source_image_imgs[i] == None:
+                            if self.source_image_imgs[i] is None:
                                 self.print_and_log('  loading source image : ' + 
                                   self.get_relative_path(self.source_image_paths[i]) )
                                 src_img = self.load_image(self.source_image_paths[i])
@@ -5145,7 +4762,7 @@ class BrainRegister(object):
                             if self.src_tar_pm is None:
                                 self.print_and_log('  source to target paramater maps not loaded - loading files..')
                                 self.src_tar_pm = self.load_pm_files( self.src_tar_pm_paths )
-                                if self.src_tar_pm == None:
+                                if self.src_tar_pm is None:
                                     print("ERROR : src_tar_ds_pm files do not exist - run register() first")
                             
                             self.print_and_log('  transforming source image to downsampled target..')
@@ -5156,9 +4773,7 @@ class BrainRegister(object):
                                 self.print_and_log('    source-to-target parameter map file '+
                                         str(j) + ' : ' + 
                                         self.get_relative_path(pm) )
-                            self.print_and_log('========================================================================')
-                            self.print_and_log('')
-                            self.print_and_log('')
+                            self.print_and_log(_BANNER_RULE)
                             
                             img_ds_tar = self.transform_image(src_img, self.src_tar_pm)
                             
@@ -5190,9 +4805,13 @@ class ImageFilterPipeline(object):
     
     def __init__(self, filter_string):
         
-        self.img_filter = []
+        # only the filter names & kernels are stored - the sitk filter objects
+         # are built on each filter_image() call by new_filter(), so threads 
+         # filtering images with one pipeline never share sitk filter state
         self.img_filter_name = []
         self.img_filter_kernel = []
+        # run Median filters on the GPU with cuCIM when available - see filter_image()
+        self.use_gpu = False
         # process string to determine the filter pipe
         # eg. M,1,1,0-GH,10,10,4 -> translates to 
             # median 4x4 XY THEN gaussian high-pass 10x10x4 XYZ
@@ -5204,38 +4823,18 @@ class ImageFilterPipeline(object):
             filter_kernel = tuple([int(s) for s in f.split(',') if s.isdigit()])
             
             if filter_code == 'M':
-                
-                flt = sitk.MedianImageFilter()
-                flt.SetRadius(filter_kernel)
-                
-                self.img_filter.append(flt)
                 self.img_filter_name.append('Median')
                 self.img_filter_kernel.append(filter_kernel)
                 
             elif filter_code == 'E':
-                
-                flt = sitk.MeanImageFilter()
-                flt.SetRadius(filter_kernel)
-                
-                self.img_filter.append(flt)
                 self.img_filter_name.append('Mean')
                 self.img_filter_kernel.append(filter_kernel)
                 
             elif filter_code == 'G':
-                
-                flt = sitk.SmoothingRecursiveGaussianImageFilter()
-                flt.SetSigma(filter_kernel)
-                
-                self.img_filter.append(flt)
                 self.img_filter_name.append('Gaussian')
                 self.img_filter_kernel.append(filter_kernel)
                 
             elif filter_code == 'GH':
-                
-                flt = sitk.SmoothingRecursiveGaussianImageFilter()
-                flt.SetSigma(filter_kernel)
-                
-                self.img_filter.append(flt)
                 self.img_filter_name.append('Gaussian-High-Pass')
                 self.img_filter_kernel.append(filter_kernel)
                 
@@ -5243,6 +4842,31 @@ class ImageFilterPipeline(object):
         
     
     
+    def new_filter(self, i):
+        """
+        Build a new sitk filter object for filter i of this pipeline
+
+        Returns
+        -------
+        sitk.ImageFilter
+            Median, Mean or SmoothingRecursiveGaussian filter with its radius
+            or sigma set from the filter kernel.
+
+        """
+        name = self.img_filter_name[i]
+        if name == 'Median':
+            flt = sitk.MedianImageFilter()
+            flt.SetRadius(self.img_filter_kernel[i])
+        elif name == 'Mean':
+            flt = sitk.MeanImageFilter()
+            flt.SetRadius(self.img_filter_kernel[i])
+        else: # Gaussian & Gaussian-High-Pass
+            flt = sitk.SmoothingRecursiveGaussianImageFilter()
+            flt.SetSigma(self.img_filter_kernel[i])
+        return flt
+    
+    
+    
     def set_image(self, img):
         """
         Set the image
@@ -5291,18 +4915,50 @@ class ImageFilterPipeline(object):
     
     def execute_pipeline(self):
         
-        img = self.img
+        # stores the images on this object - pipelines shared between threads,
+         # as returned by BrainRegister.compute_adaptive_filter(), must be run 
+         # with filter_image() instead
+        self.filtered_img = self.filter_image(self.img)
         
+        return self.filtered_img
+    
+    
+    
+    def filter_image(self, img):
+        """
+        Run the filter pipeline on img and return the filtered image
+        
+        Unlike execute_pipeline() no image is stored on this object, and new
+        sitk filter objects are built for each call, so one pipeline can 
+        filter images from several threads at once.
+
+        Returns
+        -------
+        sitk.Image
+            The filtered image.
+
+        """
         #self.print_and_log('')
         #self.print_and_log('  Execute ImageFilterPipeline:')
-        for i, f in enumerate(self.img_filter):
+        i = 0
+        while i < len(self.img_filter_name):
             #self.print_and_log('    Filter Type : ' + self.img_filter_name[i])
             #self.print_and_log('    Filter Kernel : ' + str(self.img_filter_kernel[i]) )
-            img = f.Execute(img)
+            if self.use_gpu and self.img_filter_name[i] == 'Median':
+                # run of consecutive Median filters - image stays on the GPU between them
+                j = i
+                while j < len(self.img_filter_name) and self.img_filter_name[j] == 'Median':
+                    j += 1
+                img_f = _median_filter_gpu(img, self.img_filter_kernel[i:j])
+                if img_f is not None:
+                    img = img_f
+                    i = j
+                    continue
+            # fall back to the sitk filter if the GPU filter did not run
+            img = self.new_filter(i).Execute(img)
+            i += 1
             
-        self.filtered_img = img
-        
-        return self.filtered_img
+        return img
     
     
     
@@ -5312,52 +4968,18 @@ class ImageFilterPipeline(object):
         minMax = sitk.MinimumMaximumImageFilter()
         minMax.Execute(self.img)
         
-        # cast with numpy - as sitk casting has weird rounding errors..?
-        filtered_img_np = sitk.GetArrayFromImage(self.filtered_img)
-        
         # first rescale the pixel values to those in the original matrix
         # THIS IS NEEDED as sometimes the rescaling produces values above or below
         # the ORIGINAL IMAGE - clearly this is an error, so just crop the pixel values
-        # check the number of pixels below the Minimum for example:
-        #np.count_nonzero(filtered_img_np < minMax.GetMinimum())
-        
-        filtered_img_np[ 
-            filtered_img_np < 
-            minMax.GetMinimum() ] = minMax.GetMinimum()
-        
-        filtered_img_np[ 
-            filtered_img_np > 
-            minMax.GetMaximum() ] = minMax.GetMaximum()
-        
-        # NO NEED TO CAST - this is incorrect as if one pixel is aberrantly set below
-        # 0 by a long way, this permeates into this casting, where the 0 pixels are
-        # artifically pushed up
-        #self.filtered_img_cast = np.interp(
-        #    filtered_img_np, 
-        #    ( filtered_img_np.min(), filtered_img_np.max() ), 
-        #    ( minMax.GetMinimum(), minMax.GetMaximum() ) 
-        #        )
-        
-        # then CONVERT matrix to correct datatype
-        if self.img.GetPixelIDTypeAsString() == '16-bit signed integer':
-            filtered_img_np = filtered_img_np.astype('int16')
-            
-        elif self.img.GetPixelIDTypeAsString() == '8-bit signed integer':
-            filtered_img_np = filtered_img_np.astype('int8')
-            
-        elif self.img.GetPixelIDTypeAsString() == '8-bit unsigned integer':
-            filtered_img_np = filtered_img_np.astype('uint8')
-            
-        elif self.img.GetPixelIDTypeAsString() == '16-bit unsigned integer':
-            filtered_img_np = filtered_img_np.astype('uint16')
-            
-        else: # default cast to unsigned 16-bit
-            filtered_img_np = filtered_img_np.astype('uint16')
-        
-        # discard the np array
-        #filtered_img_np = None
         
-        self.filtered_img = filtered_img_np
+        # clamp AND convert to correct datatype in one native pass - default 
+         # unsigned 16-bit : pixels are bounded to the original min/max before
+         # conversion, so overshoot pixels cannot wrap around in the cast
+        self.filtered_img = sitk.Clamp(self.filtered_img, 
+              outputPixelType=_PIXEL_TYPE_SITK_ID.get(
+                  self.img.GetPixelIDTypeAsString(), sitk.sitkUInt16), 
+              lowerBound=minMax.GetMinimum(), 
+              upperBound=minMax.GetMaximum() )
         
     
     
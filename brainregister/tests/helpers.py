@@ -0,0 +1,27 @@
+"""
+Shared helpers for the brainregister tests.
+"""
+
+import logging
+
+from brainregister import BrainRegister
+
+
+def make_brainregister(brp=None, **attrs):
+    '''
+    BrainRegister without loading a parameters file - for testing its helpers
+    
+    __init__ is not run : only the brp dict, a logger and the empty worker 
+    pool & cache attributes are set, then any other attributes in attrs.
+    '''
+    br = BrainRegister.__new__(BrainRegister)
+    br.brp = {} if brp is None else dict(brp)
+    br._log = logging.getLogger('brainregister.tests')
+    br._ds_pool = None
+    br._save_executor = None
+    br._save_future = None
+    br._filter_cache = {}
+    br._pm_files_exist = {}
+    for name, value in attrs.items():
+        setattr(br, name, value)
+    return br
@@ -0,0 +1,147 @@
+"""
+Tests BrainRegister._ds_resample() - the native resampler used for the raw <->
+downsampled scaling parameter maps - against transformix on a small synthetic 
+volume.
+"""
+
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+import SimpleITK as sitk
+
+import brainregister
+from brainregister.tests.helpers import make_brainregister
+
+
+class TestPmInterpolationOrder(unittest.TestCase):
+    
+    def test_default_order(self):
+        # elastix default - a pm without the key must not raise KeyError
+        self.assertEqual(brainregister._pm_interpolation_order({}), 3)
+    
+    def test_order_formats(self):
+        for value, order in (('0', 0), ('0.000000', 0), ('1.000000', 1), ('3', 3)):
+            self.assertEqual(brainregister._pm_interpolation_order(
+                                {'FinalBSplineInterpolationOrder': (value,)}), order)
+
+
+class TestTransposeDirection(unittest.TestCase):
+    
+    def test_transpose(self):
+        self.assertEqual(brainregister._transpose_direction(list(range(9))), 
+                         [0, 3, 6, 1, 4, 7, 2, 5, 8])
+
+
+class TestDsResample(unittest.TestCase):
+    
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.br = make_brainregister()
+        # smooth x,y,z = 20,16,12 volume of whole numbers - so nearest neighbour 
+         # results are exact whatever pixel type transformix returns
+        rng = np.random.default_rng(0)
+        img = sitk.GetImageFromArray(rng.random((12, 16, 20)).astype(np.float32))
+        img = sitk.SmoothingRecursiveGaussian(img, 2.0)
+        img = sitk.Round(sitk.RescaleIntensity(img, 0.0, 1000.0))
+        self.img = sitk.Cast(img, sitk.sitkFloat32)
+    
+    def tearDown(self):
+        self.tmp.cleanup()
+    
+    def _scaling_pm(self, order):
+        pm = brainregister._make_scaling_pm({'x-um': 2.0, 'y-um': 2.0, 'z-um': 2.0}, 
+                                            (10, 8, 6), 'nrrd')[0]
+        pm['FinalBSplineInterpolationOrder'] = (str(order),)
+        return pm
+    
+    def _affine_pm(self, order):
+        # small rotation about z with a translation and centre of rotation
+        c, s = np.cos(0.1), np.sin(0.1)
+        pm = self._scaling_pm(order)
+        pm['TransformParameters'] = tuple( '%.6f' % v for v in 
+                    (c, -s, 0.0, s, c, 0.0, 0.0, 0.0, 1.0, 1.5, -0.5, 0.25) )
+        pm['CenterOfRotationPoint'] = ('9.500000', '7.500000', '5.500000')
+        pm['Size'] = ('20.000000', '16.000000', '12.000000')
+        return pm
+    
+    def _direction_pm(self, order):
+        # identity transform onto a grid with a cyclic axis permutation - a
+         # NON-SYMMETRIC direction, stored column-major as elastix writes it.
+         # Physical x,y,z = k,i,j, so size i,j,k = 16,12,20 covers the image
+        direction = (0.0, 0.0, 1.0, 1.0, 0.0, 0.0, 0.0, 1.0, 0.0) # row-major
+        pm = self._scaling_pm(order)
+        pm['TransformParameters'] = tuple( '%.6f' % v for v in 
+                    (1, 0, 0, 0, 1, 0, 0, 0, 1, 0, 0, 0) )
+        pm['Size'] = ('16.000000', '12.000000', '20.000000')
+        pm['Origin'] = ('0.500000', '0.250000', '0.000000')
+        pm['Direction'] = tuple( '%.6f' % v for v in 
+                                 brainregister._transpose_direction(direction) )
+        return pm, direction
+    
+    def _transformix(self, pm):
+        tf = sitk.TransformixImageFilter()
+        tf.LogToConsoleOff()
+        tf.SetOutputDirectory(self.tmp.name)
+        tf.SetTransformParameterMap(pm)
+        tf.SetMovingImage(self.img)
+        tf.Execute()
+        return tf.GetResultImage()
+    
+    def assertMatchesTransformix(self, pm, atol):
+        img = self.br._ds_resample(self.img, [pm])
+        self.assertIsNotNone(img)
+        ref = self._transformix(pm)
+        self.assertEqual(img.GetSize(), ref.GetSize())
+        np.testing.assert_allclose(img.GetOrigin(), ref.GetOrigin())
+        np.testing.assert_allclose(img.GetSpacing(), ref.GetSpacing())
+        np.testing.assert_allclose(img.GetDirection(), ref.GetDirection(), atol=1e-6)
+        np.testing.assert_allclose(
+                sitk.GetArrayFromImage(img).astype(np.float64), 
+                sitk.GetArrayFromImage(ref).astype(np.float64), atol=atol )
+    
+    def test_scaling(self):
+        # atol 1 allows for transformix rounding to an integer pixel type
+        for order, atol in ((0, 0.0), (1, 1.0), (3, 1.0)):
+            with self.subTest(order=order):
+                self.assertMatchesTransformix(self._scaling_pm(order), atol)
+    
+    def test_affine(self):
+        for order, atol in ((0, 0.0), (1, 1.0), (3, 1.0)):
+            with self.subTest(order=order):
+                self.assertMatchesTransformix(self._affine_pm(order), atol)
+    
+    def test_direction(self):
+        for order, atol in ((0, 0.0), (1, 1.0), (3, 1.0)):
+            with self.subTest(order=order):
+                pm, direction = self._direction_pm(order)
+                self.assertMatchesTransformix(pm, atol)
+                img = self.br._ds_resample(self.img, [pm])
+                np.testing.assert_allclose(img.GetDirection(), direction, atol=1e-6)
+    
+    def test_non_affine_uses_transformix(self):
+        pm = self._scaling_pm(3)
+        self.assertIsNone(self.br._ds_resample(self.img, [pm, pm]))
+        pm['Transform'] = ('BSplineTransform',)
+        self.assertIsNone(self.br._ds_resample(self.img, [pm]))
+    
+    def test_initial_transform_uses_transformix(self):
+        # a chained pm cannot be applied without its initial transform
+        pm = self._scaling_pm(3)
+        pm['InitialTransformParametersFileName'] = ('affine.txt',)
+        self.assertIsNone(self.br._ds_resample(self.img, [pm]))
+    
+    def test_only_scaling_pms_resampled(self):
+        # registration output - even a single affine pm - goes through transformix
+        pm = self._scaling_pm(3)
+        with mock.patch.object(self.br, '_ds_resample', 
+                               wraps=self.br._ds_resample) as ds_resample:
+            self.br.transform_image(self.img, [pm])
+            ds_resample.assert_not_called()
+            self.br.transform_image(self.img, [pm], scaling=True)
+            ds_resample.assert_called_once()
+
+
+if __name__ == '__main__':
+    unittest.main()
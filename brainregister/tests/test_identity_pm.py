@@ -0,0 +1,87 @@
+"""
+Tests the identity parameter maps written when source and target templates are
+the same file - they must sit on the fixed template grid in registration space.
+"""
+
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import SimpleITK as sitk
+
+import brainregister
+from brainregister.tests.helpers import make_brainregister
+
+
+class TestIdentityPm(unittest.TestCase):
+    
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        # template with non-unit spacing, an origin and a cyclic axis permutation
+         # direction - NON-SYMMETRIC, so a transposed Direction is caught
+        rng = np.random.default_rng(0)
+        img = sitk.GetImageFromArray(
+                    rng.integers(0, 1000, size=(5, 6, 7)).astype(np.uint16) )
+        img.SetSpacing((0.5, 0.5, 2.0))
+        img.SetOrigin((1.5, -2.0, 3.0))
+        img.SetDirection((0.0, 0.0, 1.0, 1.0, 0.0, 0.0, 0.0, 1.0, 0.0))
+        self.template_path = os.path.join(self.tmp.name, 'template.nrrd')
+        sitk.WriteImage(img, self.template_path)
+        
+        self.br = make_brainregister(
+                    _ds_mode = brainregister._DS_NONE, 
+                    source_template_path = self.template_path, 
+                    target_template_path = self.template_path, 
+                    src_tar_ep = [ {'ResultImagePixelType': ('float',), 
+                                    'ResultImageFormat': ('nii',)} ], 
+                    src_tar_pm_paths = [ os.path.join(self.tmp.name, f) 
+                                         for f in ('affine.txt', 'bspline.txt') ] )
+    
+    def tearDown(self):
+        self.tmp.cleanup()
+    
+    def _written_pms(self):
+        self.br._register_templates('source', 'target')
+        self.assertTrue(self.br._pm_files_exist['src_tar'])
+        return [ sitk.ReadParameterFile(p) for p in self.br.src_tar_pm_paths ]
+    
+    def test_fixed_image_geometry(self):
+        reader = sitk.ImageFileReader()
+        reader.SetFileName(self.template_path)
+        reader.ReadImageInformation()
+        for pm in self._written_pms():
+            np.testing.assert_allclose([float(v) for v in pm['Size']], reader.GetSize())
+            np.testing.assert_allclose([float(v) for v in pm['Spacing']], (1.0, 1.0, 1.0))
+            np.testing.assert_allclose([float(v) for v in pm['Origin']], reader.GetOrigin())
+            # elastix Direction is column-major
+            np.testing.assert_allclose( 
+                    brainregister._transpose_direction([float(v) for v in pm['Direction']]), 
+                    reader.GetDirection() )
+            np.testing.assert_allclose([float(v) for v in pm['TransformParameters']], 
+                                       (1, 0, 0, 0, 1, 0, 0, 0, 1, 0, 0, 0))
+            self.assertEqual(tuple(pm['ResultImagePixelType']), ('float',))
+            self.assertEqual(tuple(pm['ResultImageFormat']), ('nii',))
+    
+    def test_transform_is_identity(self):
+        # transformix with the written pms returns the template unchanged
+        pms = self._written_pms()
+        img = self.br.load_image(self.template_path)
+        tf = sitk.TransformixImageFilter()
+        tf.LogToConsoleOff()
+        tf.SetOutputDirectory(self.tmp.name)
+        tf.SetTransformParameterMap(pms[0])
+        tf.AddTransformParameterMap(pms[1])
+        tf.SetMovingImage(img)
+        tf.Execute()
+        img_t = tf.GetResultImage()
+        self.assertEqual(img_t.GetSize(), img.GetSize())
+        np.testing.assert_allclose(img_t.GetOrigin(), img.GetOrigin(), atol=1e-5)
+        np.testing.assert_allclose(img_t.GetDirection(), img.GetDirection(), atol=1e-5)
+        np.testing.assert_allclose(
+                sitk.GetArrayFromImage(img_t).astype(np.float64), 
+                sitk.GetArrayFromImage(img).astype(np.float64), atol=0.5 )
+
+
+if __name__ == '__main__':
+    unittest.main()
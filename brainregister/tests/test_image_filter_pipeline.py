@@ -0,0 +1,87 @@
+"""
+Tests for ImageFilterPipeline - filter string parsing and thread safety.
+"""
+
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import SimpleITK as sitk
+
+from brainregister import ImageFilterPipeline
+from brainregister.tests.helpers import make_brainregister
+
+
+class TestImageFilterPipeline(unittest.TestCase):
+    
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.images = [ sitk.GetImageFromArray(
+                            rng.integers(0, 1000, size=(8, 9, 10)).astype(np.uint16) ) 
+                        for i in range(8) ]
+    
+    def test_parse_filter_string(self):
+        pipeline = ImageFilterPipeline('M,1,1,0-E,2,2,2-G,1,1,1-GH,10,10,4')
+        self.assertEqual(pipeline.img_filter_name, 
+                         ['Median', 'Mean', 'Gaussian', 'Gaussian-High-Pass'])
+        self.assertEqual(pipeline.img_filter_kernel, 
+                         [(1, 1, 0), (2, 2, 2), (1, 1, 1), (10, 10, 4)])
+    
+    def test_new_filter_per_call(self):
+        # filters are never shared between calls
+        pipeline = ImageFilterPipeline('M,1,1,1')
+        flt = pipeline.new_filter(0)
+        self.assertIsInstance(flt, sitk.MedianImageFilter)
+        self.assertEqual(tuple(flt.GetRadius()), (1, 1, 1))
+        self.assertIsNot(flt, pipeline.new_filter(0))
+    
+    def test_filter_image_matches_sitk(self):
+        pipeline = ImageFilterPipeline('M,1,2,1-E,1,1,0')
+        ref = sitk.Mean(sitk.Median(self.images[0], (1, 2, 1)), (1, 1, 0))
+        np.testing.assert_array_equal(
+                sitk.GetArrayViewFromImage(pipeline.filter_image(self.images[0])), 
+                sitk.GetArrayViewFromImage(ref) )
+    
+    def test_concurrent_filter_image(self):
+        # one pipeline shared by several threads gives the serial results
+        pipeline = ImageFilterPipeline('M,1,1,1-E,1,1,0-G,1,1,1')
+        serial = [ pipeline.filter_image(img) for img in self.images ]
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            parallel = list(pool.map(pipeline.filter_image, self.images))
+        for s, p in zip(serial, parallel):
+            np.testing.assert_array_equal(sitk.GetArrayViewFromImage(s), 
+                                          sitk.GetArrayViewFromImage(p))
+
+
+
+class TestComputeAdaptiveFilter(unittest.TestCase):
+    
+    def setUp(self):
+        self.br = make_brainregister()
+        rng = np.random.default_rng(0)
+        self.images = [ sitk.GetImageFromArray(
+                            rng.integers(0, 1000, size=(8, 9, 10)).astype(np.uint16) ) 
+                        for i in range(8) ]
+    
+    def test_memoized(self):
+        pipeline = self.br.compute_adaptive_filter('brainregister:autofl-filter')
+        self.assertIs(pipeline, self.br.compute_adaptive_filter('brainregister:autofl-filter'))
+        self.assertEqual(pipeline.img_filter_name, ['Median'])
+        self.assertIsNone(self.br.compute_adaptive_filter('none'))
+    
+    def test_memoized_pipeline_from_threads(self):
+        # the memoized pipeline applied from several threads gives the serial results
+        pipeline = self.br.compute_adaptive_filter('M,1,1,1-G,1,1,1')
+        serial = [ self.br.apply_adaptive_filter(img, pipeline) for img in self.images ]
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            parallel = list(pool.map(
+                lambda img: self.br.apply_adaptive_filter(
+                                img, self.br.compute_adaptive_filter('M,1,1,1-G,1,1,1')), 
+                self.images ))
+        for s, p in zip(serial, parallel):
+            np.testing.assert_array_equal(sitk.GetArrayViewFromImage(s), 
+                                          sitk.GetArrayViewFromImage(p))
+
+
+if __name__ == '__main__':
+    unittest.main()
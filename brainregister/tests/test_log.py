@@ -0,0 +1,61 @@
+"""
+Tests the brainregister log file - per instance loggers, and close().
+"""
+
+import logging
+import os
+import tempfile
+import unittest
+
+from brainregister.tests.helpers import make_brainregister
+
+
+class TestLog(unittest.TestCase):
+    
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.yaml_path = os.path.join(self.tmp.name, 'brainregister_parameters.yaml')
+        self.log_path = os.path.join(self.tmp.name, 'brainregister.log')
+    
+    def tearDown(self):
+        self.tmp.cleanup()
+    
+    def _open(self):
+        br = make_brainregister(yaml_path=self.yaml_path, _verbose=False)
+        br.set_brainregister_log_filepath(self.yaml_path)
+        return br
+    
+    def _read_log(self):
+        with open(self.log_path) as f:
+            return f.read()
+    
+    def test_close_releases_logger(self):
+        br = self._open()
+        name = br._log.name
+        br.print_and_log('first')
+        br.close()
+        self.assertIsNone(br._log)
+        self.assertNotIn(name, logging.Logger.manager.loggerDict)
+        self.assertIn('\nfirst', self._read_log())
+    
+    def test_log_after_close_appends(self):
+        br = self._open()
+        br.print_and_log('first')
+        br.close()
+        br.print_and_log('second')
+        br.close()
+        self.assertEqual(self._read_log(), '\nfirst\nsecond')
+    
+    def test_instances_on_same_log(self):
+        # a second instance on the same log file does not mute the first
+        br1 = self._open()
+        br2 = self._open()
+        self.assertNotEqual(br1._log.name, br2._log.name)
+        self.assertTrue(br1._log.handlers)
+        br1.print_and_log('one')
+        br1.close()
+        br2.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
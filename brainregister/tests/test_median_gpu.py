@@ -0,0 +1,67 @@
+"""
+Tests the cuCIM GPU median filter against the SimpleITK median filter.
+
+Skipped unless cupy and cucim are installed and a CUDA GPU is available - install with : pip install brainregister[gpu]
+"""
+
+import importlib.util
+import unittest
+
+import numpy as np
+import SimpleITK as sitk
+
+import brainregister
+
+_HAS_GPU_LIBS = all(importlib.util.find_spec(m) is not None 
+                    for m in ('cupy', 'cucim'))
+
+
+@unittest.skipUnless(_HAS_GPU_LIBS, 'cupy and cucim not installed')
+class TestMedianFilterGpu(unittest.TestCase):
+    
+    def setUp(self):
+        # small x,y,z = 9,8,7 volume of random values - with an odd size and 
+         # non-cubic radii, errors in axis order or border handling show up
+        rng = np.random.default_rng(0)
+        self.img = sitk.GetImageFromArray(
+                        rng.integers(0, 1000, size=(7, 8, 9)).astype(np.uint16) )
+        self.img.SetOrigin((1.0, 2.0, 3.0))
+    
+    def _sitk_median(self, radii):
+        img = self.img
+        for radius in radii:
+            img = sitk.Median(img, radius)
+        return img
+    
+    def _gpu_median(self, radii):
+        img = brainregister._median_filter_gpu(self.img, radii)
+        if img is None:
+            self.skipTest('CUDA GPU not available')
+        return img
+    
+    def assertImagesEqual(self, img, ref):
+        np.testing.assert_array_equal(sitk.GetArrayViewFromImage(img), 
+                                      sitk.GetArrayViewFromImage(ref))
+        self.assertEqual(img.GetOrigin(), ref.GetOrigin())
+        self.assertEqual(img.GetSpacing(), ref.GetSpacing())
+    
+    def test_single_radius(self):
+        radii = [(1, 2, 3)]
+        self.assertImagesEqual(self._gpu_median(radii), self._sitk_median(radii))
+    
+    def test_repeated_radii(self):
+        radii = [(2, 2, 2), (1, 1, 1)]
+        self.assertImagesEqual(self._gpu_median(radii), self._sitk_median(radii))
+    
+    def test_borders(self):
+        # radius larger than half the image - every voxel sees the border
+        radii = [(4, 4, 3)]
+        gpu = sitk.GetArrayViewFromImage(self._gpu_median(radii))
+        ref = sitk.GetArrayViewFromImage(self._sitk_median(radii))
+        for face in (np.s_[0], np.s_[-1], np.s_[:, 0], np.s_[:, -1], 
+                     np.s_[:, :, 0], np.s_[:, :, -1]):
+            np.testing.assert_array_equal(gpu[face], ref[face])
+
+
+if __name__ == '__main__':
+    unittest.main()
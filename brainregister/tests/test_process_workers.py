@@ -0,0 +1,140 @@
+"""
+Tests that images processed by a worker pool match images processed serially.
+
+Each workers key runs the same synthetic images through 
+BrainRegister._process_ds_all() serially and with 4 workers : anno-workers & 
+downsampling-workers filter with a single shared ImageFilterPipeline as the 
+downsampling step does, and transform-workers runs transform_image() - so 
+transformix - in each worker.  Both runs must write the same files with the 
+same pixel data.
+"""
+
+import functools
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import SimpleITK as sitk
+
+import brainregister
+from brainregister import ImageFilterPipeline
+from brainregister.tests.helpers import make_brainregister
+
+
+class TestProcessWorkers(unittest.TestCase):
+    
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        rng = np.random.default_rng(0)
+        self.images = [ sitk.GetImageFromArray(
+                            rng.integers(0, 1000, size=(8, 9, 10)).astype(np.uint16) ) 
+                        for i in range(7) ]
+        self.pipeline = ImageFilterPipeline('M,1,1,1-E,1,1,0')
+    
+    def tearDown(self):
+        self.tmp.cleanup()
+    
+    def _filter(self, br, img):
+        return br.apply_adaptive_filter(img, self.pipeline)
+    
+    def _transform(self, br, img):
+        # registration output pms - not flagged as scaling, so transform_image()
+         # runs transformix : a rotation about z chained with a scaling
+        c, s = np.cos(0.1), np.sin(0.1)
+        affine = brainregister._make_scaling_pm({'x-um': 1.0, 'y-um': 1.0, 'z-um': 1.0}, 
+                                                (10, 9, 8), 'nrrd')[0]
+        affine['TransformParameters'] = tuple( '%.6f' % v for v in 
+                    (c, -s, 0.0, s, c, 0.0, 0.0, 0.0, 1.0, 0.5, -0.5, 0.0) )
+        affine['CenterOfRotationPoint'] = ('4.500000', '4.000000', '3.500000')
+        scaling = brainregister._make_scaling_pm({'x-um': 2.0, 'y-um': 2.0, 'z-um': 2.0}, 
+                                                 (5, 4, 4), 'nrrd')[0]
+        return br.transform_image(img, [affine, scaling])
+    
+    def _run(self, workers_key, workers, transform):
+        out_dir = os.path.join(self.tmp.name, workers_key + str(workers))
+        os.makedirs(out_dir)
+        br = make_brainregister({workers_key: workers})
+        
+        def get(index):
+            return transform(br, self.images[index])
+        
+        def save(index, img):
+            br.save_image(img, os.path.join(out_dir, 'img%d.nrrd' % index))
+        
+        br._process_ds_all(functools.partial(br._transform_save, get, save, 'image'), 
+                           list(range(len(self.images))), workers_key)
+        br._shutdown_ds_pool()
+        return out_dir
+    
+    def _check_workers(self, workers_key, transform):
+        serial_dir = self._run(workers_key, 1, transform)
+        parallel_dir = self._run(workers_key, 4, transform)
+        names = sorted(os.listdir(serial_dir))
+        self.assertEqual(len(names), len(self.images))
+        self.assertEqual(names, sorted(os.listdir(parallel_dir)))
+        for name in names:
+            serial = sitk.ReadImage(os.path.join(serial_dir, name))
+            parallel = sitk.ReadImage(os.path.join(parallel_dir, name))
+            np.testing.assert_array_equal(sitk.GetArrayViewFromImage(serial), 
+                                          sitk.GetArrayViewFromImage(parallel))
+            self.assertEqual(serial.GetPixelID(), parallel.GetPixelID())
+    
+    def test_anno_workers(self):
+        self._check_workers('anno-workers', self._filter)
+    
+    def test_downsampling_workers(self):
+        self._check_workers('downsampling-workers', self._filter)
+    
+    def test_transform_workers(self):
+        # concurrent TransformixImageFilter runs in the worker threads
+        self._check_workers('transform-workers', self._transform)
+
+
+
+class TestProcessErrors(unittest.TestCase):
+    
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.img = sitk.Image(4, 4, 4, sitk.sitkUInt16)
+        # a write to a missing directory fails in the background save thread
+        self.bad_path = os.path.join(self.tmp.name, 'missing', 'img.nrrd')
+    
+    def tearDown(self):
+        self.tmp.cleanup()
+    
+    def test_serial_write_error_raised(self):
+        br = make_brainregister()
+        with self.assertRaises(RuntimeError):
+            br._process_ds_all(lambda i: br.save_image(self.img, self.bad_path), 
+                               [0], 'downsampling-workers')
+        self.assertIsNone(br._save_executor)
+    
+    def test_serial_process_error_not_masked(self):
+        # the processing error is raised - not the failed write before it
+        br = make_brainregister()
+        def process(i):
+            if i == 0:
+                br.save_image(self.img, self.bad_path)
+            else:
+                raise ValueError('process failed')
+        with self.assertRaises(ValueError):
+            br._process_ds_all(process, [0, 1], 'downsampling-workers')
+        self.assertIsNone(br._save_executor)
+        self.assertIsNone(br._save_future)
+    
+    def test_parallel_error_raised(self):
+        br = make_brainregister({'downsampling-workers': 2})
+        def process(i):
+            if i == 3:
+                raise ValueError('process failed')
+        try:
+            with self.assertRaises(ValueError):
+                br._process_ds_all(process, list(range(4)), 'downsampling-workers')
+        finally:
+            br._shutdown_ds_pool()
+        self.assertIsNone(br._ds_pool)
+
+
+if __name__ == '__main__':
+    unittest.main()
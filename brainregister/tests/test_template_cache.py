@@ -0,0 +1,153 @@
+"""
+Tests for the brainregister template cache - cache keys and eviction.
+"""
+
+import os
+import tempfile
+import time
+import unittest
+
+import brainregister
+from brainregister import ImageFilterPipeline
+from brainregister.tests.helpers import make_brainregister
+
+
+def _ds_brainregister(**brp):
+    # BrainRegister with only the brp keys the cache helpers read
+    return make_brainregister( dict( {
+                'downsampling-filter': 'brainregister:downsampling-adaptive-filter',
+                'downsampling-filter-gpu': False }, **brp) )
+
+
+class TestTemplateDsCacheKey(unittest.TestCase):
+    
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.template = os.path.join(self.tmp.name, 'template.nrrd')
+        with open(self.template, 'wb') as f:
+            f.write(b'template')
+        self.pm = {'Spacing': ('1.000000',)*3, 'Size': ('10', '12', '14'), 
+                   'TransformParameters': ('0.5',)*12}
+        self.cache_dir = os.path.join(self.tmp.name, 'cache')
+    
+    def tearDown(self):
+        self.tmp.cleanup()
+    
+    def _path(self, br, pm):
+        return br._template_ds_cache_path(self.template, [pm])
+    
+    def test_disabled(self):
+        br = _ds_brainregister(**{'template-cache-dir': False})
+        self.assertIsNone(self._path(br, self.pm))
+    
+    def test_same_settings_same_key(self):
+        br = _ds_brainregister(**{'template-cache-dir': self.cache_dir})
+        self.assertEqual(self._path(br, self.pm), self._path(br, dict(self.pm)))
+    
+    def test_filter_changes_key(self):
+        br = _ds_brainregister(**{'template-cache-dir': self.cache_dir})
+        path = self._path(br, self.pm)
+        br.brp['downsampling-filter'] = 'none'
+        self.assertNotEqual(path, self._path(br, self.pm))
+        br.brp['downsampling-filter-gpu'] = True
+        self.assertNotEqual(path, self._path(br, self.pm))
+    
+    def test_resolution_changes_key(self):
+        br = _ds_brainregister(**{'template-cache-dir': self.cache_dir})
+        path = self._path(br, self.pm)
+        pm = dict(self.pm, TransformParameters=('0.25',)*12, Size=('5', '6', '7'))
+        self.assertNotEqual(path, self._path(br, pm))
+    
+    def test_template_rewrite_changes_key(self):
+        br = _ds_brainregister(**{'template-cache-dir': self.cache_dir})
+        path = self._path(br, self.pm)
+        with open(self.template, 'wb') as f:
+            f.write(b'new template')
+        self.assertNotEqual(path, self._path(br, self.pm))
+
+
+class TestPruneCacheDir(unittest.TestCase):
+    
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        now = time.time()
+        for i in range(5): # cache0.nrrd is the oldest
+            path = os.path.join(self.tmp.name, 'cache%d.nrrd' % i)
+            with open(path, 'wb') as f:
+                f.write(b'x')
+            os.utime(path, (now - 100 + i, now - 100 + i))
+    
+    def tearDown(self):
+        self.tmp.cleanup()
+    
+    def test_evicts_least_recently_used(self):
+        brainregister._prune_cache_dir(self.tmp.name, 3)
+        self.assertEqual(sorted(os.listdir(self.tmp.name)), 
+                         ['cache2.nrrd', 'cache3.nrrd', 'cache4.nrrd'])
+    
+    def test_zero_is_unbounded(self):
+        brainregister._prune_cache_dir(self.tmp.name, 0)
+        self.assertEqual(len(os.listdir(self.tmp.name)), 5)
+
+
+
+class TestTemplateFiltCacheKey(unittest.TestCase):
+    
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.br = _ds_brainregister(**{'template-cache-dir': 
+                                        os.path.join(self.tmp.name, 'cache')})
+        self.br.downsampling_img = 'none'
+        self.br.source_template_path = os.path.join(self.tmp.name, 'template.nrrd')
+        with open(self.br.source_template_path, 'wb') as f:
+            f.write(b'template')
+    
+    def tearDown(self):
+        self.tmp.cleanup()
+    
+    def _path(self, filter_string, pipeline):
+        return self.br._template_filt_cache_path('source', filter_string, pipeline)
+    
+    def test_same_settings_same_key(self):
+        self.assertEqual(self._path('M,4,4,4', ImageFilterPipeline('M,4,4,4')), 
+                         self._path('M,4,4,4', ImageFilterPipeline('M,4,4,4')))
+    
+    def test_filter_changes_key(self):
+        self.assertNotEqual(self._path('M,4,4,4', ImageFilterPipeline('M,4,4,4')), 
+                            self._path('M,2,2,2', ImageFilterPipeline('M,2,2,2')))
+    
+    def test_resolved_filter_changes_key(self):
+        # a named filter that resolves to different kernels gets a new key
+        name = 'brainregister:autofl-filter'
+        self.assertNotEqual(self._path(name, ImageFilterPipeline('M,4,4,4')), 
+                            self._path(name, ImageFilterPipeline('M,3,3,3')))
+    
+    def test_gpu_changes_key(self):
+        pipeline = ImageFilterPipeline('M,4,4,4')
+        path = self._path('M,4,4,4', pipeline)
+        pipeline.use_gpu = True
+        self.assertNotEqual(path, self._path('M,4,4,4', pipeline))
+    
+    def test_downsampling_changes_key(self):
+        # a template filtered in downsampled space is keyed on the ds pm file
+         # and the downsampling filter settings too
+        pipeline = ImageFilterPipeline('M,4,4,4')
+        path = self._path('M,4,4,4', pipeline)
+        self.br.downsampling_img = 'source'
+        self.br._ds_mode = brainregister._DS_SOURCE
+        self.br.source_template_path_ds = self.br.source_template_path
+        pm_path = os.path.join(self.tmp.name, 'ds_pm.txt')
+        with open(pm_path, 'w') as f:
+            f.write('(Spacing 1.0 1.0 1.0)')
+        self.br.src_tar_ds_pm_path = [pm_path]
+        ds_path = self._path('M,4,4,4', pipeline)
+        self.assertNotEqual(path, ds_path)
+        self.br.brp['downsampling-filter'] = 'none'
+        self.assertNotEqual(ds_path, self._path('M,4,4,4', pipeline))
+        with open(pm_path, 'w') as f:
+            f.write('(Spacing 2.50 2.50 2.50)')
+        self.assertNotEqual(ds_path, self._path('M,4,4,4', pipeline))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -31,9 +31,18 @@ setuptools.setup(
           'simpleitk-simpleelastix>=2.0.0rc2.dev908',
           'numpy>=1.19.2',
           'pyyaml>=6.0',
+          'ruamel.yaml>=0.17',
           'pynrrd>=0.4.2',
           'matplotlib>=3.5.1',
       ],
+    
+    # OPTIONAL dependencies - install with : pip install brainregister[gpu]
+     # gpu : median filters on a CUDA GPU - see downsampling-filter-gpu & 
+     # prefilter-gpu in brainregister_parameters.yaml.  Install the cupy wheel
+     # built for your CUDA version (eg. cupy-cuda12x) if cupy fails to build
+    extras_require={
+          'gpu': ['cupy', 'cucim'],
+      },
       
     # test suite
     test_suite='nose.collector',